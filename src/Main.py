@@ -1,70 +1,15 @@
 from ast import Dict
-import logging
 import time
+import logging
+import argparse
 import threading
 import configparser
-from influxdb_client import InfluxDBClient
-from influxdb_client.client.write_api import ASYNCHRONOUS
-from gui import MeasurementApp
-from modules.BucketManager import BucketManager
-from modules.DataProcessor import DataProcessor
-from modules.RIPEAtlasAPI import RIPEAtlasAPI
+from modules.Metrics import Metrics
+from modules.SamplingProfiler import SamplingProfiler
+from modules.RetentionPolicies import RetentionPolicies
 from modules.SQLiteManager import SQLiteManager
 
-
-def background_worker(db_manager: SQLiteManager, bucket_manager: BucketManager, data_processor: DataProcessor, ripe_api: RIPEAtlasAPI, influx_client: InfluxDBClient):
-    """
-    Background worker to fetch and process measurement data at regular intervals.
-    
-    @param db_manager: SQLiteManager instance
-    @param bucket_manager: BucketManager instance
-    @param data_processor: DataProcessor instance
-    @param ripe_api: RIPEAtlasAPI instance
-    @param influx_client: InfluxDBClient instance
-    """
-    write_api = influx_client.write_api(write_options=ASYNCHRONOUS)
-    
-    while True:
-        measurements = db_manager.get_measurements()
-        if not measurements:
-            logging.info("No measurements to process. Sleeping for 60 seconds...")
-            time.sleep(60)
-            continue
-
-        for measurement in measurements:
-            try:
-                measurement_id, _, bucket_name, retention_policy, _, measurement_type = measurement[1:7]
-                bucket_manager.ensure_bucket(bucket_name, retention_policy)
-                last_timestamp = db_manager.get_last_processed(measurement_id)
-                results = ripe_api.fetch_measurement_results(measurement_id=int(measurement_id))
-                
-                if results:
-                    new_results = [r for r in results if r.get("timestamp", 0) > last_timestamp]
-                    if new_results:
-                        retention_seconds = {"24 hours": 86400, "7 days": 604800, "14 days": 1209600}.get(retention_policy, 0)
-                        points = []
-                        
-                        logging.info(f"ID: {measurement_id} - preparing data")
-
-                        if measurement_type.lower() in ["ping", "packetloss"]:
-                            points += data_processor.prepare_latency_data_for_influxdb(new_results, retention_seconds)
-                            points += data_processor.prepare_packetloss_data_for_influxdb(new_results, retention_seconds)
-                        elif measurement_type.lower() == "traceroute":
-                            points += data_processor.prepare_traceroute_data_for_influxdb(new_results, retention_seconds)
-                        
-                        for point in points:
-                            write_api.write(bucket=bucket_name, record=point)
-                        
-                        max_timestamp = max(r["timestamp"] for r in new_results)
-                        db_manager.update_last_processed(measurement_id, max_timestamp)
-                        logging.info(f"ID: {measurement_id} processed.")
-                    else:
-                        logging.info(f"ID: {measurement_id} - no new data.")
-            except Exception as e:
-                logging.error(f"Error processing measurement ID {measurement_id}: {e}")
-
-        logging.info("Sleeping for 60 seconds...")
-        time.sleep(60)
+MEASUREMENT_TYPES = ("Ping", "Traceroute", "Packetloss")
 
 
 def load_config(config_file="config/config.ini") -> Dict:
@@ -80,35 +25,485 @@ def load_config(config_file="config/config.ini") -> Dict:
         "influx_url": config.get("InfluxDB", "url"),
         "influx_token": config.get("InfluxDB", "token"),
         "influx_org": config.get("InfluxDB", "org"),
+        "bucket_cache_ttl": config.getfloat("InfluxDB", "bucket_cache_ttl", fallback=300.0),
+        "downsampling_offset": RetentionPolicies.parse_duration(config.get("InfluxDB", "downsampling_offset", fallback="5m")),
+        # parsed once, a malformed policy stops the start instead of surfacing in the workers
+        "retention_policies": RetentionPolicies.from_mapping(dict(config.items("RetentionPolicies")) if config.has_section("RetentionPolicies") else {}),
         "api_key": config.get("RIPEAtlas", "api_key"),
-        "db_path": config.get("Database", "db_path")
+        "ripe_base_url": config.get("RIPEAtlas", "base_url", fallback="") or None,
+        "ripe_pool_size": config.getint("RIPEAtlas", "pool_size", fallback=0),
+        "ripe_max_retries": config.getint("RIPEAtlas", "max_retries", fallback=5),
+        "ripe_backoff_base": config.getfloat("RIPEAtlas", "backoff_base", fallback=1.0),
+        "ripe_backoff_max": config.getfloat("RIPEAtlas", "backoff_max", fallback=60.0),
+        "ripe_rate_limit": config.getfloat("RIPEAtlas", "rate_limit", fallback=10.0),
+        "ripe_rate_burst": config.getint("RIPEAtlas", "rate_burst", fallback=20),
+        "db_path": config.get("Database", "db_path"),
+        "db_busy_timeout": config.getfloat("Database", "busy_timeout", fallback=30.0),
+        "db_cache_size_kib": config.getint("Database", "cache_size_kib", fallback=8192),
+        "db_journal_mode": config.get("Database", "journal_mode", fallback="WAL"),
+        "sharding_enabled": config.getboolean("Sharding", "enabled", fallback=False),
+        "worker_id": config.get("Sharding", "worker_id", fallback="") or None,
+        "lease_ttl": config.getfloat("Sharding", "lease_ttl", fallback=60.0),
+        "max_concurrency": config.getint("Worker", "max_concurrency", fallback=8),
+        "request_timeout": config.getfloat("Worker", "request_timeout", fallback=30.0),
+        "default_interval": config.getint("Worker", "default_interval", fallback=60),
+        "max_jitter": config.getfloat("Worker", "max_jitter", fallback=30.0),
+        "registry_refresh": config.getfloat("Worker", "registry_refresh", fallback=300.0),
+        "late_tolerance": config.getint("Worker", "late_tolerance", fallback=3600),
+        "late_sweep_polls": config.getint("Worker", "late_sweep_polls", fallback=10),
+        "write_batch_size": config.getint("InfluxWriter", "batch_size", fallback=5000),
+        "write_flush_interval": config.getfloat("InfluxWriter", "flush_interval", fallback=1.0),
+        "write_max_retries": config.getint("InfluxWriter", "max_retries", fallback=3),
+        "write_retry_interval": config.getfloat("InfluxWriter", "retry_interval", fallback=1.0),
+        "write_max_jitter": config.getfloat("InfluxWriter", "max_jitter", fallback=0.5),
+        "write_max_pending": config.getint("InfluxWriter", "max_pending", fallback=50000),
+        "spool_path": config.get("Spool", "spool_path", fallback="") or f"{config.get('Database', 'db_path')}-spool",
+        "spool_max_bytes": config.getint("Spool", "max_bytes", fallback=512 * 1024 * 1024),
+        "spool_drain_batch": config.getint("Spool", "drain_batch", fallback=200),
+        "spool_retry_interval": config.getfloat("Spool", "retry_interval", fallback=5.0),
+        "geoip_db_path": config.get("GeoIP", "db_path", fallback=""),
+        "geoip_cache_size": config.getint("GeoIP", "cache_size", fallback=65536),
+        "aggregation_enabled": config.getboolean("Aggregation", "enabled", fallback=False),
+        "aggregation_window": config.getint("Aggregation", "window_seconds", fallback=300),
+        "aggregation_grace": config.getint("Aggregation", "grace_seconds", fallback=60),
+        "aggregation_write_raw": config.getboolean("Aggregation", "write_raw", fallback=True),
+        "aggregation_state_path": config.get("Aggregation", "state_path", fallback="") or f"{config.get('Database', 'db_path')}-aggregation",
+        "packet_enabled": config.getboolean("PacketIngest", "enabled", fallback=False),
+        "packet_per_packet": config.getboolean("PacketIngest", "per_packet", fallback=True),
+        "packet_derived": config.getboolean("PacketIngest", "derived", fallback=True),
+        "metrics_enabled": config.getboolean("Metrics", "enabled", fallback=False),
+        "metrics_host": config.get("Metrics", "host", fallback="127.0.0.1"),
+        "metrics_port": config.getint("Metrics", "port", fallback=9108),
+        "profiler_enabled": config.getboolean("Profiler", "enabled", fallback=False),
+        "profiler_interval": config.getfloat("Profiler", "interval", fallback=0.01),
+        "profiler_output_path": config.get("Profiler", "output_path", fallback="") or None,
+        "profiler_dump_interval": config.getfloat("Profiler", "dump_interval", fallback=60.0),
+        "stream_enabled": config.getboolean("Stream", "enabled", fallback=False),
+        "stream_url": config.get("Stream", "url", fallback="") or None,
+        "stream_batch_interval": config.getfloat("Stream", "batch_interval", fallback=1.0),
+        "stream_batch_size": config.getint("Stream", "batch_size", fallback=1000),
+        "stream_reconnect_delay": config.getfloat("Stream", "reconnect_delay", fallback=1.0),
+        "stream_max_reconnect_delay": config.getfloat("Stream", "max_reconnect_delay", fallback=60.0),
+        "stream_ping_interval": config.getfloat("Stream", "ping_interval", fallback=30.0),
+        "backfill_concurrency": config.getint("Backfill", "concurrency", fallback=4),
+        "backfill_chunk_hours": config.getfloat("Backfill", "chunk_hours", fallback=6.0),
+        "backfill_rate_limit": config.getfloat("Backfill", "rate_limit", fallback=5.0),
+        "backfill_spool_path": config.get("Backfill", "spool_path", fallback="") or None,
+        "rollups_enabled": config.getboolean("Rollups", "enabled", fallback=False),
+        "rollups_path": config.get("Rollups", "path", fallback="") or f"{config.get('Database', 'db_path')}-rollups",
+        "rollups_relative_accuracy": config.getfloat("Rollups", "relative_accuracy", fallback=0.01),
+        "rollups_cache_size": config.getint("Rollups", "cache_size", fallback=1024),
+        "anomaly_enabled": config.getboolean("Anomaly", "enabled", fallback=False),
+        "anomaly_path": config.get("Anomaly", "path", fallback="") or f"{config.get('Database', 'db_path')}-anomaly",
+        "anomaly_alpha": config.getfloat("Anomaly", "alpha", fallback=0.05),
+        "anomaly_threshold": config.getfloat("Anomaly", "threshold", fallback=4.0),
+        "anomaly_warmup": config.getint("Anomaly", "warmup", fallback=20),
+        "anomaly_min_stddev": config.getfloat("Anomaly", "min_stddev", fallback=1.0),
+        "anomaly_loss_window": config.getint("Anomaly", "loss_window", fallback=20),
+        "anomaly_loss_threshold": config.getfloat("Anomaly", "loss_threshold", fallback=0.3),
+        "anomaly_checkpoint_interval": config.getfloat("Anomaly", "checkpoint_interval", fallback=60.0)
     }
 
 
-def main():
+def build_worker(config: Dict, db_manager: SQLiteManager, worker_id: str = None, metrics: Metrics = None):
     """
-    Main function to initialize components and start the background worker and GUI.
+    Initialize all ingest components.
+
+    @param config: Configuration dictionary from load_config
+    @param db_manager: SQLiteManager instance of the measurement registry
+    @param worker_id: Worker ID for sharded operation, overrides the configured one
+    @param metrics: Metrics registry shared by all components, None gives each a private one
+    @return: Tuple of (IngestWorker, WriteSpool), the spool drainer is not started yet
     """
-    config = load_config()
-    
-    logging.info("Initializing components...")
-    db_manager = SQLiteManager(db_path=config["db_path"])
-    bucket_manager = BucketManager(influx_url=config["influx_url"], org=config["influx_org"], token=config["influx_token"])
-    data_processor = DataProcessor()
-    ripe_api = RIPEAtlasAPI(api_key=config["api_key"])
+    # the ingest stack pulls in influxdb_client, requests and NumPy, so it is only imported where a worker runs
+    from influxdb_client import InfluxDBClient
+    from modules.BatchWriter import BatchWriter
+    from modules.BucketManager import BucketManager
+    from modules.DataProcessor import DataProcessor
+    from modules.GeoIPResolver import GeoIPResolver
+    from modules.HTTPTransport import HTTPTransport
+    from modules.IngestWorker import IngestWorker
+    from modules.LeaseManager import LeaseManager
+    from modules.RIPEAtlasAPI import RIPEAtlasAPI
+    from modules.WriteSpool import WriteSpool
+
+    bucket_manager = BucketManager(
+        influx_url=config["influx_url"],
+        org=config["influx_org"],
+        token=config["influx_token"],
+        cache_ttl=config["bucket_cache_ttl"],
+        retention_policies=config["retention_policies"],
+        task_offset=config["downsampling_offset"],
+        late_tolerance=config["late_tolerance"]
+    )
+    geoip_resolver = None
+    if config["geoip_db_path"]:
+        geoip_resolver = GeoIPResolver(config["geoip_db_path"], cache_size=config["geoip_cache_size"])
+    else:
+        logging.warning("No GeoIP database configured, traceroute measurements are not polled until one is configured.")
+    aggregator = None
+    if config["aggregation_enabled"]:
+        from modules.LatencyAggregator import LatencyAggregator  # imports NumPy, only needed with rollups
+        aggregator = LatencyAggregator(
+            window_seconds=config["aggregation_window"],
+            grace_seconds=config["aggregation_grace"],
+            late_tolerance=config["late_tolerance"],
+            state_path=config["aggregation_state_path"],
+            metrics=metrics
+        )
+    packet_processor = None
+    if config["packet_enabled"]:
+        from modules.PacketRTTProcessor import PacketRTTProcessor  # imports NumPy, only needed with per-packet ingestion
+        packet_processor = PacketRTTProcessor(per_packet=config["packet_per_packet"], derived=config["packet_derived"])
+    anomaly_detector = None
+    if config["anomaly_enabled"]:
+        from modules.AnomalyDetector import AnomalyDetector
+        anomaly_detector = AnomalyDetector(
+            config["anomaly_path"],
+            alpha=config["anomaly_alpha"],
+            threshold=config["anomaly_threshold"],
+            warmup=config["anomaly_warmup"],
+            min_stddev=config["anomaly_min_stddev"],
+            loss_window=config["anomaly_loss_window"],
+            loss_threshold=config["anomaly_loss_threshold"],
+            checkpoint_interval=config["anomaly_checkpoint_interval"],
+            metrics=metrics
+        )
+    data_processor = DataProcessor(geoip_resolver=geoip_resolver, aggregator=aggregator, packet_processor=packet_processor, anomaly_detector=anomaly_detector)
+    transport = HTTPTransport(
+        pool_size=config["ripe_pool_size"] or config["max_concurrency"],
+        timeout=config["request_timeout"],
+        max_retries=config["ripe_max_retries"],
+        backoff_base=config["ripe_backoff_base"],
+        backoff_max=config["ripe_backoff_max"],
+        rate_limit=config["ripe_rate_limit"],
+        burst=config["ripe_rate_burst"]
+    )
+    ripe_api = RIPEAtlasAPI(api_key=config["api_key"], transport=transport, base_url=config["ripe_base_url"], metrics=metrics)
     influx_client = InfluxDBClient(url=config["influx_url"], token=config["influx_token"], org=config["influx_org"])
     
+    writer = BatchWriter(
+        influx_client,
+        batch_size=config["write_batch_size"],
+        flush_interval=config["write_flush_interval"],
+        max_retries=config["write_max_retries"],
+        retry_interval=config["write_retry_interval"],
+        max_jitter=config["write_max_jitter"],
+        max_pending=config["write_max_pending"],
+        metrics=metrics
+    )
+    spool = WriteSpool(
+        config["spool_path"], writer,
+        max_bytes=config["spool_max_bytes"],
+        drain_batch=config["spool_drain_batch"],
+        retry_interval=config["spool_retry_interval"],
+        metrics=metrics
+    )
+    result_stream = None
+    if config["stream_enabled"]:
+        from modules.ResultStream import ResultStream  # imports websocket-client, only needed with the stream
+        result_stream = ResultStream(
+            url=config["stream_url"],
+            api_key=config["api_key"],
+            reconnect_delay=config["stream_reconnect_delay"],
+            max_reconnect_delay=config["stream_max_reconnect_delay"],
+            ping_interval=config["stream_ping_interval"]
+        )
+    rollup_store = None
+    if config["rollups_enabled"]:
+        from modules.RollupStore import RollupStore
+        rollup_store = RollupStore(config["rollups_path"], relative_accuracy=config["rollups_relative_accuracy"], cache_size=config["rollups_cache_size"], metrics=metrics)
+        if metrics is not None:
+            metrics.rollups = rollup_store
+    lease_manager = None
+    if config["sharding_enabled"] or worker_id:
+        lease_manager = LeaseManager(db_manager, worker_id=worker_id or config["worker_id"], lease_ttl=config["lease_ttl"])
+    ingest_worker = IngestWorker(
+        db_manager, bucket_manager, data_processor, ripe_api, spool,
+        max_concurrency=config["max_concurrency"],
+        default_interval=config["default_interval"],
+        max_jitter=config["max_jitter"],
+        registry_refresh=config["registry_refresh"],
+        late_tolerance=config["late_tolerance"],
+        late_sweep_polls=config["late_sweep_polls"],
+        write_raw=config["aggregation_write_raw"] or aggregator is None,
+        lease_manager=lease_manager,
+        metrics=metrics,
+        result_stream=result_stream,
+        stream_batch_interval=config["stream_batch_interval"],
+        stream_batch_size=config["stream_batch_size"],
+        rollup_store=rollup_store
+    )
+    return ingest_worker, spool
+
+
+def start_worker(config: Dict, db_manager: SQLiteManager, worker_id: str = None):
+    """
+    Builds the ingest worker and starts the spool drainer, the metrics endpoint and the profiler.
+
+    @param config: Configuration dictionary from load_config
+    @param db_manager: SQLiteManager instance of the measurement registry
+    @param worker_id: Worker ID for sharded operation, overrides the configured one
+    @return: Tuple of (IngestWorker, SamplingProfiler or None), the worker loop is not started yet
+    """
+    metrics = Metrics()
+    ingest_worker, spool = build_worker(config, db_manager, worker_id=worker_id, metrics=metrics)
+
+    profiler = None
+    if config["profiler_enabled"]:
+        profiler = SamplingProfiler(interval=config["profiler_interval"], output_path=config["profiler_output_path"], dump_interval=config["profiler_dump_interval"])
+        metrics.profiler = profiler
+        profiler.start()
+    if config["metrics_enabled"]:
+        metrics.start_server(config["metrics_host"], config["metrics_port"])
+
+    spool.start()
+    return ingest_worker, profiler
+
+
+def run_worker(config: Dict, db_manager: SQLiteManager, worker_id: str = None):
+    """
+    Runs only the ingest worker in the foreground, without tkinter, PIL or a display.
+
+    @param config: Configuration dictionary from load_config
+    @param db_manager: SQLiteManager instance of the measurement registry
+    @param worker_id: Worker ID for sharded operation, overrides the configured one
+    """
+    ingest_worker, profiler = start_worker(config, db_manager, worker_id=worker_id)
     logging.info("------------------Initialization completed------------------")
+    try:
+        ingest_worker.run()
+    except KeyboardInterrupt:
+        logging.info("Worker interrupted.")
+    finally:
+        if profiler is not None:
+            profiler.stop()
+
+
+def run_gui(config: Dict, db_manager: SQLiteManager, with_worker: bool = True):
+    """
+    Runs the GUI, by default with the ingest worker on a background thread.
+
+    @param config: Configuration dictionary from load_config
+    @param db_manager: SQLiteManager instance of the measurement registry
+    @param with_worker: Also run the ingest worker in this process
+    """
+    from gui import MeasurementApp  # tkinter and PIL are only needed with a display
+
+    profiler = None
+    status_source = None
+    worker_thread = None
+    if with_worker:
+        ingest_worker, profiler = start_worker(config, db_manager)
+        worker_thread = threading.Thread(target=ingest_worker.run, name="ingest-worker", daemon=True)
+        worker_thread.start()
+        status_source = ingest_worker.status
+    logging.info("------------------Initialization completed------------------")
+    try:
+        gui_app = MeasurementApp(db_manager=db_manager, retention_policies=config["retention_policies"].names(), status_source=status_source)
+        gui_app.run()
+    finally:
+        if worker_thread is not None:
+            # lets the running measurements finish, checkpoints the anomaly baselines and releases the leases
+            logging.info("GUI closed, stopping the ingest worker.")
+            ingest_worker.stop()
+            worker_thread.join()
+        if profiler is not None:
+            profiler.stop()
+
 
-    worker_thread = threading.Thread(
-        target=background_worker,
-        args=(db_manager, bucket_manager, data_processor, ripe_api, influx_client),
-        daemon=True
+def run_backfill(config: Dict, db_manager: SQLiteManager, measurement_id: str, days: float = None, restart: bool = False) -> bool:
+    """
+    Imports the history of a registered measurement in parallel, resumable chunks.
+
+    Runs next to the workers with its own spool and rate limit, so their live ingestion goes on.
+
+    @param config: Configuration dictionary from load_config
+    @param db_manager: SQLiteManager instance of the measurement registry
+    @param measurement_id: RIPE Atlas measurement ID
+    @param days: Days of history to import, defaults to the retention period of the measurement
+    @param restart: Plan a new backfill instead of resuming the previous one
+    @return: True if the backfill is complete and its data was handed to InfluxDB
+    """
+    measurement = next((m for m in db_manager.get_measurements() if m[1] == measurement_id), None)
+    if measurement is None:
+        logging.error(f"Measurement {measurement_id} is not registered, add it first.")
+        return False
+
+    from modules.Backfill import Backfill
+    metrics = Metrics()
+    backfill_config = dict(
+        config,
+        max_concurrency=config["backfill_concurrency"],
+        ripe_pool_size=config["backfill_concurrency"],
+        ripe_rate_limit=config["backfill_rate_limit"],
+        ripe_rate_burst=config["backfill_concurrency"],
+        spool_path=config["backfill_spool_path"] or f"{config['spool_path']}-backfill",
+        stream_enabled=False,
+        sharding_enabled=False
     )
-    worker_thread.start()
-    
-    gui_app = MeasurementApp(db_manager=db_manager)
-    gui_app.run()
+    ingest_worker, spool = build_worker(backfill_config, db_manager, metrics=metrics)
+    backfill = Backfill(ingest_worker, chunk_seconds=int(config["backfill_chunk_hours"] * 3600), window_seconds=config["aggregation_window"], retry_interval=config["spool_retry_interval"], metrics=metrics)
+    if config["metrics_enabled"]:
+        metrics.start_server(config["metrics_host"], config["metrics_port"])
+
+    seconds = days * 86400 if days is not None else config["retention_policies"].seconds(measurement[4])
+    backfill.plan(measurement, int(time.time() - seconds), restart=restart)
+    spool.start()
+    complete = False
+    try:
+        complete = backfill.run(measurement)
+        logging.info("Waiting for the spool to be written to InfluxDB...")
+        while spool.size:
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        logging.info("Backfill interrupted, run it again to resume.")
+        backfill.stop()
+    finally:
+        ingest_worker.executor.shutdown(wait=True)
+        spool.stop()
+        spool.writer.close()
+    return complete
+
+
+def register_measurements(config: Dict, db_manager: SQLiteManager, retention_policy: str, asn: str = None, probes: list = (), csv_path: str = None) -> bool:
+    """
+    Registers measurements in bulk, discovered by target ASN or probes, or read from a CSV file.
+
+    @param config: Configuration dictionary from load_config
+    @param db_manager: SQLiteManager instance of the measurement registry
+    @param retention_policy: Data retention policy of the measurements
+    @param asn: Target ASN to discover measurements for, or the ASN of CSV rows without one
+    @param probes: Probe IDs to discover the measurements currently running on
+    @param csv_path: CSV file to import instead of discovering
+    @return: True if the listing or file could be read
+    """
+    import requests
+    from modules.HTTPTransport import HTTPTransport
+    from modules.MeasurementCatalog import MeasurementCatalog
+    from modules.RIPEAtlasAPI import RIPEAtlasAPI
+
+    transport = HTTPTransport(
+        timeout=config["request_timeout"],
+        max_retries=config["ripe_max_retries"],
+        backoff_base=config["ripe_backoff_base"],
+        backoff_max=config["ripe_backoff_max"],
+        rate_limit=config["ripe_rate_limit"],
+        burst=config["ripe_rate_burst"]
+    )
+    ripe_api = RIPEAtlasAPI(api_key=config["api_key"], transport=transport, base_url=config["ripe_base_url"])
+    catalog = MeasurementCatalog(db_manager, ripe_api, retention_policies=config["retention_policies"].names())
+    try:
+        if csv_path:
+            added = catalog.import_csv(csv_path, retention_policy, asn=asn)
+        else:
+            added = catalog.register(catalog.discover(asn=asn, probes=probes), retention_policy)
+    except (OSError, requests.RequestException) as e:
+        logging.error(f"Bulk registration failed: {e}")
+        return False
+    logging.info(f"Registered {added} new measurements.")
+    return True
+
+
+def add_measurement(db_manager: SQLiteManager, asn: str, measurement_id: str, retention_policy: str, measurement_type: str, interval: int) -> bool:
+    """
+    Registers a measurement from the command line, with the same checks as the GUI.
+
+    @param db_manager: SQLiteManager instance of the measurement registry
+    @param asn: ASN number
+    @param measurement_id: RIPE Atlas measurement ID
+    @param retention_policy: Data retention policy
+    @param measurement_type: Type of measurement
+    @param interval: Polling interval in seconds
+    @return: True if the input was valid and the measurement was stored
+    """
+    if not asn.isdigit() or not measurement_id.isdigit():
+        logging.error("ASN and Measurement ID must be numeric!")
+        return False
+    db_manager.add_measurement(
+        measurement_id=measurement_id,
+        asn=asn,
+        bucket_name=f"AS_{asn}",
+        retention_policy=retention_policy,
+        interval=interval,
+        measurement_type=measurement_type
+    )
+    return True
+
+
+def main():
+    """
+    Parses the command line and runs the selected command.
+
+    Commands:
+    - worker: only the ingest worker, for servers without a display. Several workers with
+      --worker-id (or sharding enabled in the config) share the measurements of one registry.
+    - gui: the GUI with the ingest worker on a background thread, the default command.
+    - add-measurement: registers a measurement without starting anything.
+    - discover: registers the measurements targeting an ASN or running on probes, with the type
+      and interval of their RIPE Atlas metadata.
+    - import-csv: registers the measurements listed in a CSV file.
+    - backfill: imports the history of a registered measurement in resumable chunks, next to
+      running workers.
+    Only the gui command imports tkinter and PIL, only worker and gui import the ingest stack.
+    """
+    parser = argparse.ArgumentParser(description="ISP Network Performance Tracking")
+    parser.add_argument("--config", default="config/config.ini", help="path to the configuration file")
+    parser.add_argument("--headless", action="store_true", help="same as the worker command")
+    parser.add_argument("--worker-id", help="unique worker ID, enables sharding across worker processes")
+    subparsers = parser.add_subparsers(dest="command", metavar="{worker,gui,add-measurement,discover,import-csv,backfill}")
+
+    worker_parser = subparsers.add_parser("worker", help="run only the ingest worker, no display needed")
+    worker_parser.add_argument("--worker-id", default=argparse.SUPPRESS, help="unique worker ID, enables sharding across worker processes")
+
+    gui_parser = subparsers.add_parser("gui", help="run the GUI and the ingest worker (default)")
+    gui_parser.add_argument("--no-worker", action="store_true", help="only edit the registry, e.g. while separate workers run")
+
+    add_parser = subparsers.add_parser("add-measurement", help="register a measurement")
+    add_parser.add_argument("--asn", required=True, help="ASN number, also names the bucket AS_<asn>")
+    add_parser.add_argument("--measurement-id", required=True, help="RIPE Atlas measurement ID")
+    add_parser.add_argument("--retention-policy", required=True, help="a policy of the [RetentionPolicies] config section")
+    add_parser.add_argument("--type", dest="measurement_type", required=True, choices=MEASUREMENT_TYPES)
+    add_parser.add_argument("--interval", type=int, default=60, help="polling interval in seconds")
+
+    discover_parser = subparsers.add_parser("discover", help="register the ongoing measurements of an ASN or of probes")
+    discover_target = discover_parser.add_mutually_exclusive_group(required=True)
+    discover_target.add_argument("--asn", help="target ASN of the measurements, also names the bucket AS_<asn>")
+    discover_target.add_argument("--probes", type=lambda value: [int(probe) for probe in value.split(",")], help="comma-separated probe IDs, buckets are named by the target ASN")
+    discover_parser.add_argument("--retention-policy", required=True, help="a policy of the [RetentionPolicies] config section")
+
+    csv_parser = subparsers.add_parser("import-csv", help="register the measurements of a CSV file (measurement_id[,asn,retention_policy,type,interval])")
+    csv_parser.add_argument("path", help="CSV file with a header row")
+    csv_parser.add_argument("--retention-policy", required=True, help="retention policy of rows without one, a policy of the [RetentionPolicies] config section")
+    csv_parser.add_argument("--asn", help="ASN of rows without one, defaults to the target ASN of each measurement")
+
+    backfill_parser = subparsers.add_parser("backfill", help="import the history of a registered measurement, resumes an interrupted backfill")
+    backfill_parser.add_argument("--measurement-id", required=True, help="RIPE Atlas measurement ID")
+    backfill_parser.add_argument("--days", type=float, help="days of history to import, defaults to the retention period")
+    backfill_parser.add_argument("--restart", action="store_true", help="plan a new backfill instead of resuming the previous one")
+    args = parser.parse_args()
+
+    command = args.command or ("worker" if args.headless else "gui")
+    config = load_config(args.config)
+    # the policies come from the config, so they are checked after parsing
+    if getattr(args, "retention_policy", None) is not None and args.retention_policy not in config["retention_policies"]:
+        parser.error(f"unknown retention policy '{args.retention_policy}', choose from: {', '.join(config['retention_policies'].names())}")
+
+    logging.info("Initializing components...")
+    db_manager = SQLiteManager(db_path=config["db_path"], busy_timeout=config["db_busy_timeout"], cache_size_kib=config["db_cache_size_kib"], journal_mode=config["db_journal_mode"])
+
+    if command == "worker":
+        run_worker(config, db_manager, worker_id=args.worker_id)
+    elif command == "gui":
+        run_gui(config, db_manager, with_worker=not args.no_worker if args.command else True)
+    elif command in ("discover", "import-csv"):
+        if not register_measurements(config, db_manager, args.retention_policy, asn=args.asn, probes=getattr(args, "probes", None) or (), csv_path=getattr(args, "path", None)):
+            raise SystemExit(1)
+    elif command == "backfill":
+        if not run_backfill(config, db_manager, args.measurement_id, days=args.days, restart=args.restart):
+            raise SystemExit(1)
+    elif not add_measurement(db_manager, args.asn, args.measurement_id, args.retention_policy, args.measurement_type, args.interval):
+        raise SystemExit(1)
 
 
 if __name__ == "__main__":
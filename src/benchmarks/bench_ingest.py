@@ -0,0 +1,278 @@
+"""
+End-to-end ingest benchmark against a local RIPE Atlas stand-in and a fake InfluxDB.
+
+Stages:
+    fetch      RIPEAtlasAPI streams every measurement from the stand-in, results are discarded
+    transform  DataProcessor turns the same payloads into line protocol, without any I/O
+    worker     IngestWorker.run_cycle fetches, transforms and spools all measurements, until
+               the spool is drained into the fake InfluxDB
+
+Both servers run in this process, every stage runs in a fresh child process, so CPU time and
+peak RSS of a stage contain neither the servers nor the other stages.
+
+Run from the src directory:
+    python -m benchmarks.bench_ingest --probes 200 --history 86400 --output bench.jsonl
+"""
+import os
+import sys
+import json
+import time
+import logging
+import tempfile
+import argparse
+import configparser
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Dict, Any, Optional
+from benchmarks.payloads import generate_ping_results, generate_traceroute_results, write_geoip_csv
+from benchmarks.stand_ins import RIPEAtlasStandIn, FakeInfluxDB
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+STAGES = ("fetch", "transform", "worker")
+PING_INTERVAL = 240
+TRACEROUTE_INTERVAL = 900
+RETENTION_POLICY = "14 days"
+RETENTION_SECONDS = 1209600
+
+
+def measurement_ids(options: Dict[str, Any]) -> Dict[int, str]:
+    """
+    Returns the benchmark measurements.
+
+    @param options: Benchmark options
+    @return: Dictionary of measurement ID to measurement type
+    """
+    measurements = {1001 + index: "Ping" for index in range(options["ping_measurements"])}
+    measurements.update({2001 + index: "Traceroute" for index in range(options["traceroute_measurements"])})
+    return measurements
+
+
+def generate_payloads(options: Dict[str, Any]) -> Dict[int, list]:
+    """
+    Generates the results of all benchmark measurements, identical in every process.
+
+    @param options: Benchmark options
+    @return: Dictionary of measurement ID to results
+    """
+    payloads = {}
+    for measurement_id, measurement_type in measurement_ids(options).items():
+        if measurement_type == "Ping":
+            payloads[measurement_id] = generate_ping_results(
+                options["probes"], max(1, options["history"] // PING_INTERVAL), measurement_id,
+                interval=PING_INTERVAL, now=options["now"], seed=measurement_id
+            )
+        else:
+            payloads[measurement_id] = generate_traceroute_results(
+                options["probes"], max(1, options["history"] // TRACEROUTE_INTERVAL), measurement_id,
+                interval=TRACEROUTE_INTERVAL, now=options["now"], seed=measurement_id
+            )
+    return payloads
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Returns the peak resident set size of this process in bytes, None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # bytes on macOS, KiB elsewhere
+
+
+def write_config(path: str, options: Dict[str, Any], ripe_url: str, influx_url: str, work_dir: str):
+    """
+    Writes a config file in the format of config/config.ini for the worker stage.
+
+    @param path: Path of the config file
+    @param options: Benchmark options
+    @param ripe_url: API root URL of the RIPE Atlas stand-in
+    @param influx_url: URL of the fake InfluxDB
+    @param work_dir: Directory for the registry, the spool and the GeoIP database
+    """
+    geoip_path = os.path.join(work_dir, "geoip.csv")
+    write_geoip_csv(geoip_path)
+    config = configparser.ConfigParser()
+    config["InfluxDB"] = {"url": influx_url, "token": "benchmark", "org": "benchmark"}
+    config["RIPEAtlas"] = {"api_key": "benchmark", "base_url": ripe_url, "rate_limit": str(options["rate_limit"]), "rate_burst": str(options["concurrency"]), "backoff_base": "0.05"}
+    config["Database"] = {"db_path": os.path.join(work_dir, "registry.db")}
+    config["Worker"] = {"max_concurrency": str(options["concurrency"])}
+    config["Spool"] = {"spool_path": os.path.join(work_dir, "spool.db"), "retry_interval": "0.1"}
+    config["GeoIP"] = {"db_path": geoip_path}
+    config["Aggregation"] = {"enabled": str(options["rollups"])}
+    config["PacketIngest"] = {"enabled": str(options["packets"])}
+    with open(path, "w") as file:
+        config.write(file)
+
+
+def stage_fetch(options: Dict[str, Any], ripe_url: str, influx_url: str) -> Dict[str, Any]:
+    """Streams all measurements concurrently and counts the results."""
+    from modules.HTTPTransport import HTTPTransport
+    from modules.RIPEAtlasAPI import RIPEAtlasAPI
+
+    transport = HTTPTransport(pool_size=options["concurrency"], rate_limit=options["rate_limit"], burst=options["concurrency"], backoff_base=0.05)
+    ripe_api = RIPEAtlasAPI(api_key="benchmark", transport=transport, base_url=ripe_url)
+
+    def fetch(measurement_id: int) -> int:
+        count = 0
+        for window in ripe_api.fetch_new_measurement_results(measurement_id, 0, RETENTION_SECONDS):
+            for results in window:
+                count += len(results)
+        return count
+
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+        results = sum(executor.map(fetch, measurement_ids(options)))
+    return {"results": results, "wall": time.perf_counter() - start_wall, "cpu": time.process_time() - start_cpu}
+
+
+def stage_transform(options: Dict[str, Any], ripe_url: str, influx_url: str) -> Dict[str, Any]:
+    """Transforms all payloads in the batch size of the streaming API and counts the lines."""
+    from modules.DataProcessor import DataProcessor
+    from modules.GeoIPResolver import GeoIPResolver
+    from modules.RIPEAtlasAPI import RIPEAtlasAPI
+
+    aggregator = packet_processor = None
+    if options["rollups"]:
+        from modules.LatencyAggregator import LatencyAggregator
+        aggregator = LatencyAggregator()
+    if options["packets"]:
+        from modules.PacketRTTProcessor import PacketRTTProcessor
+        packet_processor = PacketRTTProcessor()
+    with tempfile.TemporaryDirectory() as work_dir:
+        geoip_path = os.path.join(work_dir, "geoip.csv")
+        write_geoip_csv(geoip_path)
+        processor = DataProcessor(geoip_resolver=GeoIPResolver(geoip_path), aggregator=aggregator, packet_processor=packet_processor)
+
+    payloads = generate_payloads(options)
+    types = measurement_ids(options)
+    batch_size = RIPEAtlasAPI.DEFAULT_BATCH_SIZE
+    results = lines = 0
+
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    for measurement_id, measurement_results in payloads.items():
+        for offset in range(0, len(measurement_results), batch_size):
+            batch = measurement_results[offset:offset + batch_size]
+            if types[measurement_id] == "Ping":
+                lines += len(processor.prepare_ping_lines_for_influxdb(batch, RETENTION_SECONDS))
+                lines += len(processor.prepare_latency_rollups_for_influxdb(measurement_id, batch, RETENTION_SECONDS))
+                lines += len(processor.prepare_packet_data_for_influxdb(batch, RETENTION_SECONDS))
+            else:
+                lines += len(processor.prepare_traceroute_data_for_influxdb(batch, RETENTION_SECONDS))
+            results += len(batch)
+    return {"results": results, "lines": lines, "wall": time.perf_counter() - start_wall, "cpu": time.process_time() - start_cpu}
+
+
+def stage_worker(options: Dict[str, Any], ripe_url: str, influx_url: str) -> Dict[str, Any]:
+    """Runs one IngestWorker cycle over all measurements and waits until the spool is drained."""
+    from Main import load_config, build_worker
+    from modules.SQLiteManager import SQLiteManager
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        config_path = os.path.join(work_dir, "config.ini")
+        write_config(config_path, options, ripe_url, influx_url, work_dir)
+        config = load_config(config_path)
+        db_manager = SQLiteManager(db_path=config["db_path"])
+        for measurement_id, measurement_type in measurement_ids(options).items():
+            interval = PING_INTERVAL if measurement_type == "Ping" else TRACEROUTE_INTERVAL
+            db_manager.add_measurement(str(measurement_id), "3333", "benchmark", RETENTION_POLICY, interval, measurement_type)
+        ingest_worker, spool = build_worker(config, db_manager)
+
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        spool.start()
+        ingest_worker.run_cycle(db_manager.get_measurements())
+        deadline = time.monotonic() + options["drain_timeout"]
+        while spool.size and time.monotonic() < deadline:
+            time.sleep(0.01)
+        wall, cpu = time.perf_counter() - start_wall, time.process_time() - start_cpu
+
+        drained = spool.size == 0
+        spool.stop()
+        spool.writer.close()
+        ingest_worker.executor.shutdown()
+        db_manager.close()
+    if not drained:
+        logging.error("Spool was not drained within the drain timeout.")
+    return {"wall": wall, "cpu": cpu, "drained": drained}
+
+
+def run_stage(stage: str, options: Dict[str, Any], ripe_url: str, influx_url: str) -> Dict[str, Any]:
+    """
+    Runs one stage, in a child process, and adds its peak RSS.
+
+    @param stage: Name of the stage
+    @param options: Benchmark options
+    @param ripe_url: API root URL of the RIPE Atlas stand-in
+    @param influx_url: URL of the fake InfluxDB
+    @return: Dictionary with wall and cpu seconds, peak_rss bytes and stage specific counters
+    """
+    # the 429 retries of the transport are expected and counted by the stand-in
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.ERROR)
+    stats = globals()[f"stage_{stage}"](options, ripe_url, influx_url)
+    stats["peak_rss"] = peak_rss_bytes()
+    return stats
+
+
+def report(stages: Dict[str, Dict[str, Any]]):
+    """Prints one row per stage."""
+    print(f"{'stage':<10} {'results':>9} {'results/s':>11} {'requests':>8} {'429s':>5} {'fetched MiB':>11} {'lines':>9} {'wall s':>8} {'cpu s':>8} {'peak RSS MiB':>12}")
+    for stage, stats in stages.items():
+        rate = stats["results"] / stats["wall"] if stats["wall"] else 0.0
+        peak_rss = f"{stats['peak_rss'] / 2 ** 20:12.1f}" if stats["peak_rss"] is not None else f"{'n/a':>12}"
+        print(f"{stage:<10} {stats['results']:>9} {rate:>11,.0f} {stats.get('requests', 0):>8} {stats.get('throttled', 0):>5} {stats.get('bytes', 0) / 2 ** 20:>11.1f} {stats.get('lines', 0):>9} "
+              f"{stats['wall']:>8.2f} {stats['cpu']:>8.2f} {peak_rss}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--probes", type=int, default=200, help="probes per measurement")
+    parser.add_argument("--history", type=int, default=86400, help="seconds of results per measurement, at most 14 days")
+    parser.add_argument("--ping-measurements", type=int, default=4)
+    parser.add_argument("--traceroute-measurements", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent measurements and HTTP connections")
+    parser.add_argument("--rate-limit", type=float, default=1000.0, help="client side requests per second")
+    parser.add_argument("--throttle-rate", type=float, default=0.02, help="share of requests the stand-in answers with 429")
+    parser.add_argument("--retry-after", type=float, default=0.05, help="Retry-After seconds of a 429")
+    parser.add_argument("--write-latency", type=float, default=0.0, help="seconds the fake InfluxDB delays every write")
+    parser.add_argument("--no-rollups", dest="rollups", action="store_false", help="skip the latency rollups (needs NumPy otherwise)")
+    parser.add_argument("--no-packets", dest="packets", action="store_false", help="skip the per-packet series (needs NumPy otherwise)")
+    parser.add_argument("--drain-timeout", type=float, default=300.0, help="maximum seconds the worker stage waits for the spool")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--output", help="append the results as one JSON line to this file, to track them over time")
+    args = parser.parse_args()
+
+    if args.history > RETENTION_SECONDS:
+        parser.error(f"--history must not exceed the {RETENTION_POLICY} retention ({RETENTION_SECONDS} seconds)")
+
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.WARNING)
+    options = vars(args).copy()
+    options["now"] = int(time.time())
+
+    payloads = generate_payloads(options)
+    context = multiprocessing.get_context("spawn")
+    stages = {}
+    with RIPEAtlasStandIn(payloads, throttle_rate=args.throttle_rate, retry_after=args.retry_after) as ripe, FakeInfluxDB(write_latency=args.write_latency) as influx:
+        for stage in args.stages:
+            ripe_before, influx_before = ripe.stats(), influx.stats()
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                stats = executor.submit(run_stage, stage, options, ripe.base_url, influx.url).result()
+            ripe_after, influx_after = ripe.stats(), influx.stats()
+
+            served = {name: value - ripe_before.get(name, 0) for name, value in ripe_after.items()}
+            written = {name: value - influx_before.get(name, 0) for name, value in influx_after.items()}
+            if stage != "transform":
+                stats.setdefault("results", served.get("results", 0))
+                stats.update(bytes=served.get("bytes", 0), requests=served.get("requests", 0), throttled=served.get("throttled", 0))
+            if stage == "worker":
+                stats.update(lines=written.get("lines", 0), writes=written.get("writes", 0), written_bytes=written.get("bytes", 0))
+            stages[stage] = stats
+
+    report(stages)
+    if args.output:
+        with open(args.output, "a") as file:
+            file.write(json.dumps({"time": options["now"], "options": options, "stages": stages}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
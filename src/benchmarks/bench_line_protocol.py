@@ -0,0 +1,59 @@
+"""
+Compares the Point-based ping transform with the direct line protocol serializer.
+
+Run from the src directory:
+    python -m benchmarks.bench_line_protocol --probes 500 --results 20
+"""
+import time
+import logging
+import argparse
+from modules.DataProcessor import DataProcessor
+from benchmarks.payloads import generate_ping_results
+
+
+def point_path(processor: DataProcessor, results: list) -> list:
+    """Transforms results with the Point-based functions and serializes them."""
+    points = processor.prepare_latency_data_for_influxdb(results, 86400)
+    points += processor.prepare_packetloss_data_for_influxdb(results, 86400)
+    return [point.to_line_protocol().encode() for point in points]
+
+
+def line_path(processor: DataProcessor, results: list) -> list:
+    """Transforms results with the direct line protocol serializer."""
+    return processor.prepare_ping_lines_for_influxdb(results, 86400)
+
+
+def measure(function, processor: DataProcessor, results: list, repeat: int) -> float:
+    """Returns the best wall time of repeat runs in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(processor, results)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--probes", type=int, default=500)
+    parser.add_argument("--results", type=int, default=20, help="results per probe")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    processor = DataProcessor()
+    results = generate_ping_results(args.probes, args.results)
+
+    if sorted(point_path(processor, results)) != sorted(line_path(processor, results)):
+        raise SystemExit("Line protocol output differs from the Point-based path!")
+
+    point_seconds = measure(point_path, processor, results, args.repeat)
+    line_seconds = measure(line_path, processor, results, args.repeat)
+    print(f"{len(results)} results")
+    print(f"Point path:         {point_seconds * 1000:8.1f} ms  ({len(results) / point_seconds:,.0f} results/s)")
+    print(f"Line protocol path: {line_seconds * 1000:8.1f} ms  ({len(results) / line_seconds:,.0f} results/s)")
+    print(f"Speedup:            {point_seconds / line_seconds:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Synthetic RIPE Atlas result payloads for the benchmarks.
+
+All generators take a seed, so two runs with the same parameters produce the same payloads.
+"""
+import time
+import random
+from typing import List, Dict, Any, Optional
+
+# hop addresses are drawn from these public /16 networks, so they pass the GeoIP global address check
+HOP_NETWORKS = ("193.0", "194.0", "195.0", "212.0")
+
+
+def generate_ping_results(probes: int, results_per_probe: int, measurement_id: int = 1001, interval: int = 240, packets: int = 3, now: Optional[int] = None, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Generates synthetic RIPE Atlas ping results.
+
+    @param probes: Number of distinct probes
+    @param results_per_probe: Number of results per probe, the history covers results_per_probe * interval seconds
+    @param measurement_id: Measurement ID written into every result
+    @param interval: Seconds between two results of the same probe
+    @param packets: Packets sent per result
+    @param now: Timestamp of the end of the history, defaults to the current time
+    @param seed: Seed of the random generator
+    @return: List of result dictionaries, ordered by timestamp
+    """
+    rng = random.Random(seed)
+    now = int(time.time()) if now is None else now
+    results = []
+    for index in range(results_per_probe):
+        timestamp = now - (results_per_probe - index) * interval
+        for probe_id in range(1, probes + 1):
+            base = rng.uniform(1, 80)
+            replies = []
+            for _ in range(packets):
+                if rng.random() < 0.05:
+                    replies.append({"x": "*"})
+                else:
+                    replies.append({"rtt": round(base + rng.expovariate(1.0), 3)})
+            rtts = [reply["rtt"] for reply in replies if "rtt" in reply]
+            results.append({
+                "fw": 5080,
+                "msm_id": measurement_id,
+                "prb_id": probe_id,
+                "timestamp": timestamp,
+                "type": "ping",
+                "proto": "ICMP",
+                "from": f"84.{probe_id // 65536 % 256}.{probe_id // 256 % 256}.{probe_id % 256}",
+                "src_addr": f"192.168.{probe_id // 256 % 256}.{probe_id % 256}",
+                "dst_addr": "193.0.14.129",
+                "dst_name": "k.root-servers.net",
+                "sent": packets,
+                "rcvd": len(rtts),
+                "dup": 0,
+                "ttl": 56,
+                "size": 48,
+                "min": min(rtts) if rtts else -1,
+                "max": max(rtts) if rtts else -1,
+                "avg": round(sum(rtts) / len(rtts), 3) if rtts else -1,
+                "result": replies
+            })
+    return results
+
+
+def generate_traceroute_results(probes: int, results_per_probe: int, measurement_id: int = 2001, interval: int = 900, hops: int = 12, now: Optional[int] = None, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Generates synthetic RIPE Atlas traceroute results.
+
+    Every probe takes a fixed path, the first hop is a private address and every tenth reply
+    times out, like in real traceroutes.
+
+    @param probes: Number of distinct probes
+    @param results_per_probe: Number of results per probe, the history covers results_per_probe * interval seconds
+    @param measurement_id: Measurement ID written into every result
+    @param interval: Seconds between two results of the same probe
+    @param hops: Hops per traceroute
+    @param now: Timestamp of the end of the history, defaults to the current time
+    @param seed: Seed of the random generator
+    @return: List of result dictionaries, ordered by timestamp
+    """
+    rng = random.Random(seed)
+    now = int(time.time()) if now is None else now
+    paths = {}
+    for probe_id in range(1, probes + 1):
+        path = ["192.168.1.1"]
+        for _ in range(hops - 1):
+            path.append(f"{rng.choice(HOP_NETWORKS)}.{rng.randrange(256)}.{rng.randrange(1, 255)}")
+        paths[probe_id] = path
+
+    results = []
+    for index in range(results_per_probe):
+        timestamp = now - (results_per_probe - index) * interval
+        for probe_id in range(1, probes + 1):
+            hop_results = []
+            for hop, address in enumerate(paths[probe_id], start=1):
+                replies = []
+                for _ in range(3):
+                    if rng.random() < 0.1:
+                        replies.append({"x": "*"})
+                    else:
+                        replies.append({"from": address, "rtt": round(hop * 2.5 + rng.expovariate(0.5), 3), "size": 28, "ttl": 255 - hop})
+                hop_results.append({"hop": hop, "result": replies})
+            results.append({
+                "fw": 5080,
+                "msm_id": measurement_id,
+                "prb_id": probe_id,
+                "timestamp": timestamp,
+                "endtime": timestamp + 5,
+                "type": "traceroute",
+                "proto": "ICMP",
+                "af": 4,
+                "from": f"84.{probe_id // 65536 % 256}.{probe_id // 256 % 256}.{probe_id % 256}",
+                "src_addr": f"192.168.{probe_id // 256 % 256}.{probe_id % 256}",
+                "dst_addr": paths[probe_id][-1],
+                "paris_id": index % 16,
+                "size": 48,
+                "result": hop_results
+            })
+    return results
+
+
+def write_geoip_csv(path: str, seed: int = 0):
+    """
+    Writes a GeoIP CSV that resolves every /24 of the hop networks of generate_traceroute_results.
+
+    @param path: Path of the CSV file
+    @param seed: Seed of the random generator
+    """
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("network,latitude,longitude\n")
+        for prefix in HOP_NETWORKS:
+            for third in range(256):
+                file.write(f"{prefix}.{third}.0/24,{rng.uniform(-60, 70):.4f},{rng.uniform(-180, 180):.4f}\n")
@@ -0,0 +1,586 @@
+"""
+Local HTTP stand-ins for the RIPE Atlas results API, the RIPE Atlas result stream and the
+InfluxDB write API.
+
+Both servers run on a background thread of the calling process and bind to a free port on
+localhost, so benchmarks neither need network access nor load the real services.
+"""
+import re
+import gzip
+import json
+import base64
+import socket
+import struct
+import hashlib
+import time
+import bisect
+import random
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Any, Optional
+from urllib.parse import urlsplit, parse_qs
+
+
+class _StandInServer:
+    """
+    Runs a ThreadingHTTPServer on a background thread and counts what it served.
+    """
+
+    def __init__(self, handler_class: type, host: str = "127.0.0.1", port: int = 0):
+        """
+        Binds the server, it answers requests once start() is called.
+
+        @param handler_class: BaseHTTPRequestHandler subclass, its requests reach the server as self.server.stand_in
+        @param host: Address to bind to
+        @param port: Port to bind to, 0 picks a free one
+        """
+        self._server = ThreadingHTTPServer((host, port), handler_class)
+        self._server.daemon_threads = True
+        self._server.stand_in = self
+        self._thread = None
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {}
+
+    @property
+    def url(self) -> str:
+        """Root URL of the server, e.g. http://127.0.0.1:54321"""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, **increments: int):
+        """Adds the given increments to the counters."""
+        with self._lock:
+            for name, value in increments.items():
+                self._counters[name] = self._counters.get(name, 0) + value
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns a snapshot of the counters.
+
+        @return: Dictionary of counter name to value
+        """
+        with self._lock:
+            return dict(self._counters)
+
+    def start(self):
+        """Starts answering requests on a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        logging.info(f"{type(self).__name__} listening on {self.url}.")
+
+    def stop(self):
+        """Stops the server and closes its socket."""
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    """Request handler without the per-request log line on stderr."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, payload: Any):
+        """Sends a JSON response with Content-Length."""
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self) -> bytes:
+        """Reads the request body, gunzipped if needed."""
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return body
+
+
+class _RIPEAtlasHandler(_QuietHandler):
+    """Serves GET /api/v2/measurements/{id}/results/ with start/stop filtering and the measurement listing."""
+
+    PATH = re.compile(r"^/api/v2/measurements/(\d+)/results/?$")
+    LISTING_PATH = re.compile(r"^/api/v2/measurements/?$")
+    LISTING_FILTERS = {"target_asn": "target_asn", "status": "status", "current_probes": "probes"}
+
+    def do_GET(self):
+        stand_in = self.server.stand_in
+        request = urlsplit(self.path)
+        if self.LISTING_PATH.match(request.path):
+            self.send_listing(parse_qs(request.query))
+            return
+        match = self.PATH.match(request.path)
+        if match is None or int(match.group(1)) not in stand_in.measurements:
+            stand_in.count(requests=1, not_found=1)
+            self.send_json(404, {"error": {"status": 404, "title": "Not Found"}})
+            return
+
+        if stand_in.throttled():
+            stand_in.count(requests=1, throttled=1)
+            self.send_response(429)
+            self.send_header("Retry-After", str(stand_in.retry_after))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        query = parse_qs(request.query)
+        try:
+            start = int(query["start"][0]) if "start" in query else None
+            stop = int(query["stop"][0]) if "stop" in query else None
+        except ValueError:
+            stand_in.count(requests=1, bad_request=1)
+            self.send_json(400, {"error": {"status": 400, "title": "Bad Request"}})
+            return
+
+        measurement_id = int(match.group(1))
+        timestamps, encoded = stand_in.measurements[measurement_id]
+        first = 0 if start is None else bisect.bisect_left(timestamps, start)
+        last = len(timestamps) if stop is None else bisect.bisect_right(timestamps, stop)
+        last = max(first, last)
+
+        etag = f'"{measurement_id}-{first}-{last}"'
+        if self.headers.get("If-None-Match") == etag:
+            stand_in.count(requests=1, not_modified=1)
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = b"[" + b",".join(encoded[first:last]) + b"]"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+        stand_in.count(requests=1, results=last - first, bytes=len(body))
+
+
+    def send_listing(self, query: Dict[str, List[str]]):
+        """Answers a page of the measurement listing, filtered like the real one."""
+        stand_in = self.server.stand_in
+        matches = list(stand_in.metadata.values())
+        if "id__in" in query:
+            ids = {int(measurement_id) for measurement_id in query["id__in"][0].split(",") if measurement_id}
+            matches = [m for m in matches if m["id"] in ids]
+        for parameter, field in self.LISTING_FILTERS.items():
+            if parameter in query:
+                value = int(query[parameter][0])
+                if field == "probes":
+                    matches = [m for m in matches if value in m.get("probes", ())]
+                else:
+                    # status is an object like {"id": 2, "name": "Ongoing"}
+                    matches = [m for m in matches if (m.get(field) or {}).get("id", m.get(field)) == value] if field == "status" else [m for m in matches if m.get(field) == value]
+        page_size = int(query.get("page_size", ["50"])[0])
+        page = int(query.get("page", ["1"])[0])
+        results = [{key: value for key, value in m.items() if key != "probes"} for m in matches[(page - 1) * page_size:page * page_size]]
+        next_url = None
+        if page * page_size < len(matches):
+            next_query = {key: values[0] for key, values in query.items()}
+            next_query["page"] = page + 1
+            next_url = f"{stand_in.url}/api/v2/measurements/?" + "&".join(f"{key}={value}" for key, value in next_query.items())
+        stand_in.count(requests=1, listed=len(results))
+        self.send_json(200, {"count": len(matches), "next": next_url, "previous": None, "results": results})
+
+
+class RIPEAtlasStandIn(_StandInServer):
+    """
+    Serves synthetic results like the RIPE Atlas measurement results endpoint.
+
+    Supports the start and stop parameters, answers a share of all requests with 429 Too Many
+    Requests and a Retry-After header, and sends an ETag so conditional requests get a 304.
+    Results are JSON encoded once up front, so the server adds as little CPU time as possible.
+    """
+
+    def __init__(self, results: Dict[int, List[Dict[str, Any]]], throttle_rate: float = 0.0, retry_after: float = 0.05, seed: int = 0, host: str = "127.0.0.1", port: int = 0, metadata: List[Dict[str, Any]] = ()):
+        """
+        Initializes the stand-in, it answers requests once start() is called.
+
+        @param results: Results to serve per measurement ID
+        @param throttle_rate: Share of requests answered with 429, between 0 and 1
+        @param retry_after: Seconds sent in the Retry-After header of a 429
+        @param seed: Seed of the random generator that picks the throttled requests
+        @param host: Address to bind to
+        @param port: Port to bind to, 0 picks a free one
+        @param metadata: Measurements of the listing, with id, type, interval, target_asn, status and
+                         the IDs of their current probes as probes
+        """
+        super().__init__(_RIPEAtlasHandler, host, port)
+        self.metadata = {m["id"]: m for m in metadata}
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        # measurement ID -> (sorted timestamps, JSON encoded results in the same order)
+        self.measurements = {}
+        for measurement_id, measurement_results in results.items():
+            ordered = sorted(measurement_results, key=lambda result: result["timestamp"])
+            self.measurements[int(measurement_id)] = (
+                [result["timestamp"] for result in ordered],
+                [json.dumps(result, separators=(",", ":")).encode() for result in ordered]
+            )
+
+    def add_result(self, result: Dict[str, Any]):
+        """
+        Adds a result after start, e.g. one that is also published on the stream stand-in.
+
+        @param result: Result with msm_id and timestamp
+        """
+        with self._lock:
+            timestamps, encoded = self.measurements.setdefault(int(result["msm_id"]), ([], []))
+            index = bisect.bisect_right(timestamps, result["timestamp"])
+            timestamps.insert(index, result["timestamp"])
+            encoded.insert(index, json.dumps(result, separators=(",", ":")).encode())
+
+    @property
+    def base_url(self) -> str:
+        """API root URL to pass to RIPEAtlasAPI."""
+        return f"{self.url}/api/v2/"
+
+    def throttled(self) -> bool:
+        """Decides whether the current request gets a 429."""
+        with self._lock:
+            return self._random.random() < self.throttle_rate
+
+
+class _InfluxDBHandler(_QuietHandler):
+    """Serves the write, bucket, task and organization endpoints used by this project."""
+
+    def do_POST(self):
+        stand_in = self.server.stand_in
+        request = urlsplit(self.path)
+        body = self.read_body()
+
+        if request.path == "/api/v2/write":
+            if stand_in.write_latency:
+                time.sleep(stand_in.write_latency)
+            lines = body.count(b"\n") + (1 if body and not body.endswith(b"\n") else 0)
+            stand_in.count(writes=1, lines=lines, bytes=len(body))
+            self.send_response(204)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif request.path == "/api/v2/buckets":
+            self.send_json(201, stand_in.add_bucket(json.loads(body)))
+        elif request.path == "/api/v2/tasks":
+            self.send_json(201, stand_in.add_task(json.loads(body)))
+        else:
+            self.send_json(404, {"code": "not found", "message": request.path})
+
+    def do_PATCH(self):
+        stand_in = self.server.stand_in
+        request = urlsplit(self.path)
+        body = self.read_body()
+        task = None
+        if request.path.startswith("/api/v2/tasks/"):
+            task = stand_in.update_task(request.path.rsplit("/", 1)[1], json.loads(body))
+        if task is None:
+            self.send_json(404, {"code": "not found", "message": request.path})
+        else:
+            self.send_json(200, task)
+
+    def do_GET(self):
+        stand_in = self.server.stand_in
+        request = urlsplit(self.path)
+        query = parse_qs(request.query)
+
+        if request.path == "/api/v2/buckets":
+            buckets = stand_in.buckets()
+            if "name" in query:
+                buckets = [bucket for bucket in buckets if bucket["name"] == query["name"][0]]
+            self.send_json(200, {"links": {"self": "/api/v2/buckets"}, "buckets": buckets})
+        elif request.path == "/api/v2/tasks":
+            tasks = stand_in.tasks()
+            if "name" in query:
+                tasks = [task for task in tasks if task["name"] == query["name"][0]]
+            self.send_json(200, {"links": {"self": "/api/v2/tasks"}, "tasks": tasks})
+        elif request.path == "/api/v2/orgs":
+            self.send_json(200, {"links": {"self": "/api/v2/orgs"}, "orgs": [{"id": stand_in.ORG_ID, "name": stand_in.org, "links": {"self": f"/api/v2/orgs/{stand_in.ORG_ID}"}}]})
+        elif request.path in ("/ping", "/health"):
+            self.send_json(200, {"name": "influxdb", "status": "pass"})
+        else:
+            self.send_json(404, {"code": "not found", "message": request.path})
+
+
+class FakeInfluxDB(_StandInServer):
+    """
+    Accepts line protocol like the InfluxDB v2 write endpoint and only counts it.
+
+    Also keeps in-memory bucket and task lists, so BucketManager works against it unchanged.
+    Tasks are stored but never run.
+    """
+
+    ORG_ID = "0000000000000001"
+
+    def __init__(self, org: str = "benchmark", write_latency: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        """
+        Initializes the fake server, it answers requests once start() is called.
+
+        @param org: Name of the only organization
+        @param write_latency: Seconds every write request is delayed, to simulate a slow server
+        @param host: Address to bind to
+        @param port: Port to bind to, 0 picks a free one
+        """
+        super().__init__(_InfluxDBHandler, host, port)
+        self.org = org
+        self.write_latency = write_latency
+        self._buckets: Dict[str, Dict[str, Any]] = {}
+        self._tasks: List[Dict[str, Any]] = []
+
+    def add_bucket(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Stores a bucket from a POST /api/v2/buckets request body.
+
+        @param request: Decoded request body
+        @return: Bucket as returned by InfluxDB
+        """
+        with self._lock:
+            bucket_id = f"{len(self._buckets) + 1:016x}"
+            bucket = {
+                "id": bucket_id,
+                "name": request["name"],
+                "orgID": self.ORG_ID,
+                "retentionRules": request.get("retentionRules", []),
+                "links": {"self": f"/api/v2/buckets/{bucket_id}"}
+            }
+            self._buckets.setdefault(bucket["name"], bucket)
+            return self._buckets[bucket["name"]]
+
+    def add_task(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Stores a task from a POST /api/v2/tasks request body, named by its option task line.
+
+        @param request: Decoded request body
+        @return: Task as returned by InfluxDB
+        """
+        name = re.search(r'option task = \{name: "([^"]*)"', request.get("flux", ""))
+        with self._lock:
+            task = {
+                "id": f"{len(self._tasks) + 1:016x}",
+                "orgID": self.ORG_ID,
+                "org": self.org,
+                "name": name.group(1) if name else "",
+                "status": request.get("status", "active"),
+                "flux": request.get("flux", ""),
+                "description": request.get("description", "")
+            }
+            self._tasks.append(task)
+            return task
+
+    def update_task(self, task_id: str, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Updates a task from a PATCH /api/v2/tasks/{id} request body.
+
+        @param task_id: ID of the task
+        @param request: Decoded request body
+        @return: Updated task as returned by InfluxDB, None if there is no such task
+        """
+        with self._lock:
+            for task in self._tasks:
+                if task["id"] == task_id:
+                    task.update((key, value) for key, value in request.items() if key in ("flux", "status", "description"))
+                    return task
+        return None
+
+    def tasks(self) -> List[Dict[str, Any]]:
+        """
+        Returns all stored tasks.
+
+        @return: List of tasks as returned by InfluxDB
+        """
+        with self._lock:
+            return list(self._tasks)
+
+    def buckets(self) -> List[Dict[str, Any]]:
+        """
+        Returns all stored buckets.
+
+        @return: List of buckets as returned by InfluxDB
+        """
+        with self._lock:
+            return list(self._buckets.values())
+
+
+class _StreamHandler(_QuietHandler):
+    """
+    Minimal RFC 6455 WebSocket endpoint speaking the RIPE Atlas result stream messages.
+    """
+
+    GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+    def do_GET(self):
+        stand_in = self.server.stand_in
+        key = self.headers.get("Sec-WebSocket-Key")
+        if self.headers.get("Upgrade", "").lower() != "websocket" or not key:
+            self.send_json(400, {"error": "WebSocket upgrade expected"})
+            return
+        accept = base64.b64encode(hashlib.sha1((key + self.GUID).encode()).digest()).decode()
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+
+        client = stand_in.connect(self.connection)
+        try:
+            while True:
+                opcode, payload = self.read_frame()
+                if opcode == 0x8:  # close
+                    break
+                if opcode == 0x9:  # ping
+                    client.send(0xA, payload)
+                elif opcode == 0x1:
+                    stand_in.handle_message(client, payload.decode("utf-8"))
+        except (OSError, ConnectionError):
+            pass
+        finally:
+            stand_in.disconnect(client)
+        self.close_connection = True
+
+    def read_frame(self):
+        """Reads one masked client frame, returns (opcode, payload)."""
+        header = self.rfile.read(2)
+        if len(header) < 2:
+            raise ConnectionError("connection closed")
+        opcode, length = header[0] & 0x0F, header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", self.rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", self.rfile.read(8))[0]
+        mask = self.rfile.read(4) if header[1] & 0x80 else b"\x00\x00\x00\x00"
+        payload = self.rfile.read(length)
+        return opcode, bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+
+
+class _StreamClient:
+    """One connection to the stream stand-in and its subscriptions."""
+
+    def __init__(self, connection: socket.socket):
+        self.connection = connection
+        self.subscriptions = set()
+        self._lock = threading.Lock()
+
+    def send(self, opcode: int, payload: bytes):
+        """Sends one unmasked server frame."""
+        length = len(payload)
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, length)
+        elif length < 1 << 16:
+            header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+        with self._lock:
+            self.connection.sendall(header + payload)
+
+    def send_message(self, message: Any):
+        """Sends a JSON text message."""
+        self.send(0x1, json.dumps(message).encode("utf-8"))
+
+
+class RIPEAtlasStreamStandIn(_StandInServer):
+    """
+    Stand-in for the RIPE Atlas result stream.
+
+    Clients subscribe with ["atlas_subscribe", {"streamType": "result", "msm": <id>}] and receive
+    every published result of their measurements as ["atlas_result", <result>]. disconnect_all()
+    drops the connections like a restart of the real service.
+
+    Counters: connections, subscriptions, published, delivered.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        """
+        Binds the stand-in.
+
+        @param host: Address to bind to
+        @param port: Port to bind to, 0 picks a free one
+        """
+        super().__init__(_StreamHandler, host, port)
+        self._clients: List[_StreamClient] = []
+
+    @property
+    def stream_url(self) -> str:
+        """WebSocket URL to pass to ResultStream."""
+        return self.url.replace("http://", "ws://", 1) + "/stream/"
+
+    def connect(self, connection: socket.socket) -> _StreamClient:
+        """Registers an upgraded connection."""
+        client = _StreamClient(connection)
+        with self._lock:
+            self._clients.append(client)
+        self.count(connections=1)
+        return client
+
+    def disconnect(self, client: _StreamClient):
+        """Forgets a closed connection."""
+        with self._lock:
+            if client in self._clients:
+                self._clients.remove(client)
+
+    def handle_message(self, client: _StreamClient, message: str):
+        """Applies a subscribe or unsubscribe message of a client."""
+        try:
+            message_type, payload = json.loads(message)
+            measurement_id = int(payload["msm"])
+        except (ValueError, KeyError, TypeError):
+            client.send_message(["atlas_error", f"malformed message: {message}"])
+            return
+        if message_type == "atlas_subscribe":
+            client.subscriptions.add(measurement_id)
+            self.count(subscriptions=1)
+            client.send_message(["atlas_subscribed", payload])
+        elif message_type == "atlas_unsubscribe":
+            client.subscriptions.discard(measurement_id)
+            client.send_message(["atlas_unsubscribed", payload])
+
+    def subscribed(self, measurement_id: int) -> bool:
+        """
+        Tells whether any client is subscribed to a measurement.
+
+        @param measurement_id: Measurement ID
+        @return: True if at least one client receives its results
+        """
+        with self._lock:
+            return any(measurement_id in client.subscriptions for client in self._clients)
+
+    def publish(self, result: Dict[str, Any]) -> int:
+        """
+        Pushes a result to the clients subscribed to its measurement.
+
+        @param result: Result with an msm_id
+        @return: Number of clients it was delivered to
+        """
+        with self._lock:
+            clients = [client for client in self._clients if result["msm_id"] in client.subscriptions]
+        delivered = 0
+        for client in clients:
+            try:
+                client.send_message(["atlas_result", result])
+                delivered += 1
+            except OSError:
+                self.disconnect(client)
+        self.count(published=1, delivered=delivered)
+        return delivered
+
+    def disconnect_all(self):
+        """Closes every client connection."""
+        with self._lock:
+            clients, self._clients = self._clients, []
+        for client in clients:
+            try:
+                client.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
@@ -1,34 +1,58 @@
 import os
-from PIL import Image, ImageTk
+import logging
+import time
 import tkinter as tk
 from tkinter import ttk, messagebox
+from typing import Callable, Dict, List, Optional
+from modules.RetentionPolicies import RetentionPolicies
 from modules.SQLiteManager import SQLiteManager
+from .TaskQueue import TaskQueue
 
 class MeasurementApp:
     """
     GUI application for entering measurement data and interacting with SQLite.
+
+    Database calls run on a background TaskQueue, so a registry locked by the worker never
+    freezes the window. The status table is refreshed on a timer from the snapshot the ingest
+    worker publishes in memory, a refresh does no database or network call.
     """
 
-    def __init__(self, db_manager: SQLiteManager):
+    STATUS_COLUMNS = (
+        ("measurement", "Measurement", 100),
+        ("type", "Type", 90),
+        ("lag", "Watermark Lag", 110),
+        ("last_run", "Last Run", 80),
+        ("duration", "Duration", 70),
+        ("rows", "Rows Written", 95),
+        ("errors", "Errors", 55),
+        ("state", "State", 180),
+    )
+
+    def __init__(self, db_manager: SQLiteManager, retention_policies: Optional[List[str]] = None, status_source: Optional[Callable[[], Dict[str, dict]]] = None, status_interval_ms: int = 2000):
         """
         Initialize the GUI application.
 
         @param db_manager: SQLiteManager instance for database interactions
+        @param retention_policies: Names of the configured retention policies, None offers the defaults
+        @param status_source: Returns the status snapshot of the ingest worker, e.g. IngestWorker.status, None if no worker runs in this process
+        @param status_interval_ms: Milliseconds between two refreshes of the status table
         """
         self.root = tk.Tk()
         self.root.title("ISP Performance Tracking")
-        self.root.geometry("650x500")  
+        self.root.geometry("820x760")
         self.root.configure(bg="#f0f0f0")  
 
         self.db_manager = db_manager
+        self.status_source = status_source
+        self.status_interval_ms = status_interval_ms
+        self.tasks = TaskQueue(self.root)
         self.asn_var = tk.StringVar()
         self.measurement_id_var = tk.StringVar()
         self.retention_policy_var = tk.StringVar()
         self.measurement_type_var = tk.StringVar()
 
-        self.retention_policies = ["24 hours", "7 days", "14 days"]
-        # self.measurement_types = ["Ping", "Traceroute", "Packetloss"] currently outcommented, because functionality of visulizing traceroute data is not given -> future developement
-        self.measurement_types = ["Ping", "Packetloss"]
+        self.retention_policies = retention_policies or list(RetentionPolicies.DEFAULTS)
+        self.measurement_types = ["Ping", "Traceroute", "Packetloss"]
 
         self.create_widgets()
 
@@ -62,7 +86,8 @@ class MeasurementApp:
         ttk.Combobox(input_frame, textvariable=self.measurement_type_var, values=self.measurement_types, state="readonly", width=33).grid(row=3, column=1, padx=10, pady=10, sticky=tk.W)
 
         # buttons
-        ttk.Button(input_frame, text="Add Measurement", command=self.on_add_measurement).grid(row=4, column=0, columnspan=2, pady=15)
+        self.add_button = ttk.Button(input_frame, text="Add Measurement", command=self.on_add_measurement)
+        self.add_button.grid(row=4, column=0, columnspan=2, pady=15)
         ttk.Button(input_frame, text="Exit", command=self.on_exit).grid(row=5, column=0, columnspan=2, pady=5)
 
         # info button
@@ -73,19 +98,94 @@ class MeasurementApp:
         credits_label = tk.Label(self.root, text="OTH Regensburg Bachelorthesis - Michael Faltermeier, 2025", font=("Arial", 9), fg="gray", bg="#f0f0f0")
         credits_label.pack(side="bottom", pady=10)  
 
+        self.create_status_table()
+
+    def create_status_table(self):
+        """Create the ingest status table below the input fields."""
+        status_frame = ttk.LabelFrame(self.root, text="Ingest Status", padding=5)
+        status_frame.pack(fill="both", expand=True, padx=15, pady=(0, 5))
+
+        if self.status_source is None:
+            ttk.Label(status_frame, text="The ingest worker does not run in this process, no status available.").pack(pady=10)
+            return
+
+        self.status_tree = ttk.Treeview(status_frame, columns=[column for column, _, _ in self.STATUS_COLUMNS], show="headings", height=8)
+        for column, heading, width in self.STATUS_COLUMNS:
+            self.status_tree.heading(column, text=heading)
+            self.status_tree.column(column, width=width, anchor=tk.W if column in ("type", "state") else tk.E)
+        scrollbar = ttk.Scrollbar(status_frame, orient="vertical", command=self.status_tree.yview)
+        self.status_tree.configure(yscrollcommand=scrollbar.set)
+        self.status_tree.pack(side="left", fill="both", expand=True)
+        scrollbar.pack(side="right", fill="y")
+        self.refresh_status()
+
+    def refresh_status(self):
+        """Update the status table from the worker snapshot and schedule the next refresh."""
+        snapshot = self.status_source()
+        now = time.time()
+        for item in self.status_tree.get_children():
+            if item not in snapshot:
+                self.status_tree.delete(item)
+        for measurement_id in sorted(snapshot, key=lambda measurement_id: int(measurement_id) if measurement_id.isdigit() else 0):
+            values = self.format_status(measurement_id, snapshot[measurement_id], now)
+            if self.status_tree.exists(measurement_id):
+                self.status_tree.item(measurement_id, values=values)
+            else:
+                self.status_tree.insert("", tk.END, iid=measurement_id, values=values)
+        self.root.after(self.status_interval_ms, self.refresh_status)
+
+    @staticmethod
+    def format_status(measurement_id: str, status: dict, now: float) -> tuple:
+        """
+        Format the status of a measurement as a row of the status table.
+
+        @param measurement_id: Measurement ID
+        @param status: Status of the measurement as published by the worker
+        @param now: Current unix time
+        @return: Values in the order of STATUS_COLUMNS
+        """
+        def duration(seconds: float) -> str:
+            if seconds < 120:
+                return f"{seconds:.0f}s"
+            if seconds < 7200:
+                return f"{seconds / 60:.0f}m"
+            return f"{seconds / 3600:.1f}h"
+
+        watermark = status.get("watermark", 0)
+        last_run = status.get("last_run")
+        if status.get("running"):
+            state = "running"
+        elif status.get("failed"):
+            state = f"error: {status['last_error']}"
+        elif status.get("streaming"):
+            state = "streaming"
+        else:
+            state = "idle" if last_run else "waiting"
+        return (
+            measurement_id,
+            status.get("measurement_type", ""),
+            duration(max(0.0, now - watermark)) if watermark else "-",
+            time.strftime("%H:%M:%S", time.localtime(last_run)) if last_run else "-",
+            f"{status['last_duration']:.1f}s" if last_run else "-",
+            status.get("rows_written", 0),
+            status.get("errors", 0),
+            state,
+        )
+
+    LOGO_SIZE = (260, 110)
+
     def load_logo(self):
         """
         Load and display the logo centered at the top.
 
         The logo must be located at 'config/logo.png'. If not found, no error is displayed.
+        The resized logo is cached next to it, so PIL is only imported when the logo changed.
         """
         logo_path = "config/logo.png"
 
         if os.path.exists(logo_path):
             try:
-                image = Image.open(logo_path)
-                image = image.resize((260, 110), Image.LANCZOS)  
-                self.logo = ImageTk.PhotoImage(image)
+                self.logo = self.load_resized_logo(logo_path)
 
                 logo_label = tk.Label(self.root, image=self.logo, bg="#f0f0f0")
                 logo_label.pack(pady=(3, 8), anchor="center")  # ensures logo is at the top
@@ -94,13 +194,37 @@ class MeasurementApp:
         else:
             print("No logo found at 'config/logo.png'.")
 
+    def load_resized_logo(self, logo_path: str) -> tk.PhotoImage:
+        """
+        Returns the logo resized to LOGO_SIZE, from the cache if it is newer than the logo.
+
+        @param logo_path: Path to the original logo
+        @return: Image for a Tk widget
+        """
+        width, height = self.LOGO_SIZE
+        cache_path = f"{os.path.splitext(logo_path)[0]}_{width}x{height}.cache.png"
+
+        if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(logo_path):
+            return tk.PhotoImage(master=self.root, file=cache_path)  # Tk reads PNG natively
+
+        from PIL import Image, ImageTk  # only needed to resize a new or changed logo
+
+        image = Image.open(logo_path)
+        image = image.resize(self.LOGO_SIZE, Image.LANCZOS)
+        try:
+            image.save(cache_path)
+        except OSError as e:
+            logging.warning(f"Could not cache the resized logo: {e}")
+        return ImageTk.PhotoImage(image)
+
     def show_info(self):
         """Show information about the input fields."""
         info_text = (
             "🔹 ASN Number: The Autonomous System Number for the measurement.\n"
             "🔹 Measurement ID: The unique ID of the measurement from RIPE Atlas.\n"
             "🔹 Retention Policy: The time period data will be stored.\n"
-            "🔹 Measurement Type: The type of network measurement (Ping, Packetloss)."
+            "🔹 Measurement Type: The type of network measurement (Ping, Traceroute, Packetloss).\n"
+            "    Traceroute hops are only stored if a GeoIP database is configured."
         )
         messagebox.showinfo("Input Field Information", info_text)
 
@@ -119,21 +243,34 @@ class MeasurementApp:
             messagebox.showerror("Input Error", "ASN and Measurement ID must be numeric!")
             return
 
-        try:
-            self.db_manager.add_measurement(
-                measurement_id=measurement_id,
-                asn=asn,
-                bucket_name=f"AS_{asn}",
-                retention_policy=retention_policy,
-                interval=60,
-                measurement_type=measurement_type
-            )
-            messagebox.showinfo("Success", f"Measurement ID {measurement_id} added successfully.")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to add measurement: {e}")
+        def on_done(added: bool):
+            self.add_button.state(["!disabled"])
+            if added:
+                messagebox.showinfo("Success", f"Measurement ID {measurement_id} added successfully.")
+            else:
+                messagebox.showerror("Error", f"Failed to add measurement {measurement_id}, see the log for details.")
+
+        def on_error(error: Exception):
+            self.add_button.state(["!disabled"])
+            messagebox.showerror("Error", f"Failed to add measurement: {error}")
+
+        # the worker may hold the database lock for a while, the window stays responsive meanwhile
+        self.add_button.state(["disabled"])
+        self.tasks.submit(
+            self.db_manager.add_measurement,
+            measurement_id=measurement_id,
+            asn=asn,
+            bucket_name=f"AS_{asn}",
+            retention_policy=retention_policy,
+            interval=60,
+            measurement_type=measurement_type,
+            on_done=on_done,
+            on_error=on_error
+        )
 
     def on_exit(self):
         """Exit the application."""
+        self.tasks.close()
         self.root.quit()
         self.root.destroy()
 
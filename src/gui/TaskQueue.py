@@ -0,0 +1,77 @@
+import queue
+import logging
+import threading
+import tkinter as tk
+from typing import Any, Callable, Optional
+
+
+class TaskQueue:
+    """
+    Runs blocking calls, e.g. SQLite writes, on one background thread instead of the Tk thread.
+
+    Tk must only be used from the thread running the mainloop, so the outcome of every call is
+    put on a result queue, which the Tk thread polls with after() to run the callbacks. The
+    calls run one at a time in submission order.
+    """
+
+    def __init__(self, root: tk.Misc, poll_interval_ms: int = 100):
+        """
+        Starts the background thread.
+
+        @param root: Tk widget whose mainloop runs the callbacks
+        @param poll_interval_ms: Milliseconds between two polls of the result queue
+        """
+        self.root = root
+        self.poll_interval_ms = poll_interval_ms
+        self._tasks = queue.Queue()
+        self._results = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="gui-tasks", daemon=True)
+        self._thread.start()
+        self._poll_id = self.root.after(self.poll_interval_ms, self._poll)
+
+    def submit(self, function: Callable, *args: Any, on_done: Optional[Callable[[Any], None]] = None, on_error: Optional[Callable[[Exception], None]] = None, **kwargs: Any):
+        """
+        Queues a call, the callbacks run on the Tk thread once it returned.
+
+        @param function: Blocking function to call
+        @param on_done: Called with the return value
+        @param on_error: Called with the exception if the call raised
+        """
+        self._tasks.put((function, args, kwargs, on_done, on_error))
+
+    def close(self, timeout: float = 5.0):
+        """
+        Stops polling and waits up to timeout seconds for queued calls to finish.
+
+        @param timeout: Maximum seconds to wait
+        """
+        self.root.after_cancel(self._poll_id)
+        self._tasks.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        """Loop of the background thread."""
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            function, args, kwargs, on_done, on_error = task
+            try:
+                self._results.put((on_done, function(*args, **kwargs)))
+            except Exception as e:
+                logging.error(f"Background task {getattr(function, '__name__', function)} failed: {e}")
+                self._results.put((on_error, e))
+
+    def _poll(self):
+        """Runs the callbacks of finished calls, on the Tk thread."""
+        while True:
+            try:
+                callback, value = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if callback is not None:
+                try:
+                    callback(value)
+                except Exception as e:
+                    logging.error(f"Background task callback failed: {e}")
+        self._poll_id = self.root.after(self.poll_interval_ms, self._poll)
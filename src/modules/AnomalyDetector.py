@@ -0,0 +1,249 @@
+import math
+import time
+import sqlite3
+import logging
+import threading
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from modules.DataProcessor import DataProcessor
+from modules.Metrics import Metrics
+
+
+class AnomalyDetector:
+    """
+    Flags latency and packet loss anomalies of ping results as they are ingested.
+
+    Every (measurement, probe, target) series has a baseline that is updated in O(1) per
+    result: an exponentially weighted moving mean and variance of the latency, a slow EWMA of
+    the loss ratio, and the lost and sent packets of its last loss_window results in a ring
+    buffer with running sums. A result is anomalous if its latency is more than threshold
+    standard deviations away from the mean, or if the loss ratio of the window exceeds the
+    baseline loss ratio by loss_threshold. Series need warmup results before they are judged.
+
+    The state of all series is held in flat arrays of the array module indexed by a slot per
+    series, so thousands of series cost a few hundred bytes each and no object per result.
+    Changed slots are checkpointed to a SQLite file every checkpoint_interval seconds and on
+    shutdown, and the state of a measurement is loaded from it when its first result of the
+    process arrives, so restarts and lease handovers keep the baselines.
+
+    Results older than the newest one of their series are only counted as out of order, the
+    baselines follow the series in time order.
+    """
+
+    def __init__(self, path: str, alpha: float = 0.05, threshold: float = 4.0, warmup: int = 20, min_stddev: float = 1.0, loss_window: int = 20, loss_threshold: float = 0.3, loss_alpha: float = 0.01, checkpoint_interval: float = 60.0, metrics: Optional[Metrics] = None):
+        """
+        Initializes the AnomalyDetector.
+
+        @param path: Path to the SQLite state file
+        @param alpha: Weight of a new latency in the moving mean and variance
+        @param threshold: Standard deviations a latency must be away from the mean to be anomalous
+        @param warmup: Results a series needs before it is judged
+        @param min_stddev: Lower bound of the standard deviation in ms, so very stable series do not flag jitter
+        @param loss_window: Number of results in the loss window of a series, at most 255
+        @param loss_threshold: Loss ratio above the baseline that makes a window anomalous
+        @param loss_alpha: Weight of a new loss ratio in the baseline loss ratio
+        @param checkpoint_interval: Minimum seconds between two checkpoints of changed series
+        @param metrics: Metrics registry for the anomaly counts, a private one is created if None
+        """
+        self.path = path
+        self.alpha = alpha
+        self.threshold = threshold
+        self.warmup = max(1, int(warmup))
+        self.min_stddev = min_stddev
+        self.loss_window = min(255, max(1, int(loss_window)))
+        self.loss_threshold = loss_threshold
+        self.loss_alpha = loss_alpha
+        self.checkpoint_interval = checkpoint_interval
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._initialize_store()
+
+        self._slots: Dict[Tuple[str, str, str], int] = {}
+        self._loaded = set()  # measurement IDs whose checkpointed state was loaded
+        self._dirty = set()
+        self._next_checkpoint = time.monotonic() + checkpoint_interval
+        # per slot
+        self._mean = array("d")
+        self._var = array("d")
+        self._count = array("I")  # results with a latency
+        self._results = array("I")
+        self._last = array("q")
+        self._loss_mean = array("d")
+        self._lost_sum = array("I")
+        self._sent_sum = array("I")
+        self._position = array("B")
+        # loss_window entries per slot
+        self._lost = array("B")
+        self._sent = array("B")
+
+        metrics = metrics or Metrics()
+        self._anomalies = metrics.counter("anomalies_total", "Anomalous results by kind.", ("measurement", "kind"))
+        self._out_of_order = metrics.counter("anomaly_out_of_order_total", "Results older than the newest result of their series, not added to the baseline.", ("measurement",))
+        metrics.gauge("anomaly_series", "Series with a baseline in memory.").set_function(function=lambda: len(self._slots))
+        logging.info(f"AnomalyDetector initialized at '{path}'.")
+
+    def _initialize_store(self):
+        """Initialize the state file."""
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL;")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS anomaly_state (
+                    measurement_id TEXT,
+                    probe_id TEXT,
+                    target TEXT,
+                    mean REAL,
+                    var REAL,
+                    count INTEGER,
+                    results INTEGER,
+                    last_timestamp INTEGER,
+                    loss_mean REAL,
+                    loss_window BLOB,
+                    PRIMARY KEY (measurement_id, probe_id, target)
+                ) WITHOUT ROWID;
+            """)
+            self._conn.commit()
+
+    def _slot(self, key: Tuple[str, str, str]) -> int:
+        """Returns the slot of a series, appending a new one for an unknown series."""
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = len(self._mean)
+            for column in (self._mean, self._var, self._loss_mean):
+                column.append(0.0)
+            for column in (self._count, self._results, self._last, self._lost_sum, self._sent_sum, self._position):
+                column.append(0)
+            self._lost.extend(bytes(self.loss_window))
+            self._sent.extend(bytes(self.loss_window))
+        return slot
+
+    def _load(self, measurement_id: str):
+        """Loads the checkpointed state of a measurement, called with the lock held."""
+        self._loaded.add(measurement_id)
+        try:
+            rows = self._conn.execute("SELECT probe_id, target, mean, var, count, results, last_timestamp, loss_mean, loss_window FROM anomaly_state WHERE measurement_id = ?;", (measurement_id,)).fetchall()
+        except Exception as e:
+            logging.error(f"ID: {measurement_id} - error loading anomaly baselines, starting new ones: {e}")
+            return
+        window = self.loss_window
+        for probe_id, target, mean, var, count, results, last, loss_mean, ring in rows:
+            slot = self._slot((measurement_id, probe_id, target))
+            self._mean[slot], self._var[slot], self._loss_mean[slot] = mean, var, loss_mean
+            self._count[slot], self._results[slot], self._last[slot] = count, results, last
+            if len(ring) == 2 * window + 1:  # a window of another length is started over
+                offset = slot * window
+                self._lost[offset:offset + window] = array("B", ring[:window])
+                self._sent[offset:offset + window] = array("B", ring[window:2 * window])
+                self._position[slot] = ring[-1]
+                self._lost_sum[slot] = sum(ring[:window])
+                self._sent_sum[slot] = sum(ring[window:2 * window])
+        logging.info(f"ID: {measurement_id} - loaded {len(rows)} anomaly baselines.")
+
+    def detect(self, measurement_results: Iterable[Dict[str, Any]], retention_seconds: int, current_time: int) -> List[bytes]:
+        """
+        Adds ping results to the baselines of their series and returns the anomalies among them.
+
+        @param measurement_results: Ping measurement results
+        @param retention_seconds: Retention period in seconds, older anomalies update the baselines but are not written
+        @param current_time: Current unix timestamp
+        @return: List of line protocol lines of the measurement "anomaly"
+        """
+        results = sorted(measurement_results, key=lambda r: r.get("timestamp", current_time))
+        alpha, loss_alpha, window = self.alpha, self.loss_alpha, self.loss_window
+        mean, var, count, seen, last, loss_mean = self._mean, self._var, self._count, self._results, self._last, self._loss_mean
+        lost_ring, sent_ring, lost_sum, sent_sum, position = self._lost, self._sent, self._lost_sum, self._sent_sum, self._position
+        lines = []
+        with self._lock:
+            for result in results:
+                measurement_id = str(result.get("msm_id", "unknown"))
+                if measurement_id not in self._loaded:
+                    self._load(measurement_id)
+                key = (measurement_id, str(result.get("prb_id", "unknown")), str(result.get("dst_addr", "unknown")))
+                slot = self._slot(key)
+                timestamp = result.get("timestamp", current_time)
+                if timestamp <= last[slot]:
+                    self._out_of_order.inc(measurement_id)
+                    continue
+                last[slot] = timestamp
+                self._dirty.add(slot)
+                write = current_time - timestamp <= retention_seconds
+
+                latency = result.get("avg")
+                if latency is not None and latency >= 0:
+                    if count[slot] == 0:
+                        mean[slot] = latency
+                    else:
+                        stddev = max(math.sqrt(var[slot]), self.min_stddev)
+                        score = (latency - mean[slot]) / stddev
+                        if count[slot] >= self.warmup and abs(score) > self.threshold:
+                            self._anomalies.inc(measurement_id, "latency")
+                            if write:
+                                lines.append(self._line(key, "latency", latency, mean[slot], score, timestamp))
+                        # West's incremental EWMA of mean and variance
+                        difference = latency - mean[slot]
+                        increment = alpha * difference
+                        mean[slot] += increment
+                        var[slot] = (1 - alpha) * (var[slot] + difference * increment)
+                    count[slot] += 1
+
+                sent = min(255, max(0, result.get("sent") or 0))
+                lost = min(sent, max(0, sent - (result.get("rcvd") or 0)))
+                offset = slot * window + position[slot]
+                lost_sum[slot] += lost - lost_ring[offset]
+                sent_sum[slot] += sent - sent_ring[offset]
+                lost_ring[offset], sent_ring[offset] = lost, sent
+                position[slot] = (position[slot] + 1) % window
+                n = seen[slot]
+                if sent:
+                    ratio = lost_sum[slot] / sent_sum[slot]
+                    if n >= self.warmup and ratio - loss_mean[slot] > self.loss_threshold:
+                        self._anomalies.inc(measurement_id, "loss")
+                        if write:
+                            lines.append(self._line(key, "loss", ratio, loss_mean[slot], ratio - loss_mean[slot], timestamp))
+                    loss_mean[slot] = lost / sent if n == 0 else loss_mean[slot] + loss_alpha * (lost / sent - loss_mean[slot])
+                seen[slot] = n + 1
+
+        if time.monotonic() >= self._next_checkpoint:
+            self.checkpoint()
+        return lines
+
+    @staticmethod
+    def _line(key: Tuple[str, str, str], kind: str, value: float, baseline: float, score: float, timestamp: int) -> bytes:
+        """Serializes one anomaly."""
+        tags = DataProcessor.format_tags({"msm_id": key[0], "probe_id": key[1], "target": key[2], "kind": kind})
+        fields = ",".join(f"{name}={DataProcessor.format_field_value(float(field))}" for name, field in (("baseline", baseline), ("score", score), ("value", value)))
+        return f"anomaly{tags} {fields} {timestamp * 1_000_000_000}".encode()
+
+    def checkpoint(self) -> int:
+        """
+        Stores the state of all series that changed since the last checkpoint.
+
+        @return: Number of stored series
+        """
+        self._next_checkpoint = time.monotonic() + self.checkpoint_interval
+        window = self.loss_window
+        with self._lock:
+            if not self._dirty:
+                return 0
+            keys = {slot: key for key, slot in self._slots.items() if slot in self._dirty}
+            rows = []
+            for slot, key in keys.items():
+                offset = slot * window
+                ring = self._lost[offset:offset + window].tobytes() + self._sent[offset:offset + window].tobytes() + bytes((self._position[slot],))
+                rows.append(key + (self._mean[slot], self._var[slot], self._count[slot], self._results[slot], self._last[slot], self._loss_mean[slot], ring))
+            try:
+                with self._conn:
+                    self._conn.executemany("INSERT OR REPLACE INTO anomaly_state VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);", rows)
+            except Exception as e:
+                logging.error(f"Error checkpointing anomaly baselines: {e}")
+                return 0
+            self._dirty.clear()
+        logging.debug(f"Checkpointed {len(rows)} anomaly baselines.")
+        return len(rows)
+
+    def close(self):
+        """
+        Checkpoints the changed series and closes the state file.
+        """
+        self.checkpoint()
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,199 @@
+import time
+import logging
+import threading
+from concurrent.futures import wait
+from typing import Optional, Tuple
+from modules.IngestWorker import IngestWorker
+from modules.Metrics import Metrics
+from modules.RIPEAtlasAPI import RIPEAtlasAPI
+
+
+class Backfill:
+    """
+    Imports the history of a measurement in parallel time chunks with per-chunk checkpoints.
+
+    plan() splits the backfill window into chunks and stores them in the backfill_chunks table.
+    run() fetches the pending chunks on the thread pool of an IngestWorker, so at most its
+    max_concurrency chunks are in flight, transforms them and appends them to its write spool.
+    A chunk is checkpointed as done only after all its lines are spooled, so an interrupted
+    backfill resumes with the chunks that are not done yet; a partly spooled chunk is fetched
+    again, which rewrites identical points.
+
+    Chunk bounds are aligned to the rollup window, so every chunk holds complete windows and its
+    latency rollups are computed on the chunk alone, independent of the order the chunks finish.
+    If the worker has a RollupStore, the local rollups of a chunk are stored with its checkpoint,
+    once per chunk even if the chunk is fetched again. The probe watermarks are raised to the
+    results of the chunks at the end of the window, so a live poll that sweeps the late tolerance
+    does not process them a second time. History is not added to the anomaly baselines, which
+    follow the live results in time order.
+    """
+
+    def __init__(self, ingest_worker: IngestWorker, chunk_seconds: int = RIPEAtlasAPI.DEFAULT_CHUNK_SECONDS, window_seconds: int = 1, retry_interval: float = 1.0, metrics: Optional[Metrics] = None):
+        """
+        Initializes the Backfill.
+
+        @param ingest_worker: IngestWorker whose API client, transform, spool and thread pool are used
+        @param chunk_seconds: Length of a chunk in seconds, rounded up to a multiple of window_seconds
+        @param window_seconds: Length of a rollup window in seconds
+        @param retry_interval: Seconds to wait before spooling again while the spool is full
+        @param metrics: Metrics registry for the chunk and result counts, a private one is created if None
+        """
+        self.ingest_worker = ingest_worker
+        self.db_manager = ingest_worker.db_manager
+        self.window_seconds = max(1, int(window_seconds))
+        self.chunk_seconds = -(-max(1, int(chunk_seconds)) // self.window_seconds) * self.window_seconds
+        self.retry_interval = retry_interval
+        self._stopped = threading.Event()
+
+        metrics = metrics or Metrics()
+        self._chunks = metrics.counter("backfill_chunks_total", "Backfill chunks processed.", ("measurement", "status"))
+        self._results = metrics.counter("backfill_results_total", "Results imported by backfills.", ("measurement",))
+
+    def window(self, measurement: tuple, start: int, now: Optional[int] = None) -> Tuple[int, int]:
+        """
+        Returns the aligned backfill window of a measurement.
+
+        The window ends where the live ingestion starts: at the stored watermark, or at the last
+        window boundary before now for a measurement that was never polled. It starts no earlier
+        than the raw retention of the measurement, results that would expire right away are not
+        requested.
+
+        @param measurement: Measurement record
+        @param start: Unix timestamp of the oldest result to import
+        @param now: Current unix timestamp
+        @return: (start, stop) of the closed interval to import, empty if start > stop
+        @raise KeyError: If the retention policy of the measurement is not defined
+        """
+        now = int(time.time()) if now is None else now
+        start = max(start, now - self.ingest_worker.retention_policies.seconds(measurement[4]))
+        stop = self.db_manager.get_last_processed(measurement[1]) or now
+        stop -= stop % self.window_seconds
+        return start - start % self.chunk_seconds, stop - 1
+
+    def plan(self, measurement: tuple, start: int, restart: bool = False) -> int:
+        """
+        Stores the chunks of a new backfill, or keeps the chunks of a previous one to resume it.
+
+        If the measurement has no watermark yet, it is set to the end of the backfill window, so
+        the live ingestion only polls the results after it.
+
+        @param measurement: Measurement record
+        @param start: Unix timestamp of the oldest result to import
+        @param restart: Drop the chunks of a previous backfill of the measurement and plan a new one
+        @return: Number of pending chunks, 0 if a previous backfill is complete
+        """
+        measurement_id = measurement[1]
+        if restart:
+            self.db_manager.delete_backfill_chunks(measurement_id)
+        chunks = self.db_manager.get_backfill_chunks(measurement_id)
+        if chunks:
+            logging.info(f"ID: {measurement_id} - resuming the backfill of {chunks[0][0]} to {chunks[-1][1]}.")
+        else:
+            window_start, window_stop = self.window(measurement, start)
+            self.db_manager.add_backfill_chunks(measurement_id, RIPEAtlasAPI.split_time_window(window_start, window_stop, self.chunk_seconds))
+            # hands everything after the window to the live ingestion
+            self.db_manager.raise_last_processed(measurement_id, window_stop)
+            logging.info(f"ID: {measurement_id} - planned a backfill of {window_start} to {window_stop}.")
+        return len(self.db_manager.get_backfill_chunks(measurement_id, pending_only=True))
+
+    def run(self, measurement: tuple) -> bool:
+        """
+        Processes the pending chunks of a measurement in parallel and waits until all are done.
+
+        @param measurement: Measurement record
+        @return: True if every chunk of the backfill is done
+        """
+        measurement_id, _, bucket_name, retention_policy = measurement[1:5]
+        pending = self.db_manager.get_backfill_chunks(measurement_id, pending_only=True)
+        if not pending:
+            return True
+        reason = self.ingest_worker.unsupported(measurement[6])
+        if reason is not None:
+            logging.error(f"ID: {measurement_id} - cannot backfill, {reason}.")
+            return False
+        self.ingest_worker.bucket_manager.ensure_bucket(bucket_name, retention_policy)
+        logging.info(f"ID: {measurement_id} - backfilling {len(pending)} chunks with up to {self.ingest_worker.max_concurrency} in parallel.")
+
+        futures = [self.ingest_worker.executor.submit(self._run_chunk, measurement, chunk_start, chunk_stop) for chunk_start, chunk_stop, _, _ in pending]
+        try:
+            wait(futures)
+        finally:
+            # on an interrupt, chunks that did not start yet stay pending for the next run
+            for future in futures:
+                future.cancel()
+        remaining = len(self.db_manager.get_backfill_chunks(measurement_id, pending_only=True))
+        if remaining:
+            logging.warning(f"ID: {measurement_id} - {remaining} backfill chunks are not done, run the backfill again to resume.")
+        return remaining == 0
+
+    def stop(self):
+        """
+        Makes running chunks return without a checkpoint and skips the chunks that did not start.
+        """
+        self._stopped.set()
+
+    def _run_chunk(self, measurement: tuple, chunk_start: int, chunk_stop: int) -> bool:
+        """
+        Fetches, transforms and spools one chunk and checkpoints it.
+
+        @param measurement: Measurement record
+        @param chunk_start: First timestamp of the chunk
+        @param chunk_stop: Last timestamp of the chunk
+        @return: True if the chunk is done
+        """
+        measurement_id, _, bucket_name, retention_policy, _, measurement_type = measurement[1:7]
+        label = str(measurement_id)
+        if self._stopped.is_set():
+            return False
+        worker = self.ingest_worker
+        aggregator = worker.data_processor.aggregator if measurement_type.lower() in ["ping", "packetloss"] else None
+        rollup_parts = []
+        local_rollups = {}
+        probes = {}
+        count = 0
+        try:
+            retention_seconds = worker.retention_policies.seconds(retention_policy)
+            for results in worker.ripe_api.stream_measurement_results(int(measurement_id), start=chunk_start, stop=chunk_stop):
+                count += len(results)
+                for result in results:
+                    probe, timestamp = result.get("prb_id"), result.get("timestamp", 0)
+                    if timestamp > probes.get(probe, 0):
+                        probes[probe] = timestamp
+                if aggregator is not None:
+                    rollup_parts.append(aggregator.to_columns(results, retention_seconds, int(time.time())))
+                    if worker.rollup_store is not None:
+                        worker.rollup_store.collect(results, local_rollups)
+                if not self._spool(bucket_name, worker.transform(measurement_id, measurement_type, results, retention_seconds, rollups=False, anomalies=False)):
+                    return False
+            if aggregator is not None and not self._spool(bucket_name, aggregator.rollup(measurement_id, rollup_parts)):
+                return False
+        except Exception as e:
+            self._chunks.inc(label, "failed")
+            logging.error(f"ID: {measurement_id} - error backfilling {chunk_start} to {chunk_stop}: {e}")
+            return False
+
+        # only probes inside the late tolerance of the live watermark matter to the live polls
+        floor = (self.db_manager.get_last_processed(measurement_id) or 0) - worker.late_tolerance
+        probes = {probe: timestamp for probe, timestamp in probes.items() if timestamp > floor}
+        if probes:
+            self.db_manager.update_probe_watermarks(measurement_id, probes)
+        if worker.rollup_store is not None:
+            worker.rollup_store.store(measurement_id, measurement[2], retention_seconds, local_rollups, source=f"backfill:{measurement_id}:{chunk_start}:{chunk_stop}")
+        self.db_manager.complete_backfill_chunk(measurement_id, chunk_start, count)
+        self._chunks.inc(label, "done")
+        self._results.inc(label, amount=count)
+        logging.info(f"ID: {measurement_id} - backfilled {count} results of {chunk_start} to {chunk_stop}.")
+        return True
+
+    def _spool(self, bucket_name: str, points: list) -> bool:
+        """
+        Appends lines to the spool, waiting while it is full.
+
+        @param bucket_name: Name of the target bucket
+        @param points: Line protocol lines
+        @return: True once spooled, False if the backfill was stopped first
+        """
+        while not self.ingest_worker.spool.append(bucket_name, points):
+            if self._stopped.wait(self.retry_interval):
+                return False
+        return True
@@ -0,0 +1,233 @@
+import time
+import random
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Dict, List, Tuple, Any, Optional
+from influxdb_client import InfluxDBClient
+from influxdb_client.client.write_api import SYNCHRONOUS
+from modules.Metrics import Metrics
+
+
+class WriteRejectedError(Exception):
+    """
+    Raised by a submission Future when InfluxDB rejected the records, retrying them cannot succeed.
+    """
+
+
+class BatchWriter:
+    """
+    Groups records per bucket and writes them to InfluxDB in batches.
+
+    Records are queued with submit() and written by a single background thread, either when
+    batch_size records are queued or when the oldest queued record is flush_interval seconds
+    old. Each submission gets a Future that resolves to True once all of its records were
+    stored and to False if the write finally failed, so callers can acknowledge data only
+    after it is actually in InfluxDB. While more than max_pending records are queued or being
+    written, submit() blocks, which slows the producers down when InfluxDB is slow.
+    """
+
+    def __init__(self, influx_client: InfluxDBClient, batch_size: int = 5000, flush_interval: float = 1.0, max_retries: int = 3, retry_interval: float = 1.0, max_jitter: float = 0.5, max_pending: int = 50000, metrics: Optional[Metrics] = None):
+        """
+        Initializes the BatchWriter and starts its flush thread.
+
+        @param influx_client: InfluxDBClient instance
+        @param batch_size: Number of queued records that triggers a flush, also the maximum records per write call
+        @param flush_interval: Maximum seconds a record stays queued before it is flushed
+        @param max_retries: Number of retries of a failed write call
+        @param retry_interval: Base delay in seconds before the first retry, doubled on every further retry
+        @param max_jitter: Maximum random delay in seconds added to every retry delay
+        @param max_pending: Number of queued and in-flight records above which submit() blocks
+        @param metrics: Metrics registry for write timings and failures, a private one is created if None
+        """
+        self.write_api = influx_client.write_api(write_options=SYNCHRONOUS)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval
+        self.max_jitter = max_jitter
+        self.max_pending = max_pending
+
+        self._condition = threading.Condition()
+        self._pending: Dict[str, List[Tuple[List[Any], Future]]] = {}
+        self._pending_count = 0
+        self._inflight_count = 0
+        self._oldest = None
+        self._closed = False
+
+        metrics = metrics or Metrics()
+        self._write_seconds = metrics.histogram("influx_write_seconds", "Seconds per InfluxDB write call, retries included.", ("bucket",))
+        self._written_records = metrics.counter("influx_written_records_total", "Records stored in InfluxDB.", ("bucket",))
+        self._write_retries = metrics.counter("influx_write_retries_total", "Retried InfluxDB write calls.", ("bucket",))
+        self._write_failures = metrics.counter("influx_write_failures_total", "InfluxDB writes that failed after all retries or were rejected.", ("bucket", "reason"))
+        metrics.gauge("influx_pending_records", "Records queued or being written to InfluxDB.").set_function(function=lambda: self._pending_count + self._inflight_count)
+
+        self._thread = threading.Thread(target=self._run, name="influx-writer", daemon=True)
+        self._thread.start()
+        logging.info("BatchWriter initialized.")
+
+    def submit(self, bucket: str, records: List[Any]) -> Future:
+        """
+        Queues records for a bucket.
+
+        @param bucket: Name of the target bucket
+        @param records: Records accepted by the InfluxDB write API (Point objects or line protocol)
+        @return: Future resolving to True when the records are stored, False if writing failed,
+                 raising WriteRejectedError if InfluxDB rejected them
+        """
+        future = Future()
+        if not records:
+            future.set_result(True)
+            return future
+
+        with self._condition:
+            # backpressure, a single oversized submission is still let through on an empty queue
+            while not self._closed and self._pending_count + self._inflight_count > 0 \
+                    and self._pending_count + self._inflight_count + len(records) > self.max_pending:
+                self._condition.wait()
+
+            if self._closed:
+                future.set_result(False)
+                return future
+
+            self._pending.setdefault(bucket, []).append((records, future))
+            self._pending_count += len(records)
+            if self._oldest is None:
+                # the flush thread sleeps without timeout while the queue is empty
+                self._oldest = time.monotonic()
+                self._condition.notify_all()
+            elif self._pending_count >= self.batch_size:
+                self._condition.notify_all()
+        return future
+
+    def write(self, bucket: str, records: List[Any]) -> bool:
+        """
+        Queues records for a bucket and waits until they are flushed.
+
+        @param bucket: Name of the target bucket
+        @param records: Records accepted by the InfluxDB write API
+        @return: True if the records are stored, False otherwise
+        @raise WriteRejectedError: If InfluxDB rejected the records
+        """
+        return self.submit(bucket, records).result()
+
+    def close(self):
+        """
+        Flushes all queued records and stops the flush thread.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        logging.info("BatchWriter closed.")
+
+    def _flush_due(self) -> bool:
+        """Checks whether the queued records must be flushed now. Caller holds the lock."""
+        if not self._pending:
+            return False
+        if self._closed or self._pending_count >= self.batch_size:
+            return True
+        return time.monotonic() - self._oldest >= self.flush_interval
+
+    def _run(self):
+        """Flush loop of the background thread."""
+        while True:
+            with self._condition:
+                while not self._flush_due():
+                    if self._closed and not self._pending:
+                        return
+                    timeout = None
+                    if self._oldest is not None:
+                        timeout = max(0.0, self._oldest + self.flush_interval - time.monotonic())
+                    self._condition.wait(timeout)
+
+                pending, self._pending = self._pending, {}
+                count = self._pending_count
+                self._inflight_count += count
+                self._pending_count = 0
+                self._oldest = None
+
+            try:
+                for bucket, submissions in pending.items():
+                    self._flush_bucket(bucket, submissions)
+            finally:
+                with self._condition:
+                    self._inflight_count -= count
+                    self._condition.notify_all()
+
+    def _flush_bucket(self, bucket: str, submissions: List[Tuple[List[Any], Future]]):
+        """
+        Writes all queued records of one bucket and resolves their futures.
+
+        @param bucket: Name of the target bucket
+        @param submissions: List of (records, future) tuples queued for the bucket
+        """
+        for (_, future), outcome in zip(submissions, self._write_submissions(bucket, submissions)):
+            if isinstance(outcome, WriteRejectedError):
+                future.set_exception(outcome)
+            else:
+                future.set_result(outcome)
+
+    def _write_submissions(self, bucket: str, submissions: List[Tuple[List[Any], Future]]) -> List[Any]:
+        """
+        Writes the records of several submissions together in batch_size slices.
+
+        If InfluxDB rejects a slice, the submissions are bisected and written again until every
+        rejected submission is written alone, so valid records that shared a slice with invalid
+        ones are still stored. Writing a record again overwrites the identical point.
+
+        @param bucket: Name of the target bucket
+        @param submissions: List of (records, future) tuples
+        @return: Outcome per submission: True if stored, False if writing failed, or the WriteRejectedError
+        """
+        records = [record for batch, _ in submissions for record in batch]
+        rejected = None
+        for start in range(0, len(records), self.batch_size):
+            try:
+                if not self._write_with_retry(bucket, records[start:start + self.batch_size]):
+                    return [False] * len(submissions)
+            except WriteRejectedError as e:
+                rejected = e
+
+        if rejected is None:
+            return [True] * len(submissions)
+        if len(submissions) == 1:
+            return [rejected]
+        logging.warning(f"InfluxDB rejected records of {len(submissions)} submissions for bucket '{bucket}', writing them separately.")
+        middle = len(submissions) // 2
+        return self._write_submissions(bucket, submissions[:middle]) + self._write_submissions(bucket, submissions[middle:])
+
+    def _write_with_retry(self, bucket: str, records: List[Any]) -> bool:
+        """
+        Writes one batch, retrying with exponential backoff and jitter.
+
+        @param bucket: Name of the target bucket
+        @param records: Records of the batch
+        @return: True if the batch was written, False after the last failed attempt
+        @raise WriteRejectedError: If InfluxDB rejected the batch with a client error
+        """
+        start = time.perf_counter()
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    self.write_api.write(bucket=bucket, record=records)
+                    self._written_records.inc(bucket, amount=len(records))
+                    logging.debug(f"Wrote {len(records)} records to bucket '{bucket}'.")
+                    return True
+                except Exception as e:
+                    status = getattr(e, "status", None)
+                    if isinstance(status, int) and 400 <= status < 500 and status != 429:
+                        # rejected data (e.g. a field type conflict) does not get better by retrying
+                        self._write_failures.inc(bucket, "rejected")
+                        raise WriteRejectedError(f"InfluxDB rejected {len(records)} records for bucket '{bucket}' with status {status}: {e}")
+                    if attempt == self.max_retries:
+                        self._write_failures.inc(bucket, "failed")
+                        logging.error(f"Writing {len(records)} records to bucket '{bucket}' failed after {attempt + 1} attempts: {e}")
+                        return False
+                    delay = self.retry_interval * (2 ** attempt) + random.uniform(0, self.max_jitter)
+                    self._write_retries.inc(bucket)
+                    logging.warning(f"Writing to bucket '{bucket}' failed ({e}), retrying in {delay:.1f}s.")
+                    time.sleep(delay)
+            return False
+        finally:
+            self._write_seconds.observe(bucket, value=time.perf_counter() - start)
@@ -1,25 +1,92 @@
+import time
 import logging
-from influxdb_client import InfluxDBClient, BucketsApi
+import threading
+from typing import Dict, Optional, Tuple
+from influxdb_client import InfluxDBClient
 from influxdb_client.domain.bucket_retention_rules import BucketRetentionRules
+from influxdb_client.domain.task_create_request import TaskCreateRequest
+from influxdb_client.domain.task_update_request import TaskUpdateRequest
+from modules.RetentionPolicies import RetentionPolicies
 
 
 class BucketManager:
     """
     Manages creation and verification of buckets in InfluxDB.
+
+    Known bucket names are cached in-process for cache_ttl seconds. A miss on a stale cache
+    reloads all bucket names of the organization in one paginated listing, a miss on a fresh
+    cache only looks up the single name. Requests to InfluxDB are made without holding the
+    cache lock, so a slow request only delays the threads that need the same bucket.
+
+    A bucket gets the raw retention of its RetentionPolicies entry. Every downsampling tier of
+    the policy gets a bucket <name>_<window> with the tier retention and a task that writes the
+    <window> means of the latency and packetloss series of the raw bucket into it. A task runs
+    task_offset after its window ends and recomputes every window that may still receive
+    results within late_tolerance, overwriting the means it wrote before, so late results reach
+    the tiers without holding back the current window. The tiers of existing buckets are checked
+    as well, at most every cache_ttl seconds, and tasks with an outdated script are updated.
     """
 
-    def __init__(self, influx_url: str, org: str, token: str):
+    PAGE_SIZE = 100  # buckets per page of the bulk listing
+    DOWNSAMPLED_MEASUREMENTS = ("latency", "packetloss")
+
+    def __init__(self, influx_url: str, org: str, token: str, cache_ttl: float = 300.0, retention_policies: Optional[RetentionPolicies] = None, task_offset: int = 300, late_tolerance: int = 3600):
         """
         Initializes the BucketManager.
 
         @param influx_url: InfluxDB instance URL
         @param org: Organization name in InfluxDB
         @param token: API token for authentication
+        @param cache_ttl: Seconds a known bucket name is trusted without asking InfluxDB again
+        @param retention_policies: Retention policies of the buckets, None uses RetentionPolicies.DEFAULTS
+        @param task_offset: Seconds a downsampling task waits after its window ends before it runs
+        @param late_tolerance: Seconds a result may arrive late, downsampling tasks recompute the windows it covers
         """
         self.client = InfluxDBClient(url=influx_url, token=token, org=org)
         self.buckets_api = self.client.buckets_api()
+        self.tasks_api = self.client.tasks_api()
+        self.cache_ttl = cache_ttl
+        self.retention_policies = retention_policies or RetentionPolicies.from_mapping(RetentionPolicies.DEFAULTS)
+        self.task_offset = task_offset
+        self.late_tolerance = max(0, int(late_tolerance))
+        self._known_buckets: Dict[str, float] = {}  # bucket name -> monotonic time it was last confirmed
+        self._last_refresh: Optional[float] = None
+        self._known_tiers: Dict[Tuple[str, str], float] = {}  # (bucket name, policy) -> monotonic time its tiers were confirmed
+        self._lock = threading.RLock()
+        self._bucket_locks: Dict[str, threading.Lock] = {}  # serializes check and creation per bucket name
         logging.info("BucketManager initialized.")
 
+    def _is_fresh(self, confirmed_at: Optional[float]) -> bool:
+        """Checks whether a cache timestamp is younger than the TTL."""
+        return confirmed_at is not None and time.monotonic() - confirmed_at < self.cache_ttl
+
+    def refresh_cache(self):
+        """
+        Reloads the names of all buckets of the organization, following the pagination.
+        """
+        now = time.monotonic()
+        names = {bucket.name for bucket in self.buckets_api.find_buckets_iter(org=self.client.org, limit=self.PAGE_SIZE)}
+        with self._lock:
+            self._known_buckets = dict.fromkeys(names, now)
+            self._last_refresh = now
+        logging.debug(f"Bucket cache refreshed with {len(names)} buckets.")
+
+    def invalidate(self, bucket_name: Optional[str] = None):
+        """
+        Removes a bucket name, or the whole cache, so the next check asks InfluxDB again.
+
+        @param bucket_name: Name of the bucket, None to invalidate every entry
+        """
+        with self._lock:
+            if bucket_name is None:
+                self._known_buckets.clear()
+                self._known_tiers.clear()
+                self._last_refresh = None
+            else:
+                self._known_buckets.pop(bucket_name, None)
+                for key in [key for key in self._known_tiers if key[0] == bucket_name]:
+                    del self._known_tiers[key]
+
     def bucket_exists(self, bucket_name: str) -> bool:
         """
         Checks if a bucket exists in InfluxDB.
@@ -28,40 +95,139 @@ class BucketManager:
         @return: True if the bucket exists, False otherwise
         """
         try:
-            return any(bucket.name == bucket_name for bucket in self.buckets_api.find_buckets(org=self.client.org).buckets)
+            with self._lock:
+                if self._is_fresh(self._known_buckets.get(bucket_name)):
+                    return True
+                listing_fresh = self._is_fresh(self._last_refresh)
+
+            if not listing_fresh:
+                self.refresh_cache()
+                with self._lock:
+                    return bucket_name in self._known_buckets
+
+            # the listing is recent, so only this name can have appeared since
+            if self.buckets_api.find_buckets(org=self.client.org, name=bucket_name).buckets:
+                with self._lock:
+                    self._known_buckets[bucket_name] = time.monotonic()
+                return True
+            return False
         except Exception as e:
             logging.error(f"Error checking bucket existence: {e}")
             return False
 
+    def downsampling_flux(self, bucket_name: str, tier_bucket: str, window_seconds: int) -> str:
+        """
+        Builds the Flux script of the task that downsamples a raw bucket into a tier bucket.
+
+        @param bucket_name: Name of the raw bucket
+        @param tier_bucket: Name of the tier bucket
+        @param window_seconds: Aggregation window of the tier, also the task interval
+        @return: Flux script
+        """
+        window = RetentionPolicies.format_duration(window_seconds)
+        # whole windows only, a window cut by the range start would overwrite its mean with a partial one
+        lookback = window_seconds + -(-self.late_tolerance // window_seconds) * window_seconds
+        measurements = " or ".join(f'r._measurement == "{measurement}"' for measurement in self.DOWNSAMPLED_MEASUREMENTS)
+        return "\n".join((
+            f'option task = {{name: "downsample_{tier_bucket}", every: {window}, offset: {RetentionPolicies.format_duration(self.task_offset)}}}',
+            f'from(bucket: "{bucket_name}")',
+            f"    |> range(start: -{RetentionPolicies.format_duration(lookback)})",
+            f"    |> filter(fn: (r) => {measurements})",
+            "    |> aggregateWindow(every: task.every, fn: mean, createEmpty: false)",
+            f'    |> to(bucket: "{tier_bucket}")',
+        ))
+
+    def _ensure_tier(self, bucket_name: str, window_seconds: int, retention_seconds: int):
+        """
+        Creates the bucket and the downsampling task of one tier if they are missing, and updates a task with another script.
+
+        @raise Exception: If InfluxDB refuses a request
+        """
+        tier_bucket = f"{bucket_name}_{RetentionPolicies.format_duration(window_seconds)}"
+        changed = False
+        if not self.bucket_exists(tier_bucket):
+            self.buckets_api.create_bucket(bucket_name=tier_bucket, org=self.client.org, retention_rules=[BucketRetentionRules(type="expire", every_seconds=retention_seconds)])
+            with self._lock:
+                self._known_buckets[tier_bucket] = time.monotonic()
+            changed = True
+        task_name = f"downsample_{tier_bucket}"
+        flux = self.downsampling_flux(bucket_name, tier_bucket, window_seconds)
+        tasks = self.tasks_api.find_tasks(name=task_name, org=self.client.org)
+        if not tasks:
+            self.tasks_api.create_task(task_create_request=TaskCreateRequest(org=self.client.org, flux=flux, status="active", description=f"Downsamples {bucket_name} into {tier_bucket}"))
+            changed = True
+        elif tasks[0].flux != flux:
+            # e.g. after the late tolerance or the offset changed
+            self.tasks_api.update_task_request(task_id=tasks[0].id, task_update_request=TaskUpdateRequest(flux=flux))
+            changed = True
+        if changed:
+            logging.info(f"Downsampling tier '{tier_bucket}' with retention {RetentionPolicies.format_duration(retention_seconds)} is provisioned.")
+
+    def ensure_tiers(self, bucket_name: str, retention_policy: str):
+        """
+        Provisions the downsampling tiers of a bucket, unless they were confirmed within cache_ttl.
+
+        @param bucket_name: Name of the raw bucket
+        @param retention_policy: Name of a policy of the RetentionPolicies
+        @raise KeyError: If the retention policy is not defined
+        """
+        policy = self.retention_policies.get(retention_policy)
+        if not policy.tiers:
+            return
+        key = (bucket_name, retention_policy)
+        with self._lock:
+            if self._is_fresh(self._known_tiers.get(key)):
+                return
+        try:
+            for window_seconds, retention_seconds in policy.tiers:
+                self._ensure_tier(bucket_name, window_seconds, retention_seconds)
+        except Exception as e:
+            logging.error(f"Error provisioning the downsampling tiers of bucket '{bucket_name}': {e}")
+            return
+        with self._lock:
+            self._known_tiers[key] = time.monotonic()
+
     def create_bucket(self, bucket_name: str, retention_policy: str):
         """
         Creates a new bucket in InfluxDB with a specified retention policy.
 
+        The tiers of the policy are provisioned first, the raw bucket last, so a bucket whose
+        tiers failed is missing and provisioned again by the next ensure_bucket.
+
         @param bucket_name: Name of the bucket to create
-        @param retention_policy: Retention policy duration
+        @param retention_policy: Name of a policy of the RetentionPolicies
+        @raise KeyError: If the retention policy is not defined
         """
-        retention_seconds = {
-            "24 hours": 86400,
-            "7 days": 604800,
-            "14 days": 1209600
-        }.get(retention_policy, 0)
-
-        retention_rule = BucketRetentionRules(type="expire", every_seconds=retention_seconds)
+        policy = self.retention_policies.get(retention_policy)
+        retention_rule = BucketRetentionRules(type="expire", every_seconds=policy.seconds)
 
         try:
+            for window_seconds, retention_seconds in policy.tiers:
+                self._ensure_tier(bucket_name, window_seconds, retention_seconds)
             self.buckets_api.create_bucket(bucket_name=bucket_name, org=self.client.org, retention_rules=[retention_rule])
+            with self._lock:
+                self._known_buckets[bucket_name] = time.monotonic()
+                self._known_tiers[(bucket_name, retention_policy)] = time.monotonic()
             logging.info(f"Bucket '{bucket_name}' with retention '{retention_policy}' created successfully.")
         except Exception as e:
             logging.error(f"Error creating bucket '{bucket_name}': {e}")
 
     def ensure_bucket(self, bucket_name: str, retention_policy: str):
         """
-        Ensures that a bucket exists. Creates it if it does not exist.
+        Ensures that a bucket and its downsampling tiers exist. Creates what does not exist.
+
+        The check and the creation run under a lock of the bucket name, so concurrent workers never
+        create the same bucket twice, while checks of other buckets go ahead. The tiers of a bucket
+        that already exists are checked too, e.g. after tiers were added to its policy.
         """
         logging.debug(f"Checking if bucket '{bucket_name}' exists.")
-        if not self.bucket_exists(bucket_name):
-            logging.debug(f"Bucket '{bucket_name}' does not exist. Creating now...")
-            self.create_bucket(bucket_name, retention_policy)
-        else:
-            logging.debug(f"Bucket '{bucket_name}' already exists. Skipping creation.")
+        with self._lock:
+            bucket_lock = self._bucket_locks.setdefault(bucket_name, threading.Lock())
+        with bucket_lock:
+            if not self.bucket_exists(bucket_name):
+                logging.debug(f"Bucket '{bucket_name}' does not exist. Creating now...")
+                self.create_bucket(bucket_name, retention_policy)
+            else:
+                logging.debug(f"Bucket '{bucket_name}' already exists. Skipping creation.")
+                self.ensure_tiers(bucket_name, retention_policy)
 
@@ -1,58 +1,183 @@
+import math
 import time
 import logging
-import requests
-import urllib3
 from influxdb_client import Point
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterable, Optional, Tuple, TYPE_CHECKING
+from modules.GeoIPResolver import GeoIPResolver
+
+if TYPE_CHECKING:
+    from modules.AnomalyDetector import AnomalyDetector
+    from modules.LatencyAggregator import LatencyAggregator
+    from modules.PacketRTTProcessor import PacketRTTProcessor
+
+# escaping rules of the InfluxDB line protocol, identical to influxdb_client.Point
+_ESCAPE_KEY = str.maketrans({",": r"\,", " ": r"\ ", "=": r"\=", "\n": r"\n", "\t": r"\t", "\r": r"\r"})
+_ESCAPE_STRING = str.maketrans({'"': r'\"', "\\": r"\\"})
 
-# urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning) # avoid 
 
 class DataProcessor:
     """
     Processes measurement data for storage in InfluxDB.
     """
 
-    def __init__(self):
+    MAX_TAG_CACHE_SIZE = 100_000  # cached tag sets before the cache is reset
+
+    def __init__(self, geoip_resolver: Optional[GeoIPResolver] = None, aggregator: Optional["LatencyAggregator"] = None, packet_processor: Optional["PacketRTTProcessor"] = None, anomaly_detector: Optional["AnomalyDetector"] = None):
         """
         Initializes the DataProcessor class.
+
+        @param geoip_resolver: Local GeoIP database used for traceroute hops, traceroute data is skipped without it
+        @param aggregator: LatencyAggregator for rollup series, rollups are disabled without it
+        @param packet_processor: PacketRTTProcessor for per-packet series, per-packet ingestion is disabled without it
+        @param anomaly_detector: AnomalyDetector for the anomaly series, detection is disabled without it
         """
-        self.geoip_api_url = "https://ipapi.co/{}/json/"  # public GeoIP API
+        self.geoip_resolver = geoip_resolver
+        self.aggregator = aggregator
+        self.packet_processor = packet_processor
+        self.anomaly_detector = anomaly_detector
+        self._tag_cache: Dict[Tuple[Any, ...], Tuple[str, str]] = {}
 
-    """ 
-    currently outcommented, because visualization for traceroute in grafana is not possible due to private/reserved ip-address spaces which can not be 
-    used to searched for geo-addresses. Keep this problem in mind for further development!
-    """
-    # def get_geo_coordinates(self, ip_address: str) -> Optional[Dict[str, float]]:
-    #     """
-    #     Fetches latitude and longitude for an IP address using ip-api.com.
+    @staticmethod
+    def format_tags(tags: Dict[str, Any]) -> str:
+        """
+        Serializes tags into the line protocol tag section, sorted by key like influxdb_client.Point.
+
+        @param tags: Dictionary of tag keys and values, empty values are skipped
+        @return: Escaped tag section including the leading comma, or an empty string
+        """
+        parts = []
+        for key in sorted(tags):
+            value = str(tags[key])
+            if value:
+                parts.append(f",{key.translate(_ESCAPE_KEY)}={value.translate(_ESCAPE_KEY)}")
+        return "".join(parts)
 
-    #     @param ip_address: The IP address to look up
-    #     @return: A dictionary with latitude and longitude or None if lookup fails
-    #     """
-    #     api_url = f"http://ip-api.com/json/{ip_address}?fields=status,lat,lon"
+    @staticmethod
+    def format_field_value(value: Any) -> Optional[str]:
+        """
+        Serializes a field value the same way influxdb_client.Point does.
+
+        @param value: Field value
+        @return: Line protocol representation, or None for values that are not written (NaN, inf)
+        """
+        if isinstance(value, bool):
+            return "true" if value else "false"
+        if isinstance(value, float):
+            if not math.isfinite(value):
+                return None
+            text = repr(value)
+            return text[:-2] if text.endswith(".0") else text
+        if isinstance(value, int):
+            return f"{value}i"
+        return '"' + str(value).translate(_ESCAPE_STRING) + '"'
 
-    #     try:
-    #         response = requests.get(api_url, timeout=5)
-    #         data = response.json()
+    def _ping_tag_prefixes(self, measurement_id: Any, probe_id: Any, source: Any, target: Any, packetloss_source: Any) -> Tuple[str, str]:
+        """
+        Returns the escaped measurement and tag prefix of the latency and packetloss lines, cached per tag set.
 
-    #         if data.get("status") == "success":
-    #             return {
-    #                 "latitude": data.get("lat"),
-    #                 "longitude": data.get("lon")
-    #             }
-    #         else:
-    #             logging.warning(f"GeoIP lookup failed for {ip_address}: {data}")
-    #     except Exception as e:
-    #         logging.warning(f"Failed to fetch GeoIP data for {ip_address}: {e}")
+        @return: Tuple of (latency prefix, packetloss prefix)
+        """
+        key = (measurement_id, probe_id, source, target, packetloss_source)
+        prefixes = self._tag_cache.get(key)
+        if prefixes is None:
+            if len(self._tag_cache) >= self.MAX_TAG_CACHE_SIZE:
+                self._tag_cache.clear()
+            prefixes = (
+                "latency" + self.format_tags({"msm_id": measurement_id, "probe_id": probe_id, "source": source, "target": target}),
+                "packetloss" + self.format_tags({"msm_id": measurement_id, "probe_id": probe_id, "source": packetloss_source, "target": target})
+            )
+            self._tag_cache[key] = prefixes
+        return prefixes
 
-    #     return None
+    def prepare_ping_lines_for_influxdb(self, measurement_results: Iterable[Dict[str, Any]], retention_seconds: int) -> List[bytes]:
+        """
+        Prepares latency and packet loss data for InfluxDB in one pass, serialized as line protocol.
 
+        Produces the same lines as prepare_latency_data_for_influxdb and prepare_packetloss_data_for_influxdb
+        followed by Point.to_line_protocol, without building Point objects. The result can be passed to the
+        InfluxDB write API as-is.
 
-    def prepare_latency_data_for_influxdb(self, measurement_results: List[Dict[str, Any]], retention_seconds: int) -> List[Point]:
+        @param measurement_results: Measurement results, e.g. one streamed batch
+        @param retention_seconds: Retention period in seconds
+        @return: List of line protocol lines, latency and packetloss interleaved
+        """
+        lines = []
+        latency_count = 0
+        current_time = int(time.time())
+
+        for result in measurement_results:
+            try:
+                timestamp = result.get("timestamp", current_time)
+                if current_time - timestamp > retention_seconds:
+                    continue
+
+                latency_prefix, packetloss_prefix = self._ping_tag_prefixes(
+                    result.get("msm_id", "unknown"),
+                    result.get("prb_id", "unknown"),
+                    result.get("src_addr", "unknown"),
+                    result.get("dst_addr", "unknown"),
+                    result.get("dst_addr", "unknown")  # packetloss has always been tagged with dst_addr as source
+                )
+                timestamp_ns = timestamp * 1_000_000_000  # convert to nanoseconds
+
+                latency = self.format_field_value(result.get("avg")) if result.get("avg") is not None else None
+                if latency is not None:
+                    lines.append(f"{latency_prefix} latency={latency} {timestamp_ns}".encode())
+                    latency_count += 1
+
+                packet_loss = self.format_field_value(result.get("sent", 0) - result.get("rcvd", 0))
+                if packet_loss is not None:
+                    lines.append(f"{packetloss_prefix} packetloss={packet_loss} {timestamp_ns}".encode())
+            except Exception as e:
+                logging.warning(f"Error processing ping result: {e}")
+
+        logging.info(f"Prepared {latency_count} latency and {len(lines) - latency_count} packet loss lines for InfluxDB.")
+        return lines
+
+    def prepare_latency_rollups_for_influxdb(self, measurement_id: Any, measurement_results: Iterable[Dict[str, Any]], retention_seconds: int) -> List[bytes]:
+        """
+        Prepares per-window latency rollups (min, p50, p95, p99, max, jitter, loss ratio) for InfluxDB.
+
+        Windows are only emitted once they are complete, results of open windows are kept by the aggregator.
+
+        @param measurement_id: ID of the measurement the results belong to
+        @param measurement_results: Ping measurement results, e.g. one streamed batch
+        @param retention_seconds: Retention period in seconds
+        @return: List of line protocol lines, empty if aggregation is disabled
+        """
+        if self.aggregator is None:
+            return []
+        return self.aggregator.add(measurement_id, measurement_results, retention_seconds, int(time.time()))
+
+    def prepare_packet_data_for_influxdb(self, measurement_results: Iterable[Dict[str, Any]], retention_seconds: int) -> List[bytes]:
+        """
+        Prepares per-packet RTTs and derived per-result statistics (jitter, min, max, timeouts) for InfluxDB.
+
+        @param measurement_results: Ping measurement results, e.g. one streamed batch
+        @param retention_seconds: Retention period in seconds
+        @return: List of line protocol lines, empty if per-packet ingestion is disabled
+        """
+        if self.packet_processor is None:
+            return []
+        return self.packet_processor.prepare(measurement_results, retention_seconds, int(time.time()))
+
+    def prepare_anomaly_data_for_influxdb(self, measurement_results: Iterable[Dict[str, Any]], retention_seconds: int) -> List[bytes]:
+        """
+        Adds ping results to the latency and loss baselines and prepares the anomalies among them for InfluxDB.
+
+        @param measurement_results: Ping measurement results, e.g. one streamed batch
+        @param retention_seconds: Retention period in seconds
+        @return: List of line protocol lines, empty if anomaly detection is disabled
+        """
+        if self.anomaly_detector is None:
+            return []
+        return self.anomaly_detector.detect(measurement_results, retention_seconds, int(time.time()))
+
+    def prepare_latency_data_for_influxdb(self, measurement_results: Iterable[Dict[str, Any]], retention_seconds: int) -> List[Point]:
         """
         Prepares latency data for InfluxDB.
 
-        @param measurement_results: List of measurement results
+        @param measurement_results: Measurement results, e.g. one streamed batch
         @param retention_seconds: Retention period in seconds
         @return: List of InfluxDB Point objects
         """
@@ -85,11 +210,11 @@ class DataProcessor:
         return points
 
 
-    def prepare_packetloss_data_for_influxdb(self, measurement_results: List[Dict[str, Any]], retention_seconds: int) -> List[Point]:
+    def prepare_packetloss_data_for_influxdb(self, measurement_results: Iterable[Dict[str, Any]], retention_seconds: int) -> List[Point]:
         """
         Prepares packet loss data for InfluxDB.
 
-        @param measurement_results: List of measurement results
+        @param measurement_results: Measurement results, e.g. one streamed batch
         @param retention_seconds: Retention period in seconds
         @return: List of InfluxDB Point objects
         """
@@ -121,58 +246,60 @@ class DataProcessor:
         logging.info(f"Prepared {len(points)} packet loss metrics for InfluxDB.")
         return points
 
-    """ 
-    currently outcommented, because visualization for traceroute in grafana is not possible due to private/reserved ip-address spaces which can not be 
-    used to searched for geo-addresses. Keep this problem in mind for further development!
-    """
-    # def prepare_traceroute_data_for_influxdb(self, measurement_results: List[Dict[str, Any]], retention_seconds: int) -> List[Point]:
-    #     """
-    #     Prepare traceroute data for InfluxDB while respecting the retention policy.
-    #     Format the data to match the Geomap Panel requirements in Grafana.
-
-    #     @param measurement_results: List of traceroute measurement results.
-    #     @param retention_seconds: Retention period in seconds.
-    #     @return: List of InfluxDB Point objects.
-    #     """
-    #     points = []
-    #     current_time = int(time.time())
-
-    #     for result in measurement_results:
-    #         try:
-    #             timestamp = result.get("timestamp", current_time)
-    #             probe_id = result.get("prb_id", "unknown")
-    #             src_ip = result.get("from", "unknown")
-    #             dst_ip = result.get("dst_addr", "unknown")
-    #             hops = result.get("result", [])
-
-    #             # Only process data within the retention policy period
-    #             if current_time - timestamp <= retention_seconds:
-    #                 for hop in hops:
-    #                     hop_index = hop.get("hop")
-    #                     for hop_detail in hop.get("result", []):
-    #                         hop_ip = hop_detail.get("from", "unknown")
-    #                         rtt = hop_detail.get("rtt", None)
-
-    #                         # get geo-coordinates for the hop IP
-    #                         geo_data = self.get_geo_coordinates(hop_ip) if hop_ip != "unknown" else None
-    #                         latitude = geo_data["latitude"] if geo_data else None
-    #                         longitude = geo_data["longitude"] if geo_data else None
-    #                         # Ensure valid data before storing
-    #                         if rtt is not None and latitude is not None and longitude is not None:
-    #                             point = Point("traceroute") \
-    #                                 .tag("probe_id", str(probe_id)) \
-    #                                 .tag("hop_ip", str(hop_ip)) \
-    #                                 .tag("src_ip", str(src_ip)) \
-    #                                 .tag("dst_ip", str(dst_ip)) \
-    #                                 .field("hop", hop_index) \
-    #                                 .field("rtt", rtt) \
-    #                                 .field("latitude", latitude) \
-    #                                 .field("longitude", longitude) \
-    #                                 .time(timestamp * 1_000_000_000)  # convert to nanoseconds
-
-    #                             points.append(point)
-    #         except Exception as e:
-    #             logging.warning(f"Error processing traceroute result: {e}")
-
-    #     logging.info(f"Prepared {len(points)} traceroute metrics for InfluxDB.")
-    #     return points
+    def prepare_traceroute_data_for_influxdb(self, measurement_results: Iterable[Dict[str, Any]], retention_seconds: int) -> List[bytes]:
+        """
+        Prepare traceroute data for InfluxDB while respecting the retention policy.
+        Format the data to match the Geomap Panel requirements in Grafana.
+
+        Hop addresses are resolved with the local GeoIP database. Hops without coordinates, e.g.
+        private or reserved addresses, and timed out replies are skipped.
+
+        @param measurement_results: Traceroute measurement results, e.g. one streamed batch
+        @param retention_seconds: Retention period in seconds
+        @return: List of line protocol lines
+        """
+        lines = []
+        current_time = int(time.time())
+
+        if self.geoip_resolver is None:
+            logging.warning("No GeoIP database configured, skipping traceroute data.")
+            return lines
+
+        for result in measurement_results:
+            try:
+                timestamp = result.get("timestamp", current_time)
+                if current_time - timestamp > retention_seconds:
+                    continue
+
+                tags = {
+                    "dst_ip": result.get("dst_addr", "unknown"),
+                    "probe_id": result.get("prb_id", "unknown"),
+                    "src_ip": result.get("from", "unknown")
+                }
+                timestamp_ns = timestamp * 1_000_000_000  # convert to nanoseconds
+
+                for hop in result.get("result", []):
+                    hop_index = hop.get("hop")
+                    for hop_detail in hop.get("result", []):
+                        hop_ip = hop_detail.get("from")
+                        rtt = hop_detail.get("rtt")
+                        if hop_ip is None or rtt is None or hop_index is None:
+                            continue
+
+                        coordinates = self.geoip_resolver.lookup(hop_ip)
+                        if coordinates is None:
+                            continue
+
+                        fields = ",".join((
+                            f"hop={self.format_field_value(hop_index)}",
+                            f"latitude={self.format_field_value(float(coordinates[0]))}",
+                            f"longitude={self.format_field_value(float(coordinates[1]))}",
+                            f"rtt={self.format_field_value(rtt)}"
+                        ))
+                        tags["hop_ip"] = hop_ip
+                        lines.append(f"traceroute{self.format_tags(tags)} {fields} {timestamp_ns}".encode())
+            except Exception as e:
+                logging.warning(f"Error processing traceroute result: {e}")
+
+        logging.info(f"Prepared {len(lines)} traceroute metrics for InfluxDB.")
+        return lines
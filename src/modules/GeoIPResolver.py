@@ -0,0 +1,111 @@
+import csv
+import bisect
+import logging
+import ipaddress
+from array import array
+from functools import lru_cache
+from typing import Optional, Tuple
+
+
+class GeoIPResolver:
+    """
+    Resolves IP addresses to coordinates from a local GeoIP database, without network calls.
+
+    Supported files:
+    - CSV with a header containing latitude and longitude plus either a network column in CIDR
+      notation (e.g. GeoLite2-City-Blocks) or start_ip and end_ip columns (IP range databases)
+    - MaxMind .mmdb files, if the optional maxminddb package is installed
+
+    CSV ranges are kept in sorted arrays per IP version and looked up with a binary search.
+    Private, reserved and other non-global addresses are rejected before any lookup, and the
+    results of recent lookups are kept in an LRU cache since traceroute hops repeat a lot.
+    """
+
+    def __init__(self, db_path: str, cache_size: int = 65536):
+        """
+        Initializes the GeoIPResolver and loads the database.
+
+        @param db_path: Path to the CSV or MMDB database file
+        @param cache_size: Number of IP addresses kept in the LRU cache
+        """
+        self.db_path = db_path
+        self._reader = None
+        # per IP version: sorted range starts, range ends, latitudes, longitudes
+        self._ranges = {
+            4: (array("I"), array("I"), array("d"), array("d")),
+            6: ([], [], array("d"), array("d"))
+        }
+
+        if db_path.lower().endswith(".mmdb"):
+            try:
+                import maxminddb
+            except ImportError:
+                raise ImportError("Reading .mmdb files requires the maxminddb package (pip install maxminddb).")
+            self._reader = maxminddb.open_database(db_path)
+        else:
+            self._load_csv(db_path)
+
+        # lookup(ip) -> Optional[(latitude, longitude)], cached per instance
+        self.lookup = lru_cache(maxsize=cache_size)(self._lookup)
+        logging.info(f"GeoIPResolver initialized from '{db_path}'.")
+
+    def _load_csv(self, db_path: str):
+        """
+        Loads a CSV database into the sorted range index.
+
+        @param db_path: Path to the CSV file
+        """
+        rows = {4: [], 6: []}
+        with open(db_path, newline="", encoding="utf-8") as file:
+            reader = csv.DictReader(file)
+            for row in reader:
+                try:
+                    latitude, longitude = row.get("latitude"), row.get("longitude")
+                    if not latitude or not longitude:
+                        continue
+                    if row.get("network"):
+                        network = ipaddress.ip_network(row["network"], strict=False)
+                        first, last = network.network_address, network.broadcast_address
+                    else:
+                        first, last = ipaddress.ip_address(row["start_ip"]), ipaddress.ip_address(row["end_ip"])
+                    rows[first.version].append((int(first), int(last), float(latitude), float(longitude)))
+                except (KeyError, ValueError) as e:
+                    logging.debug(f"Skipping GeoIP row {row}: {e}")
+
+        for version, entries in rows.items():
+            entries.sort()
+            starts, ends, latitudes, longitudes = self._ranges[version]
+            for first, last, latitude, longitude in entries:
+                starts.append(first)
+                ends.append(last)
+                latitudes.append(latitude)
+                longitudes.append(longitude)
+        logging.info(f"Loaded {len(rows[4])} IPv4 and {len(rows[6])} IPv6 GeoIP ranges.")
+
+    def _lookup(self, ip: str) -> Optional[Tuple[float, float]]:
+        """
+        Resolves an IP address, see lookup().
+
+        @param ip: IP address as string
+        @return: Tuple of (latitude, longitude), or None for unknown or non-global addresses
+        """
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if not address.is_global:
+            return None
+
+        if self._reader is not None:
+            record = self._reader.get(ip) or {}
+            location = record.get("location") or {}
+            if "latitude" in location and "longitude" in location:
+                return location["latitude"], location["longitude"]
+            return None
+
+        starts, ends, latitudes, longitudes = self._ranges[address.version]
+        value = int(address)
+        index = bisect.bisect_right(starts, value) - 1
+        if index >= 0 and value <= ends[index]:
+            return latitudes[index], longitudes[index]
+        return None
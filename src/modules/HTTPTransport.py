@@ -0,0 +1,187 @@
+import time
+import random
+import logging
+import threading
+import requests
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from typing import Dict, Any, Optional, Tuple
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting the request rate of all threads of the process.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        """
+        Initializes the TokenBucket.
+
+        @param rate: Tokens added per second, 0 or less disables the limit
+        @param burst: Maximum number of tokens that can accumulate
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes one token, sleeping until it is available.
+        """
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # the token is reserved right away, so concurrent callers queue up behind each other
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class HTTPTransport:
+    """
+    HTTP layer for API clients with a sized connection pool, timeouts, retries and rate limiting.
+
+    Requests that fail with a connection error or a retryable status are retried with exponential
+    backoff and jitter, honoring a Retry-After header if the server sends one. All requests pass a
+    shared token bucket first. Conditional requests send the ETag / Last-Modified validators that
+    were remembered for the same URL, so an unchanged resource only costs a 304 response.
+    """
+
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, headers: Optional[Dict[str, str]] = None, pool_size: int = 10, timeout: float = 30.0, max_retries: int = 5, backoff_base: float = 1.0, backoff_max: float = 60.0, rate_limit: float = 10.0, burst: int = 20):
+        """
+        Initializes the HTTPTransport.
+
+        @param headers: Headers sent with every request, e.g. authorization
+        @param pool_size: Maximum number of pooled connections per host, should match the worker concurrency
+        @param timeout: Connect and read timeout per request in seconds
+        @param max_retries: Number of retries of a failed request
+        @param backoff_base: Delay in seconds before the first retry, doubled on every further retry
+        @param backoff_max: Upper bound of a single retry delay in seconds, also caps Retry-After
+        @param rate_limit: Maximum average requests per second, 0 disables the limit
+        @param burst: Maximum number of requests sent at once after an idle period
+        """
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_limiter = TokenBucket(rate_limit, burst)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate"})
+        if headers:
+            self.session.headers.update(headers)
+
+        # base URL -> (full URL, ETag, Last-Modified), one entry per endpoint keeps the store bounded
+        self._validators: Dict[str, Tuple[str, Optional[str], Optional[str]]] = {}
+        self._validators_lock = threading.Lock()
+
+    @staticmethod
+    def request_url(url: str, params: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Returns the full URL including the encoded query parameters.
+
+        @param url: Base URL of the request
+        @param params: Query parameters
+        @return: URL as sent to the server
+        """
+        return requests.Request("GET", url, params=params).prepare().url
+
+    def _backoff(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        """
+        Returns the delay before the next attempt, taken from Retry-After if present.
+
+        @param attempt: Number of the failed attempt, starting at 0
+        @param response: Failed response, None for connection errors
+        @return: Delay in seconds
+        """
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                return min(max(0.0, delay), self.backoff_max)
+        delay = self.backoff_base * (2 ** attempt)
+        return min(delay + random.uniform(0, delay / 2), self.backoff_max)
+
+    def get(self, url: str, params: Optional[Dict[str, Any]] = None, stream: bool = False, conditional: bool = False) -> requests.Response:
+        """
+        Sends a GET request with rate limiting and retries.
+
+        @param url: URL of the request
+        @param params: Query parameters
+        @param stream: Do not download the body before returning
+        @param conditional: Send remembered validators, the response may then be 304 Not Modified
+        @return: Response of the last attempt, the caller checks its status
+        @raise requests.RequestException: If the last attempt failed with a connection error or timeout
+        """
+        headers = {}
+        if conditional:
+            with self._validators_lock:
+                full_url, etag, last_modified = self._validators.get(url, (None, None, None))
+            if full_url != self.request_url(url, params):
+                etag = last_modified = None
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                response = self.session.get(url, params=params, headers=headers, stream=stream, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logging.warning(f"Request to {url} failed ({e}), retrying in {delay:.1f}s.")
+                time.sleep(delay)
+                continue
+
+            if response.status_code in self.RETRY_STATUS and attempt < self.max_retries:
+                delay = self._backoff(attempt, response)
+                logging.warning(f"Request to {url} returned {response.status_code}, retrying in {delay:.1f}s.")
+                response.close()
+                time.sleep(delay)
+                continue
+            return response
+
+    def remember_validators(self, url: str, params: Optional[Dict[str, Any]], response: requests.Response):
+        """
+        Stores the ETag / Last-Modified validators of a response for later conditional requests.
+
+        Only the latest validators per base URL are kept, they apply to requests with the same parameters.
+
+        @param url: Base URL of the request
+        @param params: Query parameters of the request
+        @param response: Successful response of the request
+        """
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if etag or last_modified:
+            with self._validators_lock:
+                self._validators[url] = (self.request_url(url, params), etag, last_modified)
+
+    def forget_validators(self, url: str):
+        """
+        Drops the validators remembered for a base URL.
+
+        @param url: Base URL of the request
+        """
+        with self._validators_lock:
+            self._validators.pop(url, None)
@@ -0,0 +1,646 @@
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from modules.BucketManager import BucketManager
+from modules.DataProcessor import DataProcessor
+from modules.LeaseManager import LeaseManager
+from modules.Metrics import Metrics, SIZE_BUCKETS
+from modules.MeasurementScheduler import MeasurementScheduler
+from modules.ResultStream import ResultStream
+from modules.RetentionPolicies import RetentionPolicies
+from modules.RIPEAtlasAPI import RIPEAtlasAPI
+from modules.RollupStore import RollupStore
+from modules.SQLiteManager import SQLiteManager
+from modules.WriteSpool import WriteSpool
+
+
+class IngestWorker:
+    """
+    Fetches, transforms and writes measurement data for all registered measurements.
+
+    A MeasurementScheduler decides when each measurement is due according to its own interval.
+    Due measurements are processed concurrently on a bounded thread pool, so the network I/O of
+    slow RIPE Atlas responses overlaps. A measurement is never dispatched again before its
+    previous run has completed, which keeps its results and watermark updates strictly ordered.
+    Watermarks are read in one query per dispatch and committed in one transaction for all runs
+    that completed together. Transformed data goes to the durable WriteSpool, and a watermark
+    only advances after the data of its window is spooled.
+
+    Late results are not lost to the watermark: a poll requests only the results after the
+    watermark, but every late_sweep_polls-th poll of a measurement (and its first poll after a
+    start) sweeps the results since the watermark minus late_tolerance, and a result is only
+    processed if it is newer than the watermark of its probe. The probe watermarks of a
+    measurement are loaded into a dictionary once per run, so already processed (probe,
+    timestamp) pairs are skipped with one lookup.
+
+    With a LeaseManager, the worker is one of several processes sharing the registry and only
+    schedules the measurements it currently holds a lease for.
+
+    With a ResultStream, results of subscribed measurements are pushed instead of polled. They
+    are collected into micro-batches that are transformed and spooled every stream_batch_interval
+    seconds, and the scheduled polls of these measurements are skipped while they are subscribed.
+    Whenever a measurement is (re)subscribed, e.g. after a disconnect, one catch-up poll from the
+    stored watermark fetches what the stream may have missed. Without a connection, the
+    measurements are polled on schedule as usual.
+
+    Every stage of a run is timed per measurement in the ingest_stage_seconds histogram of the
+    Metrics registry, next to the rows fetched, dropped and produced per batch. status() returns
+    a snapshot of the watermark and the last run of every measurement, which the run loop
+    publishes whenever runs complete, so readers such as the GUI never query the database.
+
+    With a RollupStore, the ping results of a window are also aggregated into its local minute
+    rollups, which are stored once the window is spooled, like the watermark.
+    """
+
+    def __init__(self, db_manager: SQLiteManager, bucket_manager: BucketManager, data_processor: DataProcessor, ripe_api: RIPEAtlasAPI, spool: WriteSpool, max_concurrency: int = 8, default_interval: int = 60, max_jitter: float = 30.0, registry_refresh: float = 300.0, tick: float = 1.0, write_raw: bool = True, lease_manager: Optional[LeaseManager] = None, metrics: Optional[Metrics] = None, result_stream: Optional[ResultStream] = None, stream_batch_interval: float = 1.0, stream_batch_size: int = 1000, late_tolerance: int = 3600, rollup_store: Optional[RollupStore] = None, retention_policies: Optional[RetentionPolicies] = None, late_sweep_polls: int = 10):
+        """
+        Initializes the IngestWorker.
+
+        @param db_manager: SQLiteManager instance
+        @param bucket_manager: BucketManager instance
+        @param data_processor: DataProcessor instance
+        @param ripe_api: RIPEAtlasAPI instance
+        @param spool: WriteSpool that takes all data for InfluxDB
+        @param max_concurrency: Maximum number of measurements processed at the same time
+        @param default_interval: Polling interval in seconds for measurements without a valid interval
+        @param max_jitter: Upper bound in seconds of the random phase offset of each measurement
+        @param registry_refresh: Seconds after which the measurement list is re-read even if unchanged
+        @param tick: Maximum seconds between two checks for changed measurements
+        @param write_raw: Write the raw ping series, disable to store only the rollups of the DataProcessor
+        @param lease_manager: LeaseManager for sharded operation, None processes every measurement
+        @param metrics: Metrics registry for the stage timings and row counts, a private one is created if None
+        @param result_stream: ResultStream to receive results from instead of polling, None only polls
+        @param stream_batch_interval: Maximum seconds a streamed result waits before its micro-batch is processed
+        @param stream_batch_size: Number of buffered streamed results that triggers processing right away
+        @param late_tolerance: Seconds a result may arrive behind the watermark of its measurement and still be processed
+        @param rollup_store: RollupStore for local latency rollups of ping measurements, None keeps none
+        @param retention_policies: Retention policies of the measurements, defaults to those of the BucketManager
+        @param late_sweep_polls: Every how many polls a measurement is swept for late results, 1 sweeps every poll and 0 never
+        """
+        self.db_manager = db_manager
+        self.bucket_manager = bucket_manager
+        self.data_processor = data_processor
+        self.ripe_api = ripe_api
+        self.spool = spool
+        self.registry_refresh = registry_refresh
+        self.tick = tick
+        self.write_raw = write_raw
+        self.late_tolerance = max(0, int(late_tolerance))
+        self.late_sweep_polls = max(0, int(late_sweep_polls))
+        self._polls_since_sweep: Dict[str, int] = {}  # written by the pool thread running the measurement
+        self.rollup_store = rollup_store
+        self.retention_policies = retention_policies or bucket_manager.retention_policies
+        self.lease_manager = lease_manager
+        self.scheduler = MeasurementScheduler(default_interval=default_interval, max_jitter=max_jitter)
+        self.max_concurrency = max(1, max_concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="ingest")
+        self._completed = queue.Queue()
+        self._running = set()
+        self._stopped = threading.Event()
+        self._measurements: Dict[str, tuple] = {}  # registered measurements of this worker by ID
+
+        self.result_stream = result_stream
+        self.stream_batch_interval = stream_batch_interval
+        self.stream_batch_size = stream_batch_size
+        self._stream_lock = threading.Lock()
+        self._stream_buffer: Dict[str, List[dict]] = {}
+        self._stream_buffered = 0
+        self._stream_flushed = time.monotonic()
+        self._streamed: Dict[str, int] = {}  # subscribed measurement ID -> stream generation it was caught up for
+        self._catch_up = set()
+
+        self._status_lock = threading.Lock()
+        self._run_status: Dict[str, dict] = {}  # measurement ID -> outcome of its runs, written by the pool threads
+        self._watermarks: Dict[str, int] = {}
+        self._status: Dict[str, dict] = {}  # published snapshot, replaced as a whole
+
+        metrics = metrics or Metrics()
+        self._stage_seconds = metrics.histogram("ingest_stage_seconds", "Seconds spent in an ingest stage, one observation per call.", ("measurement", "stage"))
+        self._run_seconds = metrics.histogram("ingest_run_seconds", "Seconds of a whole measurement run.", ("measurement",))
+        self._rows_in = metrics.histogram("ingest_rows_in", "Results per fetched batch.", ("measurement",), buckets=SIZE_BUCKETS)
+        self._rows_out = metrics.histogram("ingest_rows_out", "Line protocol lines produced per batch.", ("measurement",), buckets=SIZE_BUCKETS)
+        self._rows_dropped = metrics.histogram("ingest_rows_dropped", "Results per batch skipped by the watermark or the retention filter.", ("measurement", "reason"), buckets=SIZE_BUCKETS)
+        self._write_failures = metrics.counter("ingest_write_failures_total", "Batches the spool refused, their window is fetched again.", ("measurement",))
+        self._errors = metrics.counter("ingest_errors_total", "Measurement runs aborted by an error.", ("measurement",))
+        metrics.gauge("ingest_running_measurements", "Measurements currently being processed.").set_function(function=lambda: len(self._running))
+        self._stream_results = metrics.counter("ingest_stream_results_total", "Results received from the result stream.", ("measurement",))
+        self._stream_delay = metrics.histogram("ingest_stream_delay_seconds", "Seconds between the timestamp of a streamed result and its arrival.", buckets=(1, 2.5, 5, 10, 30, 60, 120, 300, 900, 3600))
+        metrics.gauge("ingest_stream_connected", "1 while the result stream is connected.").set_function(function=lambda: int(self.result_stream is not None and self.result_stream.connected))
+        logging.info(f"IngestWorker initialized with concurrency {max_concurrency}.")
+
+    def transform(self, measurement_id: str, measurement_type: str, results: List[dict], retention_seconds: int, rollups: bool = True, anomalies: bool = True) -> list:
+        """
+        Transforms a batch of results into line protocol according to the measurement type.
+
+        @param measurement_id: ID of the measurement
+        @param measurement_type: Type of the measurement (Ping, Traceroute, Packetloss)
+        @param results: Results of the measurement
+        @param retention_seconds: Retention period in seconds
+        @param rollups: Add the results to the latency rollups, False if the caller aggregates them itself
+        @param anomalies: Add the results to the anomaly baselines, False for results that do not arrive in time order
+        @return: Line protocol lines
+        """
+        label = str(measurement_id)
+        points = []
+        with self._stage_seconds.time(label, "transform"):
+            if measurement_type.lower() in ["ping", "packetloss"]:
+                if self.write_raw:
+                    points += self.data_processor.prepare_ping_lines_for_influxdb(results, retention_seconds)
+                if rollups:
+                    points += self.data_processor.prepare_latency_rollups_for_influxdb(measurement_id, results, retention_seconds)
+                points += self.data_processor.prepare_packet_data_for_influxdb(results, retention_seconds)
+                if anomalies:
+                    points += self.data_processor.prepare_anomaly_data_for_influxdb(results, retention_seconds)
+            elif measurement_type.lower() == "traceroute":
+                points += self.data_processor.prepare_traceroute_data_for_influxdb(results, retention_seconds)
+        self._rows_out.observe(label, value=len(points))
+        return points
+
+    def _read_probe_watermarks(self, measurement_id: str, last_timestamp: int) -> Tuple[Dict[int, int], int]:
+        """
+        Loads the probe watermarks of a measurement for one run.
+
+        @param measurement_id: ID of the measurement
+        @param last_timestamp: Watermark of the measurement
+        @return: Tuple of (probe ID to watermark, watermark of probes without one)
+        """
+        with self._stage_seconds.time(str(measurement_id), "watermark_read"):
+            seen = self.db_manager.get_probe_watermarks(measurement_id)
+        return seen, max(0, last_timestamp - self.late_tolerance)
+
+    @staticmethod
+    def _unseen(results: List[dict], seen: Dict[int, int], floor: int, newest: Dict[int, int]) -> List[dict]:
+        """
+        Returns the results that are newer than the watermark of their probe.
+
+        @param results: Results of the measurement
+        @param seen: Probe ID to watermark
+        @param floor: Watermark of probes that are not in seen
+        @param newest: Probe ID to newest returned timestamp, updated in place
+        @return: Results not processed yet
+        """
+        unseen = []
+        for result in results:
+            timestamp = result.get("timestamp", 0)
+            probe = result.get("prb_id")
+            if timestamp > seen.get(probe, floor):
+                unseen.append(result)
+                if timestamp > newest.get(probe, 0):
+                    newest[probe] = timestamp
+        return unseen
+
+    def _write_probe_watermarks(self, measurement_id: str, probes: Dict[int, int], last_timestamp: int):
+        """
+        Stores the probe watermarks of a run, before the measurement watermark that depends on them.
+
+        @param measurement_id: ID of the measurement
+        @param probes: Probe ID to newest spooled timestamp
+        @param last_timestamp: Watermark of the measurement after the run
+        """
+        if probes:
+            with self._stage_seconds.time(str(measurement_id), "watermark_write"):
+                # probes behind the late tolerance are covered by the measurement watermark again
+                self.db_manager.update_probe_watermarks(measurement_id, probes, prune_before=last_timestamp - self.late_tolerance)
+
+    def _late_sweep_due(self, measurement_id: str) -> bool:
+        """
+        Decides whether a poll fetches the late tolerance window again instead of only the results after the watermark.
+
+        @param measurement_id: ID of the measurement
+        @return: True on the first poll of the process and every late_sweep_polls-th poll after a completed sweep
+        """
+        if not self.late_sweep_polls or not self.late_tolerance:
+            return False
+        polls = self._polls_since_sweep.get(measurement_id)
+        return polls is None or polls + 1 >= self.late_sweep_polls
+
+    def unsupported(self, measurement_type: str) -> Optional[str]:
+        """
+        Checks whether results of a measurement type can be stored with the current configuration.
+
+        @param measurement_type: Type of the measurement (Ping, Traceroute, Packetloss)
+        @return: Reason why the type cannot be stored, None if it can
+        """
+        if measurement_type.lower() == "traceroute" and self.data_processor.geoip_resolver is None:
+            return "no GeoIP database configured for traceroute"
+        return None
+
+    def process_measurement(self, measurement: tuple, last_timestamp: int) -> int:
+        """
+        Fetches, transforms and writes the new results of a single measurement.
+
+        @param measurement: Measurement record as returned by SQLiteManager.get_measurements
+        @param last_timestamp: Timestamp of the newest result that was already processed
+        @return: Timestamp of the newest result that is now stored in InfluxDB
+        """
+        measurement_id = measurement[1]
+        label = str(measurement_id)
+        run_start = time.perf_counter()
+        probes = {}
+        rows_written = 0
+        error = None
+        try:
+            measurement_id, _, bucket_name, retention_policy, _, measurement_type = measurement[1:7]
+            # fails the run before anything is fetched, the watermark stays until the results can be stored
+            reason = self.unsupported(measurement_type)
+            if reason is not None:
+                raise RuntimeError(reason)
+            # raises for an unknown policy before anything is fetched or a bucket is created
+            retention_seconds = self.retention_policies.seconds(retention_policy)
+            with self._stage_seconds.time(label, "bucket_check"):
+                self.bucket_manager.ensure_bucket(bucket_name, retention_policy)
+            has_new_data = False
+            seen, floor = self._read_probe_watermarks(measurement_id, last_timestamp)
+            sweep = self._late_sweep_due(measurement_id)
+            if not sweep:
+                floor = max(floor, last_timestamp)
+            rollup_store = self.rollup_store if measurement_type.lower() in ["ping", "packetloss"] else None
+
+            # a sweep leaves the validators of the regular poll in place, so it still gets 304 Not Modified
+            for window in self.ripe_api.fetch_new_measurement_results(int(measurement_id), floor, retention_seconds, conditional=not sweep):
+                window_max_timestamp = last_timestamp
+                window_probes = {}
+                window_rollups = {}
+
+                for results in window:
+                    self._rows_in.observe(label, value=len(results))
+                    new_results = self._unseen(results, seen, floor, window_probes)
+                    self._rows_dropped.observe(label, "watermark", value=len(results) - len(new_results))
+                    if not new_results:
+                        continue
+                    has_new_data = True
+
+                    logging.info(f"ID: {measurement_id} - preparing data")
+
+                    # same predicate as the retention filter of the DataProcessor
+                    cutoff = int(time.time()) - retention_seconds
+                    self._rows_dropped.observe(label, "retention", value=sum(1 for r in new_results if r["timestamp"] < cutoff))
+
+                    points = self.transform(measurement_id, measurement_type, new_results, retention_seconds)
+
+                    with self._stage_seconds.time(label, "write"):
+                        spooled = self.spool.append(bucket_name, points)
+                    if not spooled:
+                        self._write_failures.inc(label)
+                        error = "spool full or unavailable"
+                        logging.error(f"ID: {measurement_id} - spooling failed, watermark stays at {last_timestamp}.")
+                        return last_timestamp
+                    rows_written += len(points)
+                    if rollup_store is not None:
+                        rollup_store.collect(new_results, window_rollups)
+
+                    window_max_timestamp = max(window_max_timestamp, max(r["timestamp"] for r in new_results))
+
+                # results inside a window are not ordered, so only acknowledge fully consumed and spooled windows
+                probes.update(window_probes)
+                if rollup_store is not None:
+                    rollup_store.store(measurement_id, measurement[2], retention_seconds, window_rollups)
+                if window_max_timestamp > last_timestamp:
+                    last_timestamp = window_max_timestamp
+                    logging.info(f"ID: {measurement_id} processed.")
+
+            self._polls_since_sweep[measurement_id] = 0 if sweep else self._polls_since_sweep.get(measurement_id, 0) + 1
+            if not has_new_data:
+                logging.info(f"ID: {measurement_id} - no new data.")
+                if measurement_type.lower() in ["ping", "packetloss"]:
+                    # without new results the rollups of windows that completed in the meantime are only flushed here
+                    points = self.data_processor.prepare_latency_rollups_for_influxdb(measurement_id, [], retention_seconds)
+                    if points and not self.spool.append(bucket_name, points):
+                        self._write_failures.inc(label)
+                        error = "spool full or unavailable"
+                        logging.error(f"ID: {measurement_id} - spooling {len(points)} latency rollups failed.")
+                    elif points:
+                        rows_written += len(points)
+        except Exception as e:
+            self._errors.inc(label)
+            error = str(e)
+            logging.error(f"Error processing measurement ID {measurement_id}: {e}")
+        finally:
+            self._write_probe_watermarks(measurement_id, probes, last_timestamp)
+            run_seconds = time.perf_counter() - run_start
+            self._run_seconds.observe(label, value=run_seconds)
+            self._record_run(measurement[1], run_seconds, rows_written, error)
+        return last_timestamp
+
+    def _record_run(self, measurement_id: str, seconds: float, rows_written: int, error: Optional[str]):
+        """
+        Records the outcome of a run for the status snapshot.
+
+        @param measurement_id: ID of the measurement
+        @param seconds: Duration of the run
+        @param rows_written: Line protocol lines spooled by the run
+        @param error: Error message if the run failed, None on success
+        """
+        with self._status_lock:
+            status = self._run_status.setdefault(measurement_id, {"rows_written": 0, "errors": 0, "last_error": None})
+            status["last_run"] = time.time()
+            status["last_duration"] = seconds
+            status["rows_written"] += rows_written
+            status["failed"] = error is not None
+            if error is not None:
+                status["errors"] += 1
+                status["last_error"] = error
+
+    def _publish_status(self):
+        """Replaces the status snapshot, called by the run loop."""
+        with self._status_lock:
+            run_status = {measurement_id: dict(status) for measurement_id, status in self._run_status.items()}
+        self._status = {
+            measurement_id: dict(
+                run_status.get(measurement_id, {}),
+                measurement_type=measurement[6],
+                interval=measurement[5],
+                watermark=self._watermarks.get(measurement_id, 0),
+                running=measurement_id in self._running,
+                streaming=measurement_id in self._streamed
+            )
+            for measurement_id, measurement in self._measurements.items()
+        }
+
+    def status(self) -> Dict[str, dict]:
+        """
+        Returns the last published status of the measurements of this worker, without any I/O.
+
+        @return: Dictionary of measurement ID to a dictionary with measurement_type, interval,
+                 watermark, running, streaming and, once it ran, last_run (unix time),
+                 last_duration, failed (of the last run), rows_written, errors and last_error
+        """
+        return self._status
+
+    def run_cycle(self, measurements: list):
+        """
+        Processes all given measurements once, concurrently, and waits until every one is done.
+
+        Bypasses the scheduler, e.g. for one-off runs and benchmarks.
+
+        @param measurements: List of measurement records
+        """
+        with self._stage_seconds.time("all", "watermark_read"):
+            watermarks = self.db_manager.get_all_last_processed()
+        previous = [watermarks.get(measurement[1], 0) for measurement in measurements]
+
+        # list() drains the iterator, so the cycle ends only after the slowest measurement
+        current = list(self.executor.map(self.process_measurement, measurements, previous))
+
+        updates = {measurement[1]: new for measurement, old, new in zip(measurements, previous, current) if new > old}
+        with self._stage_seconds.time("all", "watermark_write"):
+            self.db_manager.update_last_processed_many(updates)
+
+    def _run_measurement(self, measurement: tuple, last_timestamp: int, scheduled: bool = True):
+        """
+        Processes a measurement on the thread pool and reports the outcome to the run loop.
+
+        @param measurement: Measurement record
+        @param last_timestamp: Watermark of the measurement at dispatch time
+        @param scheduled: The run was popped from the scheduler, False for catch-up polls
+        """
+        new_timestamp = last_timestamp
+        try:
+            new_timestamp = self.process_measurement(measurement, last_timestamp)
+        finally:
+            self._completed.put((measurement[1], last_timestamp, new_timestamp, scheduled, False))
+
+    def _run_stream_batch(self, measurement: tuple, last_timestamp: int, results: List[dict]):
+        """
+        Transforms and spools a micro-batch of streamed results on the thread pool.
+
+        Streamed results are filtered by the probe watermarks only, so late ones are kept as long as
+        their probe has no newer result yet. If the spool refuses the batch, the measurement gets a
+        catch-up poll.
+
+        @param measurement: Measurement record
+        @param last_timestamp: Watermark of the measurement at dispatch time
+        @param results: Streamed results of the measurement
+        """
+        measurement_id = measurement[1]
+        label = str(measurement_id)
+        new_timestamp = last_timestamp
+        failed = True
+        probes = {}
+        error = None
+        run_start = time.perf_counter()
+        try:
+            measurement_id, _, bucket_name, retention_policy, _, measurement_type = measurement[1:7]
+            retention_seconds = self.retention_policies.seconds(retention_policy)
+            with self._stage_seconds.time(label, "bucket_check"):
+                self.bucket_manager.ensure_bucket(bucket_name, retention_policy)
+            self._rows_in.observe(label, value=len(results))
+            seen, floor = self._read_probe_watermarks(measurement_id, last_timestamp)
+            new_results = self._unseen(results, seen, floor, probes)
+            self._rows_dropped.observe(label, "watermark", value=len(results) - len(new_results))
+            points = self.transform(measurement_id, measurement_type, new_results, retention_seconds) if new_results else []
+
+            with self._stage_seconds.time(label, "write"):
+                spooled = self.spool.append(bucket_name, points)
+            if spooled:
+                new_timestamp = max([last_timestamp] + [r.get("timestamp", 0) for r in new_results])
+                self._write_probe_watermarks(measurement_id, probes, new_timestamp)
+                if self.rollup_store is not None and new_results and measurement_type.lower() in ["ping", "packetloss"]:
+                    self.rollup_store.store(measurement_id, measurement[2], retention_seconds, self.rollup_store.collect(new_results))
+                failed = False
+            else:
+                self._write_failures.inc(label)
+                error = "spool full or unavailable"
+                logging.error(f"ID: {measurement_id} - spooling streamed results failed, polling from watermark {last_timestamp}.")
+        except Exception as e:
+            self._errors.inc(label)
+            error = str(e)
+            logging.error(f"Error processing streamed results of measurement ID {measurement_id}: {e}")
+        finally:
+            self._record_run(measurement[1], time.perf_counter() - run_start, 0 if failed else len(points), error)
+            self._completed.put((measurement[1], last_timestamp, new_timestamp, False, failed))
+
+    def _dispatch(self, measurements: list, scheduled: bool = True):
+        """
+        Submits due measurements to the thread pool.
+
+        @param measurements: List of due measurement records
+        @param scheduled: The measurements were popped from the scheduler, False for catch-up polls
+        """
+        with self._stage_seconds.time("all", "watermark_read"):
+            watermarks = self.db_manager.get_all_last_processed()
+        self._watermarks.update(watermarks)
+        for measurement in measurements:
+            self._running.add(measurement[1])
+            self.executor.submit(self._run_measurement, measurement, watermarks.get(measurement[1], 0), scheduled)
+
+    def _on_stream_result(self, result: dict):
+        """
+        Buffers a streamed result, called on the stream thread.
+
+        @param result: Result as pushed by the stream
+        """
+        measurement_id = str(result.get("msm_id"))
+        measurement = self._measurements.get(measurement_id)
+        if measurement is None or self.unsupported(measurement[6]) is not None:
+            return
+        with self._stream_lock:
+            self._stream_buffer.setdefault(measurement_id, []).append(result)
+            self._stream_buffered += 1
+            full = self._stream_buffered >= self.stream_batch_size
+        self._stream_results.inc(measurement_id)
+        if "timestamp" in result:
+            self._stream_delay.observe(value=max(0.0, time.time() - result["timestamp"]))
+        if full:
+            self._completed.put(None)  # wakes the run loop
+
+    def _stream_tick(self, now: float):
+        """
+        Dispatches the catch-up polls of (re)subscribed measurements and the due micro-batches.
+
+        @param now: Current monotonic time
+        """
+        streaming = {str(measurement_id): generation for measurement_id, generation in self.result_stream.streaming().items()}
+        for measurement_id, generation in streaming.items():
+            if self._streamed.get(measurement_id) != generation:
+                # results published before the subscription became active are only in the API
+                self._catch_up.add(measurement_id)
+        self._streamed = streaming
+
+        # catch-up polls go first, so the watermark covers the gap before streamed batches move it
+        ready = [self._measurements[measurement_id] for measurement_id in self._catch_up if measurement_id in self._measurements and measurement_id not in self._running]
+        self._catch_up.intersection_update(self._measurements)
+        if ready:
+            logging.info(f"Catching up {len(ready)} measurements from their watermarks.")
+            self._catch_up.difference_update(measurement[1] for measurement in ready)
+            self._dispatch(ready, scheduled=False)
+
+        if not self._stream_buffered or (self._stream_buffered < self.stream_batch_size and now - self._stream_flushed < self.stream_batch_interval):
+            return
+        self._stream_flushed = now
+        with self._stream_lock:
+            batches = {measurement_id: results for measurement_id, results in self._stream_buffer.items()
+                       if measurement_id not in self._running and measurement_id not in self._catch_up}
+            for measurement_id, results in batches.items():
+                del self._stream_buffer[measurement_id]
+                self._stream_buffered -= len(results)
+        if not batches:
+            return
+
+        with self._stage_seconds.time("all", "watermark_read"):
+            watermarks = self.db_manager.get_all_last_processed()
+        self._watermarks.update(watermarks)
+        for measurement_id, results in batches.items():
+            measurement = self._measurements.get(measurement_id)
+            if measurement is None:
+                continue  # removed since the results arrived
+            self._running.add(measurement_id)
+            self.executor.submit(self._run_stream_batch, measurement, watermarks.get(measurement_id, 0), results)
+
+    def _collect_completed(self, timeout: float):
+        """
+        Waits up to timeout seconds for finished runs, stores their watermarks and reschedules them.
+
+        @param timeout: Maximum seconds to wait for the first finished run
+        """
+        try:
+            completed = [self._completed.get(timeout=timeout)]
+        except queue.Empty:
+            return
+        while True:
+            try:
+                completed.append(self._completed.get_nowait())
+            except queue.Empty:
+                break
+        completed = [entry for entry in completed if entry is not None]
+
+        updates = {measurement_id: new for measurement_id, old, new, _, _ in completed if new > old}
+        if self.lease_manager is not None:
+            # a lease lost during the run belongs to another worker now, it owns the watermark too
+            updates = {measurement_id: new for measurement_id, new in updates.items() if self.lease_manager.owns(measurement_id)}
+        with self._stage_seconds.time("all", "watermark_write"):
+            self.db_manager.update_last_processed_many(updates)
+
+        self._watermarks.update(updates)
+
+        now = time.monotonic()
+        for measurement_id, _, _, scheduled, failed in completed:
+            self._running.discard(measurement_id)
+            if scheduled:
+                self.scheduler.complete(measurement_id, now)
+            if failed:
+                self._catch_up.add(measurement_id)
+        self._publish_status()
+
+    def run(self):
+        """
+        Runs the scheduler loop until stop() is called or the thread is interrupted.
+
+        The measurement list is re-read whenever another connection committed to the database, so
+        measurements added or removed in the GUI are picked up within one tick.
+        """
+        if self.result_stream is not None:
+            threading.Thread(target=self.result_stream.run, args=(self._on_stream_result,), name="result-stream", daemon=True).start()
+        try:
+            self._run_loop()
+        finally:
+            self._shutdown()
+
+    def _run_loop(self):
+        """Scheduler loop of run()."""
+        data_version = None
+        last_sync = float("-inf")
+
+        while not self._stopped.is_set():
+            now = time.monotonic()
+            leases_changed = self.lease_manager is not None and self.lease_manager.renew_if_due(self._running)
+            version = self.db_manager.get_data_version()
+            if version != data_version or leases_changed or now - last_sync >= self.registry_refresh:
+                measurements = self.db_manager.get_measurements()
+                if self.lease_manager is not None:
+                    measurements = [measurement for measurement in measurements if self.lease_manager.owns(measurement[1])]
+                self.scheduler.sync(measurements, now)
+                self._measurements = {measurement[1]: measurement for measurement in measurements}
+                self._watermarks = self.db_manager.get_all_last_processed()
+                self._publish_status()
+                if self.result_stream is not None:
+                    self.result_stream.subscribe(measurement_id for measurement_id in self._measurements if str(measurement_id).isdigit())
+                if not measurements:
+                    logging.info("No measurements to process.")
+                data_version, last_sync = version, now
+
+            if self.result_stream is not None:
+                self._stream_tick(now)
+
+            due = self.scheduler.pop_due(now)
+            # streamed measurements need no poll, and a catch-up or streamed batch may still be running
+            skipped = [measurement for measurement in due if measurement[1] in self._streamed or measurement[1] in self._running]
+            for measurement in skipped:
+                self.scheduler.complete(measurement[1], now)
+            due = [measurement for measurement in due if measurement not in skipped]
+            if due:
+                logging.debug(f"Dispatching {len(due)} due measurements.")
+                self._dispatch(due)
+
+            next_due = self.scheduler.next_due()
+            timeout = self.tick if next_due is None else min(self.tick, max(0.0, next_due - time.monotonic()))
+            if self.result_stream is not None:
+                timeout = min(timeout, self.stream_batch_interval)
+            self._collect_completed(timeout)
+
+    def _shutdown(self):
+        """Waits for running measurements, stores their watermarks and releases the leases."""
+        if self.result_stream is not None:
+            self.result_stream.stop()
+            if self._stream_buffered:
+                # not spooled yet, the catch-up poll after the next start fetches them again
+                logging.warning(f"Dropping {self._stream_buffered} buffered streamed results on shutdown.")
+        # let running measurements finish and store their watermarks before giving up the leases
+        self.executor.shutdown(wait=True)
+        while self._running:
+            self._collect_completed(self.tick)
+        if self.data_processor.anomaly_detector is not None:
+            # before the leases are released, the next owner loads the baselines from the checkpoint
+            self.data_processor.anomaly_detector.checkpoint()
+        if self.lease_manager is not None:
+            self.lease_manager.release()
+        logging.info("IngestWorker stopped.")
+
+    def stop(self):
+        """
+        Asks the run loop to finish the running measurements and return.
+        """
+        self._stopped.set()
@@ -0,0 +1,321 @@
+import logging
+import sqlite3
+import threading
+import numpy as np
+from typing import List, Dict, Any, Iterable, Optional, Set, Tuple
+from modules.DataProcessor import DataProcessor
+from modules.Metrics import Metrics
+
+
+class LatencyAggregator:
+    """
+    Aggregates ping results into per-window, per-target latency rollups with NumPy.
+
+    The rows of every window are kept per measurement until the window is complete, i.e. until
+    the current time is past the window end plus grace_seconds, so a window that is split across
+    several fetches is still written as one rollup and the last window of an idle measurement
+    is flushed as well. All statistics of a flush are computed with vectorized operations over
+    every window and target at once.
+
+    Rows of flushed windows are kept for late_tolerance seconds after the window end. A late
+    result for such a window re-emits the rollup of all its rows, which overwrites the earlier
+    rollup in InfluxDB; results for windows that were already expired are dropped and counted.
+    The first results of a measurement, e.g. its history, are aggregated whatever their age.
+    Rows are deduplicated by probe, target and timestamp, so results fetched twice are counted
+    once. With a state_path the rows are also stored in a SQLite file and loaded on start, so
+    windows that are open when the process stops are still written after a restart.
+    """
+
+    QUANTILES = (("p50", 0.50), ("p95", 0.95), ("p99", 0.99))
+
+    def __init__(self, window_seconds: int = 300, grace_seconds: int = 60, late_tolerance: int = 3600, state_path: Optional[str] = None, metrics: Optional[Metrics] = None):
+        """
+        Initializes the LatencyAggregator.
+
+        @param window_seconds: Length of an aggregation window in seconds
+        @param grace_seconds: Seconds after the window end during which late results are still expected
+        @param late_tolerance: Seconds after the window end during which a late result still updates the rollup
+        @param state_path: Path to the SQLite file of the window rows, None keeps them only in memory
+        @param metrics: Metrics registry for the dropped late results, a private one is created if None
+        """
+        self.window_seconds = max(1, int(window_seconds))
+        self.grace_seconds = grace_seconds
+        self.late_tolerance = max(int(late_tolerance), grace_seconds)
+        # measurement ID -> window start -> (probe, target, timestamp) -> (latency, sent, rcvd)
+        self._windows: Dict[str, Dict[int, Dict[Tuple[int, str, int], Tuple[float, int, int]]]] = {}
+        self._flushed: Dict[str, Set[int]] = {}
+        self._horizons: Dict[str, int] = {}  # windows starting before it are expired
+        self._lock = threading.Lock()
+        self._conn = None
+        if state_path:
+            self._conn = sqlite3.connect(state_path, timeout=30, check_same_thread=False)
+            self._initialize_store()
+            self._load()
+
+        metrics = metrics or Metrics()
+        self._late_dropped = metrics.counter("rollup_late_dropped_total", "Results that arrived after the late tolerance of their rollup window.", ("measurement",))
+        metrics.gauge("rollup_open_windows", "Rollup windows whose rows are kept for late results.").set_function(function=lambda: sum(len(windows) for windows in self._windows.values()))
+
+    def _initialize_store(self):
+        """Initialize the state file."""
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL;")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS aggregation_rows (
+                    measurement_id TEXT,
+                    window_start INTEGER,
+                    probe INTEGER,
+                    target TEXT,
+                    timestamp INTEGER,
+                    latency REAL,
+                    sent INTEGER,
+                    rcvd INTEGER,
+                    PRIMARY KEY (measurement_id, window_start, probe, target, timestamp)
+                ) WITHOUT ROWID;
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS aggregation_flushed (
+                    measurement_id TEXT,
+                    window_start INTEGER,
+                    PRIMARY KEY (measurement_id, window_start)
+                ) WITHOUT ROWID;
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS aggregation_horizons (
+                    measurement_id TEXT PRIMARY KEY,
+                    horizon INTEGER
+                );
+            """)
+            self._conn.commit()
+
+    def _load(self):
+        """Loads the stored window rows."""
+        try:
+            with self._lock:
+                for measurement_id, window, probe, target, timestamp, latency, sent, rcvd in self._conn.execute("SELECT * FROM aggregation_rows;"):
+                    rows = self._windows.setdefault(measurement_id, {}).setdefault(window, {})
+                    rows[(probe, target, timestamp)] = (np.nan if latency is None else latency, sent, rcvd)
+                for measurement_id, window in self._conn.execute("SELECT * FROM aggregation_flushed;"):
+                    self._flushed.setdefault(measurement_id, set()).add(window)
+                self._horizons.update(self._conn.execute("SELECT * FROM aggregation_horizons;"))
+        except Exception as e:
+            logging.error(f"Error loading the rollup windows, open windows are started over: {e}")
+            return
+        logging.info(f"Loaded {sum(len(windows) for windows in self._windows.values())} rollup windows.")
+
+    @staticmethod
+    def to_columns(measurement_results: Iterable[Dict[str, Any]], retention_seconds: int, current_time: int) -> Dict[str, np.ndarray]:
+        """
+        Converts ping results into column arrays, dropping results outside the retention period.
+
+        @param measurement_results: Ping measurement results
+        @param retention_seconds: Retention period in seconds
+        @param current_time: Current unix timestamp
+        @return: Dictionary of equally long arrays: timestamp, probe, target, latency, sent, rcvd
+        """
+        results = measurement_results if isinstance(measurement_results, list) else list(measurement_results)
+        count = len(results)
+        timestamp = np.fromiter((r.get("timestamp", current_time) for r in results), dtype=np.int64, count=count)
+        probe = np.fromiter((r.get("prb_id") or 0 for r in results), dtype=np.int64, count=count)
+        # -1 marks a result where every packet was lost, it has no latency
+        latency = np.fromiter((r.get("avg") if r.get("avg") is not None else np.nan for r in results), dtype=np.float64, count=count)
+        latency[latency < 0] = np.nan
+        sent = np.fromiter((r.get("sent") or 0 for r in results), dtype=np.int64, count=count)
+        rcvd = np.fromiter((r.get("rcvd") or 0 for r in results), dtype=np.int64, count=count)
+        target = np.array([str(r.get("dst_addr", "unknown")) for r in results], dtype=object)
+
+        keep = current_time - timestamp <= retention_seconds
+        return {"timestamp": timestamp[keep], "probe": probe[keep], "target": target[keep], "latency": latency[keep], "sent": sent[keep], "rcvd": rcvd[keep]}
+
+    def add(self, measurement_id: Any, measurement_results: Iterable[Dict[str, Any]], retention_seconds: int, current_time: int) -> List[bytes]:
+        """
+        Adds results of a measurement and returns the rollups of all windows that are now complete
+        or that received late results after they were flushed.
+
+        Called with no results it only flushes the windows that completed in the meantime.
+
+        @param measurement_id: ID of the measurement the results belong to
+        @param measurement_results: Ping measurement results
+        @param retention_seconds: Retention period in seconds
+        @param current_time: Current unix timestamp
+        @return: List of line protocol lines of the measurement "latency_rollup"
+        """
+        columns = self.to_columns(measurement_results, retention_seconds, current_time)
+        key = str(measurement_id)
+        window_seconds = self.window_seconds
+        horizon = current_time - window_seconds - self.late_tolerance
+        with self._lock:
+            expired_before = self._horizons.get(key, 0)
+            windows = self._windows.setdefault(key, {})
+            flushed = self._flushed.setdefault(key, set())
+            touched = set()
+            new_rows = []
+            dropped = 0
+            for row in zip(columns["timestamp"].tolist(), columns["probe"].tolist(), columns["target"].tolist(), columns["latency"].tolist(), columns["sent"].tolist(), columns["rcvd"].tolist()):
+                timestamp = row[0]
+                window = timestamp - timestamp % window_seconds
+                if window < expired_before:
+                    dropped += 1
+                    continue
+                rows = windows.setdefault(window, {})
+                touched.add(window)
+                row_key = (row[1], row[2], timestamp)
+                if row_key not in rows:
+                    rows[row_key] = row[3:]
+                    new_rows.append((key, window) + row[1:3] + (timestamp,) + row[3:])
+
+            # a result fetched again re-emits its window as well, its earlier rollup may not have been written
+            emit = sorted(window for window in windows if window + window_seconds + self.grace_seconds <= current_time and (window not in flushed or window in touched))
+            emitted = [(window, row_key, values) for window in emit for row_key, values in windows[window].items()]
+            flushed.update(emit)
+            # old windows, e.g. of the history or after a long stop, are emitted once above before they expire
+            expired = [window for window in windows if window < horizon]
+            for window in expired:
+                del windows[window]
+                flushed.discard(window)
+            self._horizons[key] = max(expired_before, horizon)
+            self._store(key, new_rows, emit, self._horizons[key])
+
+        if dropped:
+            self._late_dropped.inc(key, amount=dropped)
+            logging.warning(f"ID: {measurement_id} - dropped {dropped} results that arrived more than {self.late_tolerance}s after their rollup window.")
+        if not emit:
+            return []
+        window = np.fromiter((entry[0] for entry in emitted), dtype=np.int64, count=len(emitted))
+        done = {
+            "timestamp": np.fromiter((entry[1][2] for entry in emitted), dtype=np.int64, count=len(emitted)),
+            "probe": np.fromiter((entry[1][0] for entry in emitted), dtype=np.int64, count=len(emitted)),
+            "target": np.array([entry[1][1] for entry in emitted], dtype=object),
+            "latency": np.fromiter((entry[2][0] for entry in emitted), dtype=np.float64, count=len(emitted)),
+            "sent": np.fromiter((entry[2][1] for entry in emitted), dtype=np.int64, count=len(emitted)),
+            "rcvd": np.fromiter((entry[2][2] for entry in emitted), dtype=np.int64, count=len(emitted)),
+        }
+        return self.aggregate(measurement_id, done, window)
+
+    def _store(self, measurement_id: str, new_rows: List[tuple], flushed: List[int], horizon: int):
+        """Stores new rows, flushed windows and the horizon and deletes expired windows, called with the lock held."""
+        if self._conn is None:
+            return
+        try:
+            with self._conn:
+                # NaN is stored as NULL by SQLite
+                self._conn.executemany("INSERT OR IGNORE INTO aggregation_rows VALUES (?, ?, ?, ?, ?, ?, ?, ?);", new_rows)
+                self._conn.executemany("INSERT OR IGNORE INTO aggregation_flushed VALUES (?, ?);", [(measurement_id, window) for window in flushed])
+                self._conn.execute("INSERT OR REPLACE INTO aggregation_horizons VALUES (?, ?);", (measurement_id, horizon))
+                self._conn.execute("DELETE FROM aggregation_rows WHERE measurement_id = ? AND window_start < ?;", (measurement_id, horizon))
+                self._conn.execute("DELETE FROM aggregation_flushed WHERE measurement_id = ? AND window_start < ?;", (measurement_id, horizon))
+        except Exception as e:
+            logging.error(f"ID: {measurement_id} - error storing rollup windows, they are only kept in memory: {e}")
+
+    def close(self):
+        """
+        Closes the state file.
+        """
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+                self._conn = None
+
+    def rollup(self, measurement_id: Any, parts: List[Dict[str, np.ndarray]]) -> List[bytes]:
+        """
+        Returns the rollups of every window in the given columns at once, without buffering.
+
+        Only complete for a closed time range whose bounds are aligned to the window length, e.g.
+        one backfill chunk. Open windows of add() are not touched.
+
+        @param measurement_id: ID of the measurement the results belong to
+        @param parts: Column arrays as returned by to_columns
+        @return: List of line protocol lines of the measurement "latency_rollup"
+        """
+        parts = [part for part in parts if len(part["timestamp"])]
+        if not parts:
+            return []
+        merged = {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+        return self.aggregate(measurement_id, merged, merged["timestamp"] - merged["timestamp"] % self.window_seconds)
+
+    def aggregate(self, measurement_id: Any, columns: Dict[str, np.ndarray], window: np.ndarray) -> List[bytes]:
+        """
+        Computes count, loss ratio, min, percentiles, max and jitter per window and target.
+
+        Jitter is the mean absolute difference between consecutive latencies of the same probe.
+
+        @param measurement_id: ID of the measurement, written as msm_id tag
+        @param columns: Column arrays as returned by to_columns
+        @param window: Window start timestamp of every row
+        @return: List of line protocol lines
+        """
+        targets, target_code = np.unique(columns["target"], return_inverse=True)
+        group_keys = np.stack((window, target_code.astype(np.int64)), axis=1)
+        groups, group = np.unique(group_keys, axis=0, return_inverse=True)
+        group = group.reshape(-1)
+        group_count = len(groups)
+
+        sent = np.bincount(group, weights=columns["sent"], minlength=group_count)
+        lost = sent - np.bincount(group, weights=columns["rcvd"], minlength=group_count)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            loss_ratio = np.where(sent > 0, lost / sent, np.nan)
+
+        # latency statistics over the results that have a latency, sorted by group and value
+        valid = ~np.isnan(columns["latency"])
+        valid_group = group[valid]
+        valid_latency = columns["latency"][valid]
+        order = np.lexsort((valid_latency, valid_group))
+        sorted_latency = valid_latency[order]
+        counts = np.bincount(valid_group, minlength=group_count)
+        starts = np.cumsum(counts) - counts
+        has_latency = counts > 0
+        last = np.maximum(counts - 1, 0)
+
+        stats = {"count": counts}
+        safe_starts = np.where(has_latency, starts, 0)
+        if len(sorted_latency):
+            stats["min"] = np.where(has_latency, sorted_latency[safe_starts], np.nan)
+            stats["max"] = np.where(has_latency, sorted_latency[safe_starts + last], np.nan)
+            for name, quantile in self.QUANTILES:
+                position = quantile * last
+                lower = np.floor(position).astype(np.int64)
+                upper = np.ceil(position).astype(np.int64)
+                low_values = sorted_latency[safe_starts + lower]
+                high_values = sorted_latency[safe_starts + upper]
+                stats[name] = np.where(has_latency, low_values + (high_values - low_values) * (position - lower), np.nan)
+
+            # jitter, consecutive samples of the same probe in time order
+            jitter_order = np.lexsort((columns["timestamp"][valid], columns["probe"][valid], valid_group))
+            jitter_group = valid_group[jitter_order]
+            jitter_probe = columns["probe"][valid][jitter_order]
+            jitter_latency = valid_latency[jitter_order]
+            same = (jitter_group[1:] == jitter_group[:-1]) & (jitter_probe[1:] == jitter_probe[:-1])
+            differences = np.abs(np.diff(jitter_latency))[same]
+            difference_group = jitter_group[1:][same]
+            difference_sum = np.bincount(difference_group, weights=differences, minlength=group_count)
+            difference_count = np.bincount(difference_group, minlength=group_count)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                stats["jitter"] = np.where(difference_count > 0, difference_sum / difference_count, np.nan)
+        stats["loss_ratio"] = loss_ratio
+
+        return self._to_lines(measurement_id, targets, groups, stats)
+
+    def _to_lines(self, measurement_id: Any, targets: np.ndarray, groups: np.ndarray, stats: Dict[str, np.ndarray]) -> List[bytes]:
+        """
+        Serializes the rollups as line protocol, leaving out undefined (NaN) fields.
+
+        @return: List of line protocol lines
+        """
+        lines = []
+        prefixes = [
+            "latency_rollup" + DataProcessor.format_tags({"msm_id": measurement_id, "target": target, "window": f"{self.window_seconds}s"})
+            for target in targets
+        ]
+        names = sorted(stats)
+        columns: List[Tuple[str, list]] = [(name, stats[name].tolist()) for name in names]
+        for index, (window_start, target_code) in enumerate(groups.tolist()):
+            fields = []
+            for name, values in columns:
+                value = values[index]
+                if name == "count":
+                    fields.append(f"count={int(value)}i")
+                elif value == value:  # skip NaN
+                    fields.append(f"{name}={DataProcessor.format_field_value(float(value))}")
+            lines.append(f"{prefixes[target_code]} {','.join(fields)} {window_start * 1_000_000_000}".encode())
+        logging.info(f"Prepared {len(lines)} latency rollups for InfluxDB.")
+        return lines
@@ -0,0 +1,77 @@
+import os
+import time
+import socket
+import logging
+from typing import Iterable, Optional, Set
+from modules.SQLiteManager import SQLiteManager
+
+
+class LeaseManager:
+    """
+    Assigns measurements to worker processes that share one SQLite registry.
+
+    Every worker renews its heartbeat and leases every renew_interval seconds and claims or
+    releases leases until it holds its fair share of all measurements. If a worker dies, its
+    leases expire after lease_ttl seconds and are claimed by the remaining workers. A worker
+    only processes measurements it holds a lease for, and only stores watermarks of those.
+
+    Lease expiry uses wall-clock time, so the clocks of all hosts must be synchronized.
+    """
+
+    def __init__(self, db_manager: SQLiteManager, worker_id: Optional[str] = None, lease_ttl: float = 60.0):
+        """
+        Initializes the LeaseManager.
+
+        @param db_manager: SQLiteManager of the shared registry
+        @param worker_id: Unique ID of this worker, defaults to <hostname>-<pid>
+        @param lease_ttl: Seconds a lease stays valid without renewal
+        """
+        self.db_manager = db_manager
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_ttl = lease_ttl
+        self.renew_interval = lease_ttl / 3
+        self.owned: Set[str] = set()
+        self._last_renewal = None
+        logging.info(f"LeaseManager initialized for worker {self.worker_id}.")
+
+    def renew_if_due(self, busy: Iterable[str] = ()) -> bool:
+        """
+        Renews and rebalances the leases if the last renewal is older than renew_interval.
+
+        If the renewal fails, the worker gives up all leases until the next successful renewal,
+        since it can no longer be sure that they are still its own.
+
+        @param busy: Measurement IDs the worker is processing right now
+        @return: True if the set of owned measurements changed
+        """
+        now = time.monotonic()
+        if self._last_renewal is not None and now - self._last_renewal < self.renew_interval:
+            return False
+        self._last_renewal = now
+
+        try:
+            owned = self.db_manager.rebalance_leases(self.worker_id, self.lease_ttl, time.time(), busy)
+        except Exception:
+            owned = set()
+
+        changed = owned != self.owned
+        if changed:
+            logging.info(f"Worker {self.worker_id} now holds {len(owned)} measurements (+{len(owned - self.owned)}/-{len(self.owned - owned)}).")
+        self.owned = owned
+        return changed
+
+    def owns(self, measurement_id: str) -> bool:
+        """
+        Checks whether this worker held the lease of a measurement at the last renewal.
+
+        @param measurement_id: ID of the measurement
+        @return: True if the measurement is leased to this worker
+        """
+        return measurement_id in self.owned
+
+    def release(self):
+        """
+        Releases all leases of this worker so others can take over immediately.
+        """
+        self.db_manager.release_leases(self.worker_id)
+        self.owned = set()
@@ -0,0 +1,172 @@
+import csv
+import time
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+from modules.RIPEAtlasAPI import RIPEAtlasAPI
+from modules.SQLiteManager import SQLiteManager
+
+
+class MeasurementCatalog:
+    """
+    Registers measurements in bulk, from the RIPE Atlas measurement listing or from a CSV file.
+
+    The type, interval and target of a measurement are taken from its RIPE Atlas metadata. The
+    metadata is cached in the measurement_metadata table, so it is fetched once per measurement,
+    and missing metadata is requested in pages of up to 500 IDs instead of one request each.
+    All measurements of one call are registered in a single transaction.
+    """
+
+    TYPES = {"ping": "Ping", "traceroute": "Traceroute"}  # RIPE Atlas type -> measurement type of the registry
+    MEASUREMENT_TYPES = ("Ping", "Traceroute", "Packetloss")
+    ONGOING = 2  # status ID of running measurements in the listing
+
+    def __init__(self, db_manager: SQLiteManager, ripe_api: RIPEAtlasAPI, min_interval: int = 60, retention_policies: Optional[Iterable[str]] = None):
+        """
+        Initializes the MeasurementCatalog.
+
+        @param db_manager: SQLiteManager instance of the measurement registry
+        @param ripe_api: RIPEAtlasAPI client for the measurement listing
+        @param min_interval: Lower bound of the polling interval in seconds
+        @param retention_policies: Retention policies accepted in CSV files, None accepts any
+        """
+        self.db_manager = db_manager
+        self.ripe_api = ripe_api
+        self.min_interval = min_interval
+        self.retention_policies = set(retention_policies) if retention_policies is not None else None
+
+    def discover(self, asn: Optional[str] = None, probes: Iterable[int] = (), ongoing_only: bool = True) -> List[str]:
+        """
+        Finds the measurements targeting an ASN or running on a set of probes and caches their metadata.
+
+        @param asn: Target ASN of the measurements
+        @param probes: Probe IDs, measurements currently running on any of them are included
+        @param ongoing_only: Only include measurements that are still running
+        @return: IDs of the found measurements
+        """
+        status = {"status": self.ONGOING} if ongoing_only else {}
+        listings = []
+        if asn:
+            listings.append(self.ripe_api.list_measurements(target_asn=asn, **status))
+        for probe in probes:
+            listings.append(self.ripe_api.list_measurements(current_probes=probe, **status))
+
+        found = {}
+        for listing in listings:
+            for measurement in listing:
+                found[str(measurement["id"])] = measurement
+        self._cache(found.values())
+        logging.info(f"Discovered {len(found)} measurements.")
+        return list(found)
+
+    def metadata(self, measurement_ids: Iterable[str]) -> Dict[str, Tuple]:
+        """
+        Returns the metadata of measurements, from the cache or fetched once for uncached ones.
+
+        @param measurement_ids: Measurement IDs
+        @return: Dictionary of measurement ID to (type, interval, target_asn, target, description, is_oneoff), unknown IDs are missing
+        """
+        measurement_ids = [str(measurement_id) for measurement_id in measurement_ids]
+        metadata = self.db_manager.get_measurement_metadata(measurement_ids)
+        missing = [measurement_id for measurement_id in measurement_ids if measurement_id not in metadata]
+        for offset in range(0, len(missing), RIPEAtlasAPI.MAX_PAGE_SIZE):
+            part = missing[offset:offset + RIPEAtlasAPI.MAX_PAGE_SIZE]
+            self._cache(self.ripe_api.list_measurements(id__in=",".join(part)))
+        if missing:
+            metadata.update(self.db_manager.get_measurement_metadata(missing))
+            unknown = [measurement_id for measurement_id in missing if measurement_id not in metadata]
+            if unknown:
+                logging.warning(f"No metadata found for {len(unknown)} measurements: {', '.join(unknown[:10])}")
+        return metadata
+
+    def register(self, measurement_ids: Iterable[str], retention_policy: str, asn: Optional[str] = None) -> int:
+        """
+        Registers measurements with the type, interval and target ASN of their metadata.
+
+        One-off measurements and types that are not ingested (e.g. DNS) are skipped.
+
+        @param measurement_ids: Measurement IDs
+        @param retention_policy: Data retention policy of all measurements
+        @param asn: ASN that names the bucket, defaults to the target ASN of each measurement
+        @return: Number of newly registered measurements
+        """
+        measurement_ids = [str(measurement_id) for measurement_id in measurement_ids]
+        metadata = self.metadata(measurement_ids)
+        records = []
+        for measurement_id in measurement_ids:
+            if measurement_id not in metadata:
+                continue
+            record = self._record(measurement_id, metadata[measurement_id], asn, retention_policy)
+            if record is not None:
+                records.append(record)
+        return self.db_manager.add_measurements(records)
+
+    def import_csv(self, path: str, retention_policy: str, asn: Optional[str] = None) -> int:
+        """
+        Registers the measurements listed in a CSV file.
+
+        The file needs a header with a measurement_id column. The optional columns asn,
+        retention_policy, type and interval override the defaults and the metadata per row.
+
+        @param path: Path to the CSV file
+        @param retention_policy: Retention policy of rows without one
+        @param asn: ASN of rows without one, defaults to the target ASN of each measurement
+        @return: Number of newly registered measurements
+        @raise OSError: If the file cannot be read
+        """
+        with open(path, newline="", encoding="utf-8") as file:
+            rows = [{key.strip().lower(): (value or "").strip() for key, value in row.items() if key} for row in csv.DictReader(file)]
+
+        valid = []
+        for line, row in enumerate(rows, start=2):
+            measurement_id = row.get("measurement_id", "")
+            row_policy = row.get("retention_policy") or retention_policy
+            row_type = row.get("type", "").capitalize()
+            if not measurement_id.isdigit() or not (row.get("asn") or "0").isdigit() or not (row.get("interval") or "0").isdigit():
+                logging.error(f"{path}:{line} - measurement_id, asn and interval must be numeric, skipped.")
+            elif self.retention_policies is not None and row_policy not in self.retention_policies:
+                logging.error(f"{path}:{line} - unknown retention policy '{row_policy}', skipped.")
+            elif row_type and row_type not in self.MEASUREMENT_TYPES:
+                logging.error(f"{path}:{line} - unknown measurement type '{row_type}', skipped.")
+            else:
+                valid.append((measurement_id, row.get("asn") or asn, row_policy, row_type, int(row.get("interval") or 0)))
+
+        # rows that name everything need no metadata
+        metadata = self.metadata(row[0] for row in valid if not (row[1] and row[3] and row[4]))
+        records = []
+        for measurement_id, row_asn, row_policy, row_type, row_interval in valid:
+            if row_asn and row_type and row_interval:
+                records.append((measurement_id, row_asn, f"AS_{row_asn}", row_policy, max(self.min_interval, row_interval), row_type))
+            elif measurement_id in metadata:
+                record = self._record(measurement_id, metadata[measurement_id], row_asn, row_policy, row_type, row_interval)
+                if record is not None:
+                    records.append(record)
+        logging.info(f"Read {len(rows)} rows from '{path}', {len(records)} are valid.")
+        return self.db_manager.add_measurements(records)
+
+    def _record(self, measurement_id: str, metadata: Tuple, asn: Optional[str], retention_policy: str, measurement_type: str = "", interval: int = 0) -> Optional[Tuple]:
+        """
+        Builds a registry record from metadata, explicit values take precedence.
+
+        @return: Record for SQLiteManager.add_measurements, None if the measurement is not ingestible
+        """
+        ripe_type, ripe_interval, target_asn, _, _, is_oneoff = metadata
+        measurement_type = measurement_type or self.TYPES.get(ripe_type)
+        asn = asn or target_asn
+        if measurement_type is None:
+            logging.info(f"ID: {measurement_id} - type '{ripe_type}' is not ingested, skipped.")
+            return None
+        if is_oneoff and not interval:
+            logging.info(f"ID: {measurement_id} - one-off measurement, skipped.")
+            return None
+        if not asn:
+            logging.warning(f"ID: {measurement_id} - no ASN given and no target ASN known, skipped.")
+            return None
+        return measurement_id, str(asn), f"AS_{asn}", retention_policy, max(self.min_interval, interval or ripe_interval or 0), measurement_type
+
+    def _cache(self, measurements: Iterable[Dict]):
+        """Stores the metadata of listed measurements in the cache."""
+        now = time.time()
+        # built before the transaction, a failing listing request must not surface as a database error
+        metadata = [(str(m["id"]), m.get("type"), m.get("interval"), str(m["target_asn"]) if m.get("target_asn") else None,
+                     m.get("target"), m.get("description"), int(bool(m.get("is_oneoff"))), now) for m in measurements]
+        self.db_manager.store_measurement_metadata(metadata)
@@ -0,0 +1,135 @@
+import time
+import heapq
+import random
+import logging
+from typing import Dict, List, Optional
+
+
+class MeasurementScheduler:
+    """
+    Keeps the next due time of every measurement in a priority queue.
+
+    Every measurement is polled once per its own interval. Due times advance by exactly one
+    interval from the previous due time, so processing time does not make the period drift,
+    and a measurement that fell behind skips the missed slots instead of firing repeatedly.
+    Each measurement gets a random phase offset when it is registered, which spreads the
+    requests of measurements with the same interval over time.
+    """
+
+    def __init__(self, default_interval: int = 60, max_jitter: float = 30.0):
+        """
+        Initializes the MeasurementScheduler.
+
+        @param default_interval: Interval in seconds for measurements without a valid interval
+        @param max_jitter: Upper bound of the random phase offset in seconds
+        """
+        self.default_interval = default_interval
+        self.max_jitter = max_jitter
+        self._heap = []  # (due, sequence, measurement_id), entries are invalidated lazily
+        self._entries: Dict[str, dict] = {}
+        self._sequence = 0
+
+    def _interval_of(self, measurement: tuple) -> int:
+        """Returns the polling interval of a measurement record."""
+        try:
+            interval = int(measurement[5])
+            return interval if interval > 0 else self.default_interval
+        except (TypeError, ValueError):
+            return self.default_interval
+
+    def _push(self, measurement_id: str, due: float):
+        """Schedules a measurement at the given due time."""
+        entry = self._entries[measurement_id]
+        entry["due"] = due
+        self._sequence += 1
+        heapq.heappush(self._heap, (due, self._sequence, measurement_id))
+
+    def sync(self, measurements: List[tuple], now: Optional[float] = None):
+        """
+        Brings the schedule in line with the registered measurements.
+
+        New measurements become due after their random phase offset, removed ones are dropped and
+        changed records take effect with their next run.
+
+        @param measurements: Measurement records as returned by SQLiteManager.get_measurements
+        @param now: Current monotonic time, defaults to time.monotonic()
+        """
+        now = time.monotonic() if now is None else now
+        current = {measurement[1]: measurement for measurement in measurements}
+
+        for measurement_id, entry in list(self._entries.items()):
+            if measurement_id not in current and not entry["removed"]:
+                if entry["running"]:
+                    entry["removed"] = True  # dropped by complete(), so it is never run twice at once
+                else:
+                    del self._entries[measurement_id]
+                logging.info(f"ID: {measurement_id} - removed from schedule.")
+
+        for measurement_id, measurement in current.items():
+            entry = self._entries.get(measurement_id)
+            if entry is None:
+                interval = self._interval_of(measurement)
+                self._entries[measurement_id] = {"measurement": measurement, "interval": interval, "due": None, "running": False, "removed": False}
+                self._push(measurement_id, now + random.uniform(0, min(interval, self.max_jitter)))
+                logging.info(f"ID: {measurement_id} - scheduled every {interval}s.")
+            else:
+                entry["measurement"] = measurement
+                entry["interval"] = self._interval_of(measurement)
+                entry["removed"] = False
+
+    def pop_due(self, now: Optional[float] = None) -> List[tuple]:
+        """
+        Removes and returns all measurements that are due and not running.
+
+        @param now: Current monotonic time, defaults to time.monotonic()
+        @return: List of measurement records, marked as running until complete() is called
+        """
+        now = time.monotonic() if now is None else now
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due_time, _, measurement_id = heapq.heappop(self._heap)
+            entry = self._entries.get(measurement_id)
+            if entry is None or entry["running"] or entry["due"] != due_time:
+                continue
+            entry["running"] = True
+            due.append(entry["measurement"])
+        return due
+
+    def complete(self, measurement_id: str, now: Optional[float] = None):
+        """
+        Marks a measurement as finished and schedules its next run.
+
+        @param measurement_id: ID of the finished measurement
+        @param now: Current monotonic time, defaults to time.monotonic()
+        """
+        now = time.monotonic() if now is None else now
+        entry = self._entries.get(measurement_id)
+        if entry is None:
+            return
+        if entry["removed"]:
+            del self._entries[measurement_id]
+            return
+        entry["running"] = False
+        due = entry["due"] + entry["interval"]
+        if due < now:
+            # skip the slots that were missed while the run was slow
+            missed = int((now - due) // entry["interval"]) + 1
+            due += missed * entry["interval"]
+        self._push(measurement_id, due)
+
+    def next_due(self) -> Optional[float]:
+        """
+        Returns the earliest due time of a measurement that is not running.
+
+        @return: Monotonic time, or None if nothing is scheduled
+        """
+        while self._heap:
+            due_time, _, measurement_id = self._heap[0]
+            entry = self._entries.get(measurement_id)
+            if entry is not None and not entry["running"] and entry["due"] == due_time:
+                return due_time
+            heapq.heappop(self._heap)
+        return None
+
+    def __len__(self) -> int:
+        return sum(1 for entry in self._entries.values() if not entry["removed"])
@@ -0,0 +1,322 @@
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+from typing import Dict, List, Tuple, Iterator, Sequence, Callable
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+
+
+def _escape_label(value: str) -> str:
+    """Escapes a label value for the Prometheus text format."""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+
+
+def _format_value(value: float) -> str:
+    """Formats a sample value, integers without a decimal point."""
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Family:
+    """
+    Base of all metric families, a metric name with a fixed set of label names.
+
+    Label values are passed positionally in the order of the label names.
+    """
+
+    TYPE = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _label_text(self, values: Tuple[str, ...], extra: str = "") -> str:
+        """Formats label names and values as {name="value",...}."""
+        pairs = [f'{name}="{_escape_label(str(value))}"' for name, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        """Returns the HELP, TYPE and sample lines of the family."""
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Family):
+    """
+    Monotonically increasing value per label set.
+    """
+
+    TYPE = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values, amount: float = 1.0):
+        """
+        Increases the counter of a label set.
+
+        @param label_values: Label values in the order of the label names
+        @param amount: Non-negative increment
+        """
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{self._label_text(labels)} {_format_value(value)}" for labels, value in values]
+
+
+class Gauge(_Family):
+    """
+    Value per label set that can go up and down.
+    """
+
+    TYPE = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._callbacks: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, *label_values, value: float):
+        """
+        Sets the gauge of a label set.
+
+        @param label_values: Label values in the order of the label names
+        @param value: New value
+        """
+        with self._lock:
+            self._values[label_values] = value
+
+    def set_function(self, *label_values, function: Callable[[], float]):
+        """
+        Reads the gauge of a label set from a function whenever the metrics are rendered.
+
+        @param label_values: Label values in the order of the label names
+        @param function: Function returning the current value
+        """
+        with self._lock:
+            self._callbacks[label_values] = function
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+            callbacks = dict(self._callbacks)
+        for labels, function in callbacks.items():
+            try:
+                values[labels] = function()
+            except Exception as e:
+                logging.debug(f"Gauge {self.name} callback failed: {e}")
+        return [f"{self.name}{self._label_text(labels)} {_format_value(value)}" for labels, value in sorted(values.items())]
+
+
+class Histogram(_Family):
+    """
+    Distribution of observed values per label set in fixed buckets, with sum and count.
+    """
+
+    TYPE = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [counts per bucket plus one for +Inf, sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, *label_values, value: float):
+        """
+        Records one observation.
+
+        @param label_values: Label values in the order of the label names
+        @param value: Observed value
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, *label_values) -> Iterator[None]:
+        """
+        Observes the wall time of the with block in seconds, also if it raises.
+
+        @param label_values: Label values in the order of the label names
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(*label_values, value=time.perf_counter() - start)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((labels, list(counts), total) for labels, (counts, total) in self._values.items())
+        lines = []
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                bound_label = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{self._label_text(labels, bound_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._label_text(labels)} {cumulative}")
+        return lines
+
+
+class Metrics:
+    """
+    In-process registry of counters, gauges and histograms, served in the Prometheus text format.
+
+    Components register their metric families once and update them on the hot path, an update is
+    a dictionary lookup under a per-family lock. Registering an existing name returns the existing
+    family, so several components can share one. The optional HTTP endpoint answers GET /metrics
+    on a background thread and, with a SamplingProfiler attached, GET /profile with its stacks.
+    With a RollupStore attached, GET /rollups?asn=&measurement=&target=&seconds=&quantiles= returns
+    the latency summary of RollupStore.query() as JSON.
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        """
+        Initializes an empty registry.
+        """
+        self._families: Dict[str, _Family] = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self.profiler = None
+        self.rollups = None
+
+    def _register(self, family_class: type, name: str, documentation: str, labels: Sequence[str], **kwargs) -> _Family:
+        """Returns the family registered under name, registering it first if needed."""
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = family_class(name, documentation, labels, **kwargs)
+            elif not isinstance(family, family_class) or family.labels != tuple(labels):
+                raise ValueError(f"Metric '{name}' is already registered with a different type or labels.")
+            return family
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        """
+        Registers a counter.
+
+        @param name: Metric name, by convention ending in _total
+        @param documentation: HELP text
+        @param labels: Label names
+        @return: Counter family
+        """
+        return self._register(Counter, name, documentation, labels)
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+        """
+        Registers a gauge.
+
+        @param name: Metric name
+        @param documentation: HELP text
+        @param labels: Label names
+        @return: Gauge family
+        """
+        return self._register(Gauge, name, documentation, labels)
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        """
+        Registers a histogram.
+
+        @param name: Metric name, by convention ending in the unit, e.g. _seconds or _bytes
+        @param documentation: HELP text
+        @param labels: Label names
+        @param buckets: Upper bounds of the buckets, +Inf is added implicitly
+        @return: Histogram family
+        """
+        return self._register(Histogram, name, documentation, labels, buckets=buckets)
+
+    def render(self) -> str:
+        """
+        Renders all families in the Prometheus text exposition format.
+
+        @return: Exposition text
+        """
+        with self._lock:
+            families = sorted(self._families.values(), key=lambda family: family.name)
+        lines = []
+        for family in families:
+            lines += family.render()
+        return "\n".join(lines) + "\n"
+
+    def start_server(self, host: str = "127.0.0.1", port: int = 9108) -> Tuple[str, int]:
+        """
+        Starts the HTTP endpoint on a background thread.
+
+        @param host: Address to bind to, keep the default to serve only local scrapers
+        @param port: Port to bind to, 0 picks a free one
+        @return: Bound (host, port)
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path, _, query = self.path.partition("?")
+                if path == "/metrics":
+                    body, content_type = registry.render().encode(), registry.CONTENT_TYPE
+                elif path == "/profile" and registry.profiler is not None:
+                    body, content_type = registry.profiler.collapsed().encode(), "text/plain; charset=utf-8"
+                elif path == "/rollups" and registry.rollups is not None:
+                    parameters = {key: values[-1] for key, values in parse_qs(query).items()}
+                    try:
+                        summary = registry.rollups.query(
+                            asn=parameters.get("asn"),
+                            measurement_id=parameters.get("measurement"),
+                            target=parameters.get("target"),
+                            seconds=int(parameters.get("seconds", 3600)),
+                            quantiles=[float(q) for q in parameters.get("quantiles", "0.5,0.95,0.99").split(",")],
+                        )
+                    except ValueError:
+                        self.send_error(400, "seconds and quantiles must be numeric")
+                        return
+                    body, content_type = json.dumps(summary).encode(), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True).start()
+        address = self._server.server_address[:2]
+        logging.info(f"Metrics endpoint listening on http://{address[0]}:{address[1]}/metrics")
+        return address
+
+    def stop_server(self):
+        """
+        Stops the HTTP endpoint.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
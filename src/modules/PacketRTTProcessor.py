@@ -0,0 +1,138 @@
+import logging
+import numpy as np
+from typing import List, Dict, Any, Iterable
+from modules.DataProcessor import DataProcessor
+
+
+class PacketRTTProcessor:
+    """
+    Flattens the per-packet replies of ping results into columnar NumPy arrays.
+
+    The nested result[].rtt lists of a batch are copied into arrays that are preallocated for
+    the total number of replies, in a single pass and without a dictionary per packet. Each
+    reply gets a status: OK, TIMEOUT ("x": "*"), ERROR ("error": ...) or DUPLICATE ("dup").
+    From these arrays the processor writes per-packet RTT lines and/or derived per-result
+    statistics (min, max, jitter, timeouts, errors, duplicates) computed with vectorized ops.
+    """
+
+    OK, TIMEOUT, ERROR, DUPLICATE = 0, 1, 2, 3
+
+    def __init__(self, per_packet: bool = True, derived: bool = True):
+        """
+        Initializes the PacketRTTProcessor.
+
+        @param per_packet: Write one packet_rtt line per reply
+        @param derived: Write one packet_stats line per result
+        """
+        self.per_packet = per_packet
+        self.derived = derived
+
+    def flatten(self, results: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+        """
+        Copies the replies of all results into preallocated column arrays.
+
+        @param results: Ping measurement results
+        @return: Dictionary of equally long arrays: result (index into results), seq, rtt (NaN unless OK or DUPLICATE), status
+        """
+        total = sum(len(r.get("result") or ()) for r in results)
+        result_index = np.empty(total, dtype=np.int32)
+        seq = np.empty(total, dtype=np.int16)
+        rtt = np.full(total, np.nan, dtype=np.float64)
+        status = np.empty(total, dtype=np.int8)
+
+        position = 0
+        for index, result in enumerate(results):
+            for number, reply in enumerate(result.get("result") or ()):
+                result_index[position] = index
+                seq[position] = number
+                value = reply.get("rtt")
+                if value is not None:
+                    rtt[position] = value
+                    status[position] = self.DUPLICATE if reply.get("dup") else self.OK
+                elif "error" in reply:
+                    status[position] = self.ERROR
+                else:
+                    status[position] = self.TIMEOUT
+                position += 1
+
+        return {"result": result_index, "seq": seq, "rtt": rtt, "status": status}
+
+    def derive(self, result_count: int, packets: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """
+        Computes per-result statistics from the packet columns.
+
+        Jitter is the mean absolute difference between consecutive answered packets of a result.
+
+        @param result_count: Number of results the packets belong to
+        @param packets: Column arrays as returned by flatten
+        @return: Dictionary of arrays of length result_count
+        """
+        result_index, rtt, status = packets["result"], packets["rtt"], packets["status"]
+        answered = status == self.OK
+
+        stats = {
+            "timeouts": np.bincount(result_index[status == self.TIMEOUT], minlength=result_count),
+            "errors": np.bincount(result_index[status == self.ERROR], minlength=result_count),
+            "dups": np.bincount(result_index[status == self.DUPLICATE], minlength=result_count)
+        }
+
+        ok_result = result_index[answered]
+        ok_rtt = rtt[answered]
+        minimum = np.full(result_count, np.inf)
+        maximum = np.full(result_count, -np.inf)
+        np.minimum.at(minimum, ok_result, ok_rtt)
+        np.maximum.at(maximum, ok_result, ok_rtt)
+        stats["min"] = np.where(np.isfinite(minimum), minimum, np.nan)
+        stats["max"] = np.where(np.isfinite(maximum), maximum, np.nan)
+
+        # replies keep their order within a result, so neighbours in the answered subset are consecutive packets
+        same = ok_result[1:] == ok_result[:-1]
+        difference_result = ok_result[1:][same]
+        difference_sum = np.bincount(difference_result, weights=np.abs(np.diff(ok_rtt))[same], minlength=result_count)
+        difference_count = np.bincount(difference_result, minlength=result_count)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            stats["jitter"] = np.where(difference_count > 0, difference_sum / difference_count, np.nan)
+        return stats
+
+    def prepare(self, measurement_results: Iterable[Dict[str, Any]], retention_seconds: int, current_time: int) -> List[bytes]:
+        """
+        Prepares per-packet and derived per-result series for InfluxDB.
+
+        Per-packet lines are offset by their sequence number in nanoseconds, so the replies of
+        one result do not overwrite each other.
+
+        @param measurement_results: Ping measurement results
+        @param retention_seconds: Retention period in seconds
+        @param current_time: Current unix timestamp
+        @return: List of line protocol lines of the measurements packet_rtt and packet_stats
+        """
+        results = [r for r in measurement_results if current_time - r.get("timestamp", current_time) <= retention_seconds]
+        if not results:
+            return []
+
+        packets = self.flatten(results)
+        tags = [
+            DataProcessor.format_tags({"msm_id": r.get("msm_id", "unknown"), "probe_id": r.get("prb_id", "unknown"), "target": r.get("dst_addr", "unknown")})
+            for r in results
+        ]
+        timestamps = [r.get("timestamp", current_time) * 1_000_000_000 for r in results]
+        lines = []
+
+        if self.per_packet:
+            for index, seq, rtt, status in zip(packets["result"].tolist(), packets["seq"].tolist(), packets["rtt"].tolist(), packets["status"].tolist()):
+                rtt_field = f"rtt={DataProcessor.format_field_value(rtt)}," if rtt == rtt else ""
+                lines.append(f"packet_rtt{tags[index]} {rtt_field}seq={seq}i,status={status}i {timestamps[index] + seq}".encode())
+
+        if self.derived:
+            stats = {name: values.tolist() for name, values in self.derive(len(results), packets).items()}
+            for index in range(len(results)):
+                fields = [f"dups={stats['dups'][index]}i", f"errors={stats['errors'][index]}i"]
+                for name in ("jitter", "max", "min"):
+                    value = stats[name][index]
+                    if value == value:  # skip NaN
+                        fields.append(f"{name}={DataProcessor.format_field_value(value)}")
+                fields.append(f"timeouts={stats['timeouts'][index]}i")
+                lines.append(f"packet_stats{tags[index]} {','.join(fields)} {timestamps[index]}".encode())
+
+        logging.info(f"Prepared {len(lines)} packet metrics for InfluxDB.")
+        return lines
@@ -0,0 +1,101 @@
+import math
+import struct
+from typing import Dict, Optional
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with a bounded relative error, following DDSketch.
+
+    Positive values are counted in logarithmically sized buckets, bucket i holds the values in
+    (gamma^(i-1), gamma^i] with gamma = (1 + a) / (1 - a), so every quantile is returned within
+    the relative accuracy a of the true value. Two sketches are merged by adding their bucket
+    counts, which makes per-minute sketches combinable into the sketch of any longer window.
+    Latencies between 1 µs and 100 s need fewer than 1,000 buckets at 1 % accuracy.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        """
+        Initializes an empty sketch.
+
+        @param relative_accuracy: Maximum relative error of a quantile, between 0 and 1
+        """
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: Dict[int, int] = {}
+        self.zero_count = 0  # values <= 0, which have no logarithm
+        self.count = 0
+
+    def add(self, value: float, count: int = 1):
+        """
+        Adds a value.
+
+        @param value: Value to add
+        @param count: Number of times the value is added
+        """
+        if value > 0:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        else:
+            self.zero_count += count
+        self.count += count
+
+    def merge(self, other: "QuantileSketch"):
+        """
+        Adds the values of another sketch with the same relative accuracy.
+
+        @param other: Sketch to merge into this one
+        """
+        if other.gamma != self.gamma:
+            raise ValueError("Only sketches with the same relative accuracy can be merged.")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Returns an estimate of a quantile.
+
+        @param q: Quantile between 0 and 1, e.g. 0.95
+        @return: Estimated value, None if the sketch is empty
+        """
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                # the value in the bucket with the lowest relative error to both bounds
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def to_bytes(self) -> bytes:
+        """
+        Serializes the sketch compactly, 6 bytes per non-empty bucket.
+
+        @return: Serialized sketch
+        """
+        indexes = sorted(self.buckets)
+        return struct.pack(f"<II{len(indexes)}h{len(indexes)}I", self.zero_count, len(indexes), *indexes, *(self.buckets[index] for index in indexes))
+
+    @classmethod
+    def from_bytes(cls, data: bytes, relative_accuracy: float = 0.01) -> "QuantileSketch":
+        """
+        Restores a sketch serialized by to_bytes.
+
+        @param data: Serialized sketch
+        @param relative_accuracy: Relative accuracy the sketch was created with
+        @return: Sketch
+        """
+        sketch = cls(relative_accuracy)
+        zero_count, size = struct.unpack_from("<II", data)
+        values = struct.unpack_from(f"<{size}h{size}I", data, 8)
+        sketch.buckets = dict(zip(values[:size], values[size:]))
+        sketch.zero_count = zero_count
+        sketch.count = zero_count + sum(values[size:])
+        return sketch
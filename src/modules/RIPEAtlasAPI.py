@@ -1,6 +1,11 @@
+import json
+import time
+import codecs
 import logging
 import requests
-from typing import List, Dict, Any, Optional
+from modules.HTTPTransport import HTTPTransport
+from modules.Metrics import Metrics, SIZE_BUCKETS
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple
 
 class RIPEAtlasAPI:
     """
@@ -8,29 +13,279 @@ class RIPEAtlasAPI:
     """
 
     BASE_URL = "https://atlas.ripe.net/api/v2/"
+    DEFAULT_CHUNK_SECONDS = 6 * 3600  # upper bound for a single start/stop window
+    DEFAULT_BATCH_SIZE = 500  # results handed to the caller at once when streaming
+    READ_SIZE = 64 * 1024  # bytes read from the HTTP body per iteration
+    MAX_PAGE_SIZE = 500  # largest page of the measurement listing
 
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, timeout: float = 30.0, transport: Optional[HTTPTransport] = None, base_url: Optional[str] = None, metrics: Optional[Metrics] = None):
         """
         Initialize the API client with the API key.
 
         @param api_key: RIPE Atlas API key for authentication
+        @param timeout: Connect and read timeout per request in seconds, used if no transport is given
+        @param transport: HTTPTransport used for all requests, a default one is created if None
+        @param base_url: API root URL, e.g. of a local stand-in server, defaults to BASE_URL
+        @param metrics: Metrics registry for the fetch and decode timings, a private one is created if None
         """
-        self.session = requests.Session()
-        self.session.headers.update({"Authorization": f"Key {api_key}"})
+        self.transport = transport or HTTPTransport(timeout=timeout)
+        self.transport.session.headers.update({"Authorization": f"Key {api_key}"})
+        self.session = self.transport.session
+        self.base_url = base_url or self.BASE_URL
+        metrics = metrics or Metrics()
+        self._stage_seconds = metrics.histogram("ingest_stage_seconds", "Seconds spent in an ingest stage, one observation per call.", ("measurement", "stage"))
+        self._response_bytes = metrics.histogram("ingest_fetched_bytes", "Body size of each RIPE Atlas results response.", ("measurement",), buckets=SIZE_BUCKETS)
         logging.info("RIPEAtlasAPI client initialized.")
 
-    def fetch_measurement_results(self, measurement_id: int) -> Optional[List[Dict[str, Any]]]:
+    def fetch_measurement_results(self, measurement_id: int, start: Optional[int] = None, stop: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
         """
         Fetch measurement results from the RIPE Atlas API.
 
         @param measurement_id: ID of the measurement
+        @param start: Optional unix timestamp, only results at or after this time are returned
+        @param stop: Optional unix timestamp, only results at or before this time are returned
         @return: List of measurement results or None if the request fails
         """
-        url = f"{self.BASE_URL}measurements/{measurement_id}/results/"
+        url = f"{self.base_url}measurements/{measurement_id}/results/"
+        params = {}
+        if start is not None:
+            params["start"] = int(start)
+        if stop is not None:
+            params["stop"] = int(stop)
+
         try:
-            response = self.session.get(url)
+            response = self.transport.get(url, params=params)
             response.raise_for_status()
             return response.json()
         except requests.RequestException as e:
             logging.error(f"Failed to fetch measurement data: {e}")
             return None
+
+    def list_measurements(self, page_size: int = MAX_PAGE_SIZE, **filters: Any) -> Iterator[Dict[str, Any]]:
+        """
+        Page through the measurement listing of the RIPE Atlas API.
+
+        @param page_size: Measurements per page, at most MAX_PAGE_SIZE
+        @param filters: Query filters of the listing, e.g. target_asn=3333, status=2, id__in="1,2" or current_probes=6001
+        @return: Iterator over the metadata of the matching measurements
+        @raise requests.RequestException: If a page cannot be fetched
+        """
+        url = f"{self.base_url}measurements/"
+        params = dict(filters, page_size=min(page_size, self.MAX_PAGE_SIZE))
+        while url:
+            response = self.transport.get(url, params=params)
+            response.raise_for_status()
+            page = response.json()
+            yield from page.get("results", [])
+            # the next link already carries the filters
+            url, params = page.get("next"), None
+
+    def stream_measurement_results(self, measurement_id: int, start: Optional[int] = None, stop: Optional[int] = None, batch_size: int = DEFAULT_BATCH_SIZE, conditional: bool = False) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Stream measurement results from the RIPE Atlas API in fixed-size batches.
+
+        The response body is read and decoded incrementally, so at most one batch of results
+        plus one read buffer is held in memory regardless of the size of the response.
+
+        In conditional mode, the validators of an empty response are remembered, and the next
+        identical request yields nothing when the server answers 304 Not Modified. Non-empty
+        responses are never revalidated, their results must always reach the caller.
+
+        @param measurement_id: ID of the measurement
+        @param start: Optional unix timestamp, only results at or after this time are returned
+        @param stop: Optional unix timestamp, only results at or before this time are returned
+        @param batch_size: Maximum number of results per yielded batch
+        @param conditional: Revalidate a previously empty response instead of downloading it again
+        @return: Iterator over lists of at most batch_size measurement results
+        @raise requests.RequestException: If the request fails or the body is cut off
+        """
+        url = f"{self.base_url}measurements/{measurement_id}/results/"
+        params = {}
+        if start is not None:
+            params["start"] = int(start)
+        if stop is not None:
+            params["stop"] = int(stop)
+
+        label = str(measurement_id)
+        request_start = time.perf_counter()
+        with self.transport.get(url, params=params, stream=True, conditional=conditional) as response:
+            request_seconds = time.perf_counter() - request_start
+            if response.status_code == 304:
+                self._stage_seconds.observe(label, "fetch", value=request_seconds)
+                logging.debug(f"ID: {measurement_id} - results not modified.")
+                return
+            response.raise_for_status()
+            batch = []
+            count = 0
+            # body reads and JSON decoding interleave, so the reads are timed separately and the
+            # rest of the time spent between two yields is decoding
+            read = [0.0, 0]  # seconds, bytes
+            busy = 0.0
+            resumed = time.perf_counter()
+            try:
+                for result in self.iter_json_array(self._timed_chunks(response.iter_content(chunk_size=self.READ_SIZE), read)):
+                    batch.append(result)
+                    count += 1
+                    if len(batch) >= batch_size:
+                        busy += time.perf_counter() - resumed
+                        yield batch
+                        batch = []
+                        resumed = time.perf_counter()
+                busy += time.perf_counter() - resumed
+            except ValueError as e:
+                raise requests.RequestException(f"Invalid result stream for measurement {measurement_id}: {e}")
+            finally:
+                self._stage_seconds.observe(label, "fetch", value=request_seconds + read[0])
+                self._stage_seconds.observe(label, "decode", value=max(0.0, busy - read[0]))
+                self._response_bytes.observe(label, value=read[1])
+            if batch:
+                yield batch
+
+            if conditional:
+                if count == 0:
+                    self.transport.remember_validators(url, params, response)
+                else:
+                    self.transport.forget_validators(url)
+
+    def fetch_new_measurement_results(self, measurement_id: int, last_timestamp: int, retention_seconds: int, chunk_seconds: int = DEFAULT_CHUNK_SECONDS, batch_size: int = DEFAULT_BATCH_SIZE, conditional: bool = True) -> Iterator[Iterator[List[Dict[str, Any]]]]:
+        """
+        Fetch only the results newer than the stored watermark and inside the retention period.
+
+        The window is requested in bounded start/stop chunks, oldest first. Each chunk is yielded
+        as a stream of result batches (see stream_measurement_results), so a caller can process
+        a chunk batch by batch and acknowledge it once the chunk is fully consumed. A failed
+        chunk raises while it is consumed, before any later chunk is requested.
+
+        @param measurement_id: ID of the measurement
+        @param last_timestamp: Timestamp of the newest result that was already processed
+        @param retention_seconds: Retention period in seconds, older results are not requested
+        @param chunk_seconds: Maximum length of a single request window in seconds
+        @param batch_size: Maximum number of results per batch
+        @param conditional: Revalidate the last chunk, False for occasional requests that would replace its validators
+        @return: Iterator over chunks, each an iterator over lists of measurement results
+        """
+        now = int(time.time())
+        start = max(last_timestamp + 1, now - retention_seconds)
+
+        chunks = self.split_time_window(start, now, chunk_seconds)
+        for index, (chunk_start, chunk_stop) in enumerate(chunks):
+            if index == len(chunks) - 1:
+                yield self.stream_measurement_results(measurement_id, start=chunk_start, batch_size=batch_size, conditional=conditional)
+            else:
+                yield self.stream_measurement_results(measurement_id, start=chunk_start, stop=chunk_stop, batch_size=batch_size)
+
+    @staticmethod
+    def _timed_chunks(chunks: Iterable[bytes], read: list) -> Iterator[bytes]:
+        """
+        Passes chunks through and adds the time spent waiting for each and its size to read.
+
+        @param chunks: Iterable of byte chunks, e.g. a response body
+        @param read: List of [seconds, bytes] that is updated in place
+        @return: Iterator over the same chunks
+        """
+        iterator = iter(chunks)
+        while True:
+            start = time.perf_counter()
+            chunk = next(iterator, None)
+            read[0] += time.perf_counter() - start
+            if chunk is None:
+                return
+            read[1] += len(chunk)
+            yield chunk
+
+    @staticmethod
+    def iter_json_array(chunks: Iterable[bytes]) -> Iterator[Any]:
+        """
+        Incrementally decode a JSON array from a sequence of byte chunks.
+
+        Elements are yielded as soon as they are complete. An element is only accepted once
+        the character following it has been read, a number only once that character cannot
+        continue it, so values split anywhere across chunk boundaries are never decoded
+        prematurely. Anything but whitespace after the closing bracket is rejected.
+
+        @param chunks: Iterable of UTF-8 encoded byte chunks forming one JSON array
+        @return: Iterator over the decoded array elements
+        @raise ValueError: If the input is not a well-formed JSON array
+        """
+        decoder = json.JSONDecoder()
+        text_decoder = codecs.getincrementaldecoder("utf-8")()
+        buffer = ""
+        pos = 0
+        # "[" before the array, "first" after "[", "value" after ",", "," or "]" after an element,
+        # "end" after the closing "]"
+        expected = "["
+        exhausted = False
+        chunk_iter = iter(chunks)
+
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                pos += 1
+
+            if expected == "end":
+                if pos < len(buffer):
+                    raise ValueError("unexpected data after the JSON array")
+                if exhausted:
+                    return
+            elif pos < len(buffer):
+                char = buffer[pos]
+                if expected == "[":
+                    if char != "[":
+                        raise ValueError("expected a JSON array")
+                    expected = "first"
+                    pos += 1
+                    continue
+                if char == "]" and expected in ("first", ","):
+                    expected = "end"
+                    pos += 1
+                    continue
+                if expected == ",":
+                    if char != ",":
+                        raise ValueError("expected ',' or ']' after an array element")
+                    expected = "value"
+                    pos += 1
+                    continue
+                if char in ",]":
+                    raise ValueError("expected an array element")
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                    # "12" of "12.5e3" is a valid number, so a number is only complete once a character follows that cannot continue it
+                    complete = end < len(buffer) and (char not in "-0123456789" or buffer[end] not in "0123456789+-.eE")
+                    if complete or exhausted:
+                        yield value
+                        pos = end
+                        expected = ","
+                        continue
+                except json.JSONDecodeError:
+                    if exhausted:
+                        raise
+
+            if exhausted:
+                raise ValueError("unexpected end of JSON array")
+
+            # drop consumed text and read more
+            buffer = buffer[pos:]
+            pos = 0
+            chunk = next(chunk_iter, None)
+            if chunk is None:
+                exhausted = True
+                buffer += text_decoder.decode(b"", final=True)
+            elif chunk:
+                buffer += text_decoder.decode(chunk)
+
+    @staticmethod
+    def split_time_window(start: int, stop: int, chunk_seconds: int) -> List[Tuple[int, int]]:
+        """
+        Split the closed interval [start, stop] into consecutive non-overlapping chunks.
+
+        @param start: First timestamp of the window
+        @param stop: Last timestamp of the window
+        @param chunk_seconds: Maximum length of a chunk in seconds
+        @return: List of (chunk_start, chunk_stop) tuples, empty if start > stop
+        """
+        chunks = []
+        chunk_seconds = max(1, int(chunk_seconds))
+        while start <= stop:
+            chunk_stop = min(start + chunk_seconds - 1, stop)
+            chunks.append((start, chunk_stop))
+            start = chunk_stop + 1
+        return chunks
@@ -0,0 +1,186 @@
+import json
+import time
+import random
+import logging
+import threading
+from typing import Callable, Dict, Any, Iterable, Optional, Set
+
+
+class ResultStream:
+    """
+    Client of the RIPE Atlas result stream, which pushes new results of subscribed measurements.
+
+    The stream is a WebSocket carrying JSON arrays of [message type, payload]. Subscriptions are
+    sent as ["atlas_subscribe", {"streamType": "result", "msm": <id>}] and results arrive as
+    ["atlas_result", <result>]. run() keeps the connection up: after a disconnect it reconnects
+    with exponential backoff and jitter and subscribes again. streaming() tells which measurements
+    are subscribed on the current connection and since which connection, so the caller can tell
+    when results may have been missed and have to be fetched otherwise.
+
+    Requires the optional websocket-client package (pip install websocket-client).
+    """
+
+    DEFAULT_URL = "wss://atlas-stream.ripe.net/stream/"
+    RECEIVE_TIMEOUT = 1.0  # seconds a receive blocks before subscriptions and stop() are checked
+
+    def __init__(self, url: Optional[str] = None, api_key: Optional[str] = None, reconnect_delay: float = 1.0, max_reconnect_delay: float = 60.0, ping_interval: float = 30.0, connect_timeout: float = 10.0):
+        """
+        Initializes the ResultStream.
+
+        @param url: WebSocket URL of the stream, e.g. of a local stand-in server, defaults to DEFAULT_URL
+        @param api_key: RIPE Atlas API key, sent as Authorization header for non-public measurements
+        @param reconnect_delay: Delay in seconds before the first reconnect, doubled on every failed attempt
+        @param max_reconnect_delay: Upper bound of the reconnect delay in seconds
+        @param ping_interval: Seconds between two WebSocket pings on an idle connection
+        @param connect_timeout: Timeout of the connection handshake in seconds
+        """
+        try:
+            import websocket
+        except ImportError:
+            raise ImportError("The result stream requires the websocket-client package (pip install websocket-client).")
+        self._websocket = websocket
+
+        self.url = url or self.DEFAULT_URL
+        self.headers = [f"Authorization: Key {api_key}"] if api_key else []
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.ping_interval = ping_interval
+        self.connect_timeout = connect_timeout
+
+        self.generation = 0
+        self._wanted: Set[int] = set()
+        self._subscribed: Dict[int, int] = {}  # measurement ID -> generation it was subscribed in
+        self._subscriptions_changed = False
+        self._lock = threading.Lock()
+        self._connected = threading.Event()
+        self._stopped = threading.Event()
+        self._connection = None
+        logging.info(f"ResultStream initialized for '{self.url}'.")
+
+    @property
+    def connected(self) -> bool:
+        """True while the connection is up."""
+        return self._connected.is_set()
+
+    def streaming(self) -> Dict[int, int]:
+        """
+        Returns the measurements that are subscribed on the current connection.
+
+        @return: Dictionary of measurement ID to the generation of the connection it was subscribed
+                 on, a changed generation means results may have been missed in between
+        """
+        with self._lock:
+            return dict(self._subscribed) if self._connected.is_set() else {}
+
+    def subscribe(self, measurement_ids: Iterable[Any]):
+        """
+        Sets the measurements to receive results for, applied on the running connection.
+
+        @param measurement_ids: Measurement IDs, replacing the previous ones
+        """
+        with self._lock:
+            self._wanted = {int(measurement_id) for measurement_id in measurement_ids}
+            self._subscriptions_changed = True
+
+    def run(self, on_result: Callable[[Dict[str, Any]], None]):
+        """
+        Receives results until stop() is called, reconnecting after every disconnect.
+
+        @param on_result: Called on the stream thread with every received result
+        """
+        delay = self.reconnect_delay
+        while not self._stopped.is_set():
+            try:
+                self._connection = self._websocket.create_connection(self.url, timeout=self.connect_timeout, header=self.headers)
+                self._connection.settimeout(self.RECEIVE_TIMEOUT)
+                with self._lock:
+                    self._subscribed = {}
+                    self._subscriptions_changed = True
+                    self.generation += 1
+                    self._connected.set()
+                logging.info(f"Connected to the result stream '{self.url}'.")
+                delay = self.reconnect_delay
+                self._receive(on_result)
+            except Exception as e:
+                if not self._stopped.is_set():
+                    logging.warning(f"Result stream disconnected: {e}")
+            finally:
+                self._disconnect()
+
+            if not self._stopped.is_set():
+                wait = delay + random.uniform(0, delay / 2)
+                logging.info(f"Reconnecting to the result stream in {wait:.1f}s.")
+                self._stopped.wait(wait)
+                delay = min(delay * 2, self.max_reconnect_delay)
+
+    def stop(self):
+        """
+        Closes the connection and makes run() return.
+        """
+        self._stopped.set()
+        self._disconnect()
+
+    def _receive(self, on_result: Callable[[Dict[str, Any]], None]):
+        """Receive loop of one connection, returns when it is closed or stop() is called."""
+        last_activity = time.monotonic()
+        while not self._stopped.is_set():
+            self._sync_subscriptions()
+            try:
+                message = self._connection.recv()
+            except self._websocket.WebSocketTimeoutException:
+                if time.monotonic() - last_activity >= self.ping_interval:
+                    self._connection.ping()
+                    last_activity = time.monotonic()
+                continue
+            last_activity = time.monotonic()
+            if not message:
+                raise ConnectionError("connection closed by the server")
+
+            try:
+                message_type, payload = json.loads(message)
+            except ValueError as e:
+                logging.warning(f"Ignoring malformed stream message: {e}")
+                continue
+
+            if message_type == "atlas_result":
+                try:
+                    on_result(payload)
+                except Exception as e:
+                    logging.error(f"Error handling streamed result: {e}")
+            elif message_type == "atlas_subscribed":
+                logging.debug(f"Stream subscription confirmed: {payload}")
+            elif message_type == "atlas_error":
+                logging.error(f"Result stream error: {payload}")
+
+    def _sync_subscriptions(self):
+        """Sends subscribe and unsubscribe messages for changed measurements."""
+        with self._lock:
+            if not self._subscriptions_changed:
+                return
+            self._subscriptions_changed = False
+            added = self._wanted - self._subscribed.keys()
+            removed = self._subscribed.keys() - self._wanted
+        for measurement_id in sorted(added):
+            self._connection.send(json.dumps(["atlas_subscribe", {"streamType": "result", "msm": measurement_id}]))
+            logging.info(f"ID: {measurement_id} - subscribed to the result stream.")
+        for measurement_id in sorted(removed):
+            self._connection.send(json.dumps(["atlas_unsubscribe", {"streamType": "result", "msm": measurement_id}]))
+            logging.info(f"ID: {measurement_id} - unsubscribed from the result stream.")
+        if added or removed:
+            with self._lock:
+                for measurement_id in added:
+                    self._subscribed[measurement_id] = self.generation
+                for measurement_id in removed:
+                    self._subscribed.pop(measurement_id, None)
+
+    def _disconnect(self):
+        """Closes the current connection, if any."""
+        with self._lock:
+            self._connected.clear()
+            self._subscribed = {}
+            connection, self._connection = self._connection, None
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception as e:
+                logging.debug(f"Error closing the result stream: {e}")
@@ -0,0 +1,145 @@
+import re
+import logging
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Tuple
+
+_DURATION = re.compile(r"^\s*(\d+)\s*([smhdw]?)\s*$")
+_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+class RetentionPolicy(NamedTuple):
+    """
+    Retention of one policy: how long raw points are kept and the downsampled tiers after them.
+    """
+    name: str
+    seconds: int  # retention of the raw points, also the fetch cutoff
+    tiers: Tuple[Tuple[int, int], ...] = ()  # (aggregation window, retention) in seconds per tier
+
+
+class RetentionPolicies:
+    """
+    Registry of the retention policies a measurement can be registered with.
+
+    The policies are parsed once from the [RetentionPolicies] section of the configuration and
+    shared by the bucket provisioning, the ingest cutoff, the backfill window and the input
+    checks of the GUI and the command line. A policy value is the retention of the raw points,
+    optionally followed by downsampling tiers as <window>:<retention>, e.g.
+
+        90 days = 7d, 5m:30d, 1h:90d
+
+    keeps raw points for 7 days, 5 minute means for 30 days and hourly means for 90 days.
+    Durations are seconds or a number with one of the units s, m, h, d and w.
+
+    Looking up an unknown policy raises a KeyError instead of falling back to a retention of 0,
+    which would create buckets that keep nothing and drop every result after transforming it.
+    """
+
+    DEFAULTS = {"24 hours": "24h", "7 days": "7d", "14 days": "14d"}
+
+    def __init__(self, policies: Iterable[RetentionPolicy]):
+        """
+        Initializes the RetentionPolicies.
+
+        @param policies: Retention policies, in the order they are offered
+        """
+        self._policies: Dict[str, RetentionPolicy] = {policy.name: policy for policy in policies}
+        if not self._policies:
+            raise ValueError("At least one retention policy is required.")
+
+    @staticmethod
+    def parse_duration(value: str) -> int:
+        """
+        Parses a duration such as 86400, 90m, 24h, 7d or 2w.
+
+        @param value: Duration
+        @return: Seconds
+        @raise ValueError: If the duration is malformed or not positive
+        """
+        match = _DURATION.match(value)
+        if match is None or int(match.group(1)) <= 0:
+            raise ValueError(f"Invalid duration '{value}', expected a positive number with an optional unit s, m, h, d or w.")
+        return int(match.group(1)) * _UNITS[match.group(2)]
+
+    @staticmethod
+    def format_duration(seconds: int) -> str:
+        """
+        Formats seconds as a duration with the largest unit that divides them, e.g. 5m or 1h.
+
+        @param seconds: Positive number of seconds
+        @return: Duration, also a valid Flux duration literal
+        """
+        for unit in ("w", "d", "h", "m"):
+            if seconds % _UNITS[unit] == 0:
+                return f"{seconds // _UNITS[unit]}{unit}"
+        return f"{seconds}s"
+
+    @classmethod
+    def parse(cls, name: str, value: str) -> RetentionPolicy:
+        """
+        Parses one policy definition.
+
+        @param name: Policy name as stored in the measurement registry
+        @param value: Raw retention, optionally followed by <window>:<retention> tiers
+        @return: RetentionPolicy
+        @raise ValueError: If the definition is malformed
+        """
+        parts = [part for part in value.split(",") if part.strip()]
+        if not parts:
+            raise ValueError(f"Retention policy '{name}' has no duration.")
+        seconds = cls.parse_duration(parts[0])
+        tiers = []
+        for part in parts[1:]:
+            window, _, retention = part.partition(":")
+            tier = (cls.parse_duration(window), cls.parse_duration(retention))
+            if tier[0] >= seconds:
+                raise ValueError(f"Retention policy '{name}': a tier window must be shorter than the raw retention it is computed from.")
+            if tier[1] <= seconds or (tiers and tier[1] <= tiers[-1][1]):
+                raise ValueError(f"Retention policy '{name}': every tier must keep its data longer than the one before.")
+            tiers.append(tier)
+        return RetentionPolicy(name, seconds, tuple(tiers))
+
+    @classmethod
+    def from_mapping(cls, definitions: Mapping[str, str]) -> "RetentionPolicies":
+        """
+        Builds the registry from policy definitions, e.g. a configuration section.
+
+        @param definitions: Dictionary of policy name to definition, empty uses DEFAULTS
+        @return: RetentionPolicies
+        @raise ValueError: If a definition is malformed
+        """
+        registry = cls(cls.parse(name.strip(), value) for name, value in (definitions or cls.DEFAULTS).items())
+        logging.debug(f"Retention policies: {', '.join(registry.names())}")
+        return registry
+
+    def names(self) -> List[str]:
+        """
+        Returns the names of all policies.
+
+        @return: Policy names in definition order
+        """
+        return list(self._policies)
+
+    def get(self, name: str) -> RetentionPolicy:
+        """
+        Returns a policy.
+
+        @param name: Policy name
+        @return: RetentionPolicy
+        @raise KeyError: If the policy is not defined
+        """
+        policy = self._policies.get(name)
+        if policy is None:
+            raise KeyError(f"Unknown retention policy '{name}', defined are: {', '.join(self._policies)}")
+        return policy
+
+    def seconds(self, name: str) -> int:
+        """
+        Returns how long raw points of a policy are kept, which is also the cutoff for fetching them.
+
+        @param name: Policy name
+        @return: Retention of the raw points in seconds
+        @raise KeyError: If the policy is not defined
+        """
+        return self.get(name).seconds
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._policies
@@ -0,0 +1,296 @@
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from modules.Metrics import Metrics
+from modules.QuantileSketch import QuantileSketch
+
+
+class RollupStore:
+    """
+    Local per-minute latency rollups of ping measurements with a cached query API.
+
+    While ingesting, the worker collects count, sum, min, max, sent and received packets and a
+    QuantileSketch of the average latency of every result per target and minute, and stores
+    them once their window is spooled, merged into the rows already stored. The rows live in a
+    separate SQLite file and expire with the retention policy of their measurement. Merging is
+    not idempotent, so a store that may be repeated, such as a backfill chunk after a crash
+    before its checkpoint, names its source and a source is only merged once.
+
+    query() and series() answer questions like "p95 of AS 3333 over the last hour" by merging
+    the minute rows of the window. Their results are kept in an LRU cache that is invalidated
+    per ASN and measurement whenever new rollups of them are stored, and as a whole whenever
+    another connection, e.g. a backfill process, commits to the rollup file, as told by SQLite's
+    data_version. Repeated dashboard and alert queries cost one pragma and never touch InfluxDB.
+    """
+
+    BUCKET_SECONDS = 60
+
+    def __init__(self, path: str, relative_accuracy: float = 0.01, cache_size: int = 1024, prune_interval: float = 300.0, metrics: Optional[Metrics] = None):
+        """
+        Initializes the RollupStore.
+
+        @param path: Path to the SQLite rollup file
+        @param relative_accuracy: Relative accuracy of the quantile sketches
+        @param cache_size: Maximum number of cached query results
+        @param prune_interval: Minimum seconds between two deletions of expired rollups
+        @param metrics: Metrics registry for the cache hit rate, a private one is created if None
+        """
+        self.path = path
+        self.relative_accuracy = relative_accuracy
+        self.cache_size = cache_size
+        self.prune_interval = prune_interval
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._initialize_store()
+        self._cache: "OrderedDict[tuple, Tuple[tuple, Any]]" = OrderedDict()
+        self._versions: Dict[tuple, int] = {}
+        self._next_prune = 0.0
+
+        metrics = metrics or Metrics()
+        self._cache_requests = metrics.counter("rollup_query_cache_total", "Rollup queries by cache result.", ("result",))
+        logging.info(f"RollupStore initialized at '{path}'.")
+
+    def _initialize_store(self):
+        """Initialize the rollup file."""
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL;")
+            self._conn.execute("PRAGMA synchronous=NORMAL;")  # rollups can be rebuilt, they need no fsync per commit
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS latency_rollups (
+                    measurement_id TEXT,
+                    minute INTEGER,
+                    target TEXT,
+                    asn TEXT,
+                    count INTEGER,
+                    sum REAL,
+                    min REAL,
+                    max REAL,
+                    sent INTEGER,
+                    rcvd INTEGER,
+                    sketch BLOB,
+                    expires_at INTEGER,
+                    PRIMARY KEY (measurement_id, minute, target)
+                ) WITHOUT ROWID;
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS rollup_sources (
+                    source TEXT PRIMARY KEY,
+                    expires_at INTEGER
+                ) WITHOUT ROWID;
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS latency_rollups_asn ON latency_rollups (asn, minute);")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS latency_rollups_expiry ON latency_rollups (expires_at);")
+            self._conn.commit()
+
+    def collect(self, results: Iterable[Dict[str, Any]], partial: Optional[Dict[tuple, list]] = None) -> Dict[tuple, list]:
+        """
+        Aggregates ping results per target and minute in memory, without storing them.
+
+        @param results: Ping measurement results
+        @param partial: Aggregates of earlier batches to add to, a new dictionary is created if None
+        @return: Dictionary of (target, minute) to [count, sum, min, max, sent, rcvd, sketch]
+        """
+        partial = {} if partial is None else partial
+        for result in results:
+            key = (str(result.get("dst_addr", "unknown")), result.get("timestamp", 0) // self.BUCKET_SECONDS * self.BUCKET_SECONDS)
+            rollup = partial.get(key)
+            if rollup is None:
+                rollup = partial[key] = [0, 0.0, None, None, 0, 0, QuantileSketch(self.relative_accuracy)]
+            rollup[4] += result.get("sent") or 0
+            rollup[5] += result.get("rcvd") or 0
+            latency = result.get("avg")
+            if latency is None or latency < 0:
+                continue  # every packet was lost, there is no latency
+            rollup[0] += 1
+            rollup[1] += latency
+            rollup[2] = latency if rollup[2] is None else min(rollup[2], latency)
+            rollup[3] = latency if rollup[3] is None else max(rollup[3], latency)
+            rollup[6].add(latency)
+        return partial
+
+    def store(self, measurement_id: str, asn: str, retention_seconds: int, partial: Dict[tuple, list], source: Optional[str] = None):
+        """
+        Merges collected aggregates into the stored rollups in one transaction.
+
+        @param measurement_id: ID of the measurement
+        @param asn: ASN of the measurement
+        @param retention_seconds: Retention period of the measurement, the rollups expire with it
+        @param partial: Aggregates returned by collect()
+        @param source: Unique name of the results, e.g. a backfill chunk, nothing is merged if it was stored before
+        """
+        if not partial:
+            return
+        try:
+            with self._lock:
+                with self._conn:
+                    if source is not None:
+                        expires_at = max(minute for _, minute in partial) + retention_seconds
+                        if not self._conn.execute("INSERT OR IGNORE INTO rollup_sources VALUES (?, ?);", (source, expires_at)).rowcount:
+                            logging.info(f"Rollups of {source} are already stored.")
+                            return
+                    rows = []
+                    for (target, minute), (count, total, low, high, sent, rcvd, sketch) in partial.items():
+                        stored = self._conn.execute("""
+                            SELECT count, sum, min, max, sent, rcvd, sketch FROM latency_rollups
+                            WHERE measurement_id = ? AND minute = ? AND target = ?;
+                        """, (measurement_id, minute, target)).fetchone()
+                        if stored is not None:
+                            sketch.merge(QuantileSketch.from_bytes(stored[6], self.relative_accuracy))
+                            count, total, sent, rcvd = count + stored[0], total + stored[1], sent + stored[4], rcvd + stored[5]
+                            low = min(value for value in (low, stored[2]) if value is not None) if low is not None or stored[2] is not None else None
+                            high = max(value for value in (high, stored[3]) if value is not None) if high is not None or stored[3] is not None else None
+                        rows.append((measurement_id, minute, target, asn, count, total, low, high, sent, rcvd, sketch.to_bytes(), minute + retention_seconds))
+                    self._conn.executemany("INSERT OR REPLACE INTO latency_rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);", rows)
+                for selector in (("all",), ("asn", asn), ("measurement", measurement_id)):
+                    self._versions[selector] = self._versions.get(selector, 0) + 1
+        except Exception as e:
+            logging.error(f"Error storing rollups of measurement {measurement_id}: {e}")
+            return
+        if time.time() >= self._next_prune:
+            self.prune()
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """
+        Deletes the rollups that are past the retention period of their measurement.
+
+        @param now: Current unix time
+        @return: Number of deleted rollups
+        """
+        now = time.time() if now is None else now
+        self._next_prune = now + self.prune_interval
+        try:
+            with self._lock:
+                with self._conn:
+                    deleted = self._conn.execute("DELETE FROM latency_rollups WHERE expires_at < ?;", (int(now),)).rowcount
+                    self._conn.execute("DELETE FROM rollup_sources WHERE expires_at < ?;", (int(now),))
+            if deleted:
+                logging.debug(f"Pruned {deleted} expired rollups.")
+            return deleted
+        except Exception as e:
+            logging.error(f"Error pruning rollups: {e}")
+            return 0
+
+    def query(self, asn: Optional[str] = None, measurement_id: Optional[str] = None, target: Optional[str] = None, seconds: int = 3600, quantiles: Sequence[float] = (0.5, 0.95, 0.99), now: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Summarizes the latency of an ASN, a measurement or everything over the last seconds.
+
+        @param asn: Only measurements of this ASN
+        @param measurement_id: Only this measurement, takes precedence over asn
+        @param target: Only this target address
+        @param seconds: Length of the window ending now, extended to whole minutes
+        @param quantiles: Quantiles to estimate, returned as p50, p95, ...
+        @param now: Current unix time
+        @return: Dictionary with start, stop, count, mean, min, max, loss_ratio and the quantiles, None values if there is no data
+        """
+        start, stop = self._window(seconds, now)
+        return self._cached(("query", asn, measurement_id, target, start, stop, tuple(quantiles)), asn, measurement_id,
+                            lambda: self._summarize(self._rows(asn, measurement_id, target, start, stop), start, stop, quantiles))
+
+    def series(self, asn: Optional[str] = None, measurement_id: Optional[str] = None, target: Optional[str] = None, seconds: int = 3600, step: int = 300, quantiles: Sequence[float] = (0.95,), now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Returns the latency of an ASN, a measurement or everything per step over the last seconds.
+
+        @param asn: Only measurements of this ASN
+        @param measurement_id: Only this measurement, takes precedence over asn
+        @param target: Only this target address
+        @param seconds: Length of the window ending now, extended to whole minutes
+        @param step: Seconds per point, rounded to whole minutes
+        @param quantiles: Quantiles to estimate per point
+        @param now: Current unix time
+        @return: One summary like query() returns per step that has data, oldest first
+        """
+        start, stop = self._window(seconds, now)
+        step = max(1, round(step / self.BUCKET_SECONDS)) * self.BUCKET_SECONDS
+
+        def compute() -> List[Dict[str, Any]]:
+            steps: Dict[int, list] = {}
+            for row in self._rows(asn, measurement_id, target, start, stop):
+                steps.setdefault(start + (row[0] - start) // step * step, []).append(row)
+            return [self._summarize(rows, step_start, min(stop, step_start + step), quantiles) for step_start, rows in sorted(steps.items())]
+
+        return self._cached(("series", asn, measurement_id, target, start, stop, step, tuple(quantiles)), asn, measurement_id, compute)
+
+    def close(self):
+        """
+        Closes the rollup file.
+        """
+        with self._lock:
+            self._conn.close()
+
+    def _window(self, seconds: int, now: Optional[float]) -> Tuple[int, int]:
+        """Returns the minute aligned [start, stop) window of the last seconds, including the current minute."""
+        now = time.time() if now is None else now
+        stop = int(now) // self.BUCKET_SECONDS * self.BUCKET_SECONDS + self.BUCKET_SECONDS
+        return stop - max(self.BUCKET_SECONDS, -(-int(seconds) // self.BUCKET_SECONDS * self.BUCKET_SECONDS)), stop
+
+    def _cached(self, key: tuple, asn: Optional[str], measurement_id: Optional[str], compute) -> Any:
+        """Returns a cached result that is still current for its selector, computing it otherwise."""
+        selector = ("measurement", measurement_id) if measurement_id else ("asn", asn) if asn else ("all",)
+        with self._lock:
+            version = (self._data_version(), self._versions.get(selector, 0))
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] == version:
+                self._cache.move_to_end(key)
+                self._cache_requests.inc("hit")
+                return cached[1]
+        self._cache_requests.inc("miss")
+        result = compute()
+        with self._lock:
+            self._cache[key] = (version, result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def _data_version(self) -> int:
+        """Returns the SQLite data version of the rollup file, it changes with every commit of another connection."""
+        try:
+            return self._conn.execute("PRAGMA data_version;").fetchone()[0]
+        except Exception as e:
+            logging.error(f"Error reading the data version of the rollups: {e}")
+            return -1
+
+    def _rows(self, asn: Optional[str], measurement_id: Optional[str], target: Optional[str], start: int, stop: int) -> List[tuple]:
+        """Reads the minute rows of a window, with the narrowest index for the selector."""
+        conditions, parameters = ["minute >= ?", "minute < ?"], [start, stop]
+        if measurement_id:
+            conditions.append("measurement_id = ?")
+            parameters.append(measurement_id)
+        elif asn:
+            conditions.append("asn = ?")
+            parameters.append(asn)
+        if target:
+            conditions.append("target = ?")
+            parameters.append(target)
+        with self._lock:
+            return self._conn.execute(f"SELECT minute, count, sum, min, max, sent, rcvd, sketch FROM latency_rollups WHERE {' AND '.join(conditions)};", parameters).fetchall()
+
+    def _summarize(self, rows: List[tuple], start: int, stop: int, quantiles: Sequence[float]) -> Dict[str, Any]:
+        """Merges minute rows into one summary."""
+        sketch = QuantileSketch(self.relative_accuracy)
+        count, total, sent, rcvd = 0, 0.0, 0, 0
+        low = high = None
+        for _, row_count, row_sum, row_min, row_max, row_sent, row_rcvd, row_sketch in rows:
+            count += row_count
+            total += row_sum
+            sent += row_sent
+            rcvd += row_rcvd
+            if row_min is not None:
+                low = row_min if low is None else min(low, row_min)
+                high = row_max if high is None else max(high, row_max)
+            sketch.merge(QuantileSketch.from_bytes(row_sketch, self.relative_accuracy))
+        summary = {
+            "start": start,
+            "stop": stop,
+            "count": count,
+            "mean": total / count if count else None,
+            "min": low,
+            "max": high,
+            "loss_ratio": 1 - rcvd / sent if sent else None,
+        }
+        for q in quantiles:
+            summary[f"p{q * 100:g}"] = sketch.quantile(q)
+        return summary
@@ -1,21 +1,78 @@
 from ast import List
 import sqlite3
 import logging
+import threading
+from typing import Dict, Iterable, Set, Tuple
 
 class SQLiteManager:
     """
     Manages SQLite database operations.
+
+    Every thread gets one long-lived connection in WAL mode, so readers (e.g. the GUI) and the
+    worker no longer block each other and a commit costs one WAL append instead of a full fsync
+    of the database file.
+
+    The leases and workers tables let several worker processes share the measurement registry,
+    each measurement is leased to exactly one live worker at a time. The backfill_chunks table
+    holds the time chunks of historical backfills and whether each one is stored yet. Next to
+    the watermark per measurement in last_processed, probe_watermarks holds the newest processed
+    timestamp of every probe that reported within the late tolerance of the worker. The
+    measurement_metadata table caches the RIPE Atlas metadata (type, interval, target) of
+    measurements, so bulk registration fetches it only once per measurement.
     """
 
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, busy_timeout: float = 30.0, cache_size_kib: int = 8192, journal_mode: str = "WAL"):
         """
         Initialize the SQLite database.
 
         @param db_path: Path to the SQLite database file
+        @param busy_timeout: Seconds a statement waits for a lock held by another connection
+        @param cache_size_kib: Page cache size per connection in KiB
+        @param journal_mode: SQLite journal mode, WAL only works if all processes run on the same host
         """
         self.db_path = db_path
+        self.journal_mode = journal_mode
+        self.busy_timeout = busy_timeout
+        self.cache_size_kib = cache_size_kib
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
         self._initialize_database()
 
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Returns the connection of the calling thread, opening and tuning it on first use.
+
+        @return: sqlite3 connection owned by the current thread
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # check_same_thread is off only so close() may run on another thread, statements stay per thread
+            conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, check_same_thread=False)
+            conn.execute(f"PRAGMA journal_mode={self.journal_mode};")
+            conn.execute("PRAGMA synchronous=NORMAL;")  # durable in WAL mode except for the last commits on power loss
+            conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kib)};")
+            conn.execute("PRAGMA temp_store=MEMORY;")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        """
+        Close all connections opened by this manager.
+
+        Must only be called when no other thread uses the manager anymore.
+        """
+        with self._connections_lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except Exception as e:
+                    logging.warning(f"Error closing SQLite connection: {e}")
+            self._connections.clear()
+        self._local = threading.local()
+
     def update_last_processed(self, measurement_id: str, timestamp: int):
         """
         Updates the last processed timestamp for a measurement.
@@ -24,7 +81,7 @@ class SQLiteManager:
         @param timestamp: The new last processed timestamp
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     INSERT OR REPLACE INTO last_processed (measurement_id, last_timestamp)
@@ -36,10 +93,28 @@ class SQLiteManager:
             logging.error(f"Error updating last processed for {measurement_id}: {e}")
 
 
+    def update_last_processed_many(self, timestamps: Dict[str, int]):
+        """
+        Updates the last processed timestamps of several measurements in one transaction.
+
+        @param timestamps: Dictionary of measurement ID to new last processed timestamp
+        """
+        if not timestamps:
+            return
+        try:
+            with self._connection() as conn:
+                conn.executemany("""
+                    INSERT OR REPLACE INTO last_processed (measurement_id, last_timestamp)
+                    VALUES (?, ?);
+                """, list(timestamps.items()))
+            logging.info(f"Updated last processed timestamps for {len(timestamps)} measurements.")
+        except Exception as e:
+            logging.error(f"Error updating last processed timestamps: {e}")
+
     def _initialize_database(self):
         """Initialize the database with required tables."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     CREATE TABLE IF NOT EXISTS measurements (
@@ -58,6 +133,49 @@ class SQLiteManager:
                         last_timestamp INTEGER
                     );
                 """)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS workers (
+                        worker_id TEXT PRIMARY KEY,
+                        heartbeat REAL
+                    );
+                """)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS leases (
+                        measurement_id TEXT PRIMARY KEY,
+                        worker_id TEXT,
+                        expires_at REAL
+                    );
+                """)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS probe_watermarks (
+                        measurement_id TEXT,
+                        prb_id INTEGER,
+                        last_timestamp INTEGER,
+                        PRIMARY KEY (measurement_id, prb_id)
+                    ) WITHOUT ROWID;
+                """)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS measurement_metadata (
+                        measurement_id TEXT PRIMARY KEY,
+                        type TEXT,
+                        interval INTEGER,
+                        target_asn TEXT,
+                        target TEXT,
+                        description TEXT,
+                        is_oneoff INTEGER,
+                        fetched_at REAL
+                    );
+                """)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS backfill_chunks (
+                        measurement_id TEXT,
+                        chunk_start INTEGER,
+                        chunk_stop INTEGER,
+                        done INTEGER DEFAULT 0,
+                        results INTEGER DEFAULT 0,
+                        PRIMARY KEY (measurement_id, chunk_start)
+                    );
+                """)
                 conn.commit()
             logging.info("Database initialized successfully.")
         except Exception as e:
@@ -73,9 +191,10 @@ class SQLiteManager:
         @param retention_policy: Data retention policy
         @param interval: Measurement interval in seconds
         @param measurement_type: Type of measurement (Ping, Traceroute, etc.)
+        @return: True if the measurement is stored, also if it was already registered
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("""
                     INSERT OR IGNORE INTO measurements (measurement_id, asn, bucket_name, retention_policy, interval, measurement_type)
@@ -83,8 +202,69 @@ class SQLiteManager:
                 """, (measurement_id, asn, bucket_name, retention_policy, interval, measurement_type))
                 conn.commit()
                 logging.info(f"Measurement {measurement_id} added to database.")
+                return True
         except Exception as e:
             logging.error(f"Error adding measurement {measurement_id}: {e}")
+            return False
+
+    def add_measurements(self, measurements: Iterable[Tuple]) -> int:
+        """
+        Add many measurements in one transaction, measurements that are already registered are kept.
+
+        @param measurements: (measurement_id, asn, bucket_name, retention_policy, interval, measurement_type) tuples
+        @return: Number of newly added measurements
+        """
+        try:
+            with self._connection() as conn:
+                before = conn.total_changes
+                conn.executemany("""
+                    INSERT OR IGNORE INTO measurements (measurement_id, asn, bucket_name, retention_policy, interval, measurement_type)
+                    VALUES (?, ?, ?, ?, ?, ?);
+                """, measurements)
+                added = conn.total_changes - before
+            logging.info(f"{added} measurements added to database.")
+            return added
+        except Exception as e:
+            logging.error(f"Error adding measurements: {e}")
+            return 0
+
+    def get_measurement_metadata(self, measurement_ids: Iterable[str]) -> Dict[str, Tuple]:
+        """
+        Get the cached RIPE Atlas metadata of measurements.
+
+        @param measurement_ids: Measurement IDs
+        @return: Dictionary of measurement ID to (type, interval, target_asn, target, description, is_oneoff), uncached ones are missing
+        """
+        measurement_ids = list(measurement_ids)
+        metadata = {}
+        try:
+            with self._connection() as conn:
+                # stays below the default limit of 999 bound parameters
+                for offset in range(0, len(measurement_ids), 900):
+                    part = measurement_ids[offset:offset + 900]
+                    cursor = conn.execute(f"""
+                        SELECT measurement_id, type, interval, target_asn, target, description, is_oneoff
+                        FROM measurement_metadata WHERE measurement_id IN ({",".join("?" * len(part))});
+                    """, part)
+                    metadata.update((row[0], row[1:]) for row in cursor)
+        except Exception as e:
+            logging.error(f"Error fetching measurement metadata: {e}")
+        return metadata
+
+    def store_measurement_metadata(self, metadata: Iterable[Tuple]):
+        """
+        Cache RIPE Atlas metadata of measurements, replacing older entries.
+
+        @param metadata: (measurement_id, type, interval, target_asn, target, description, is_oneoff, fetched_at) tuples
+        """
+        try:
+            with self._connection() as conn:
+                conn.executemany("""
+                    INSERT OR REPLACE INTO measurement_metadata (measurement_id, type, interval, target_asn, target, description, is_oneoff, fetched_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+                """, metadata)
+        except Exception as e:
+            logging.error(f"Error storing measurement metadata: {e}")
 
     def get_measurements(self) -> List:
         """
@@ -93,7 +273,7 @@ class SQLiteManager:
         @return: List of measurement records
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("SELECT * FROM measurements;")
                 return cursor.fetchall()
@@ -109,7 +289,7 @@ class SQLiteManager:
         @return: Last processed timestamp or 0 if not found
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute("SELECT last_timestamp FROM last_processed WHERE measurement_id = ?;", (measurement_id,))
                 result = cursor.fetchone()
@@ -117,3 +297,212 @@ class SQLiteManager:
         except Exception as e:
             logging.error(f"Error fetching last processed timestamp for {measurement_id}: {e}")
             return 0
+
+    def get_all_last_processed(self) -> Dict[str, int]:
+        """
+        Get the last processed timestamps of all measurements in one query.
+
+        @return: Dictionary of measurement ID to last processed timestamp, measurements without one are missing
+        """
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT measurement_id, last_timestamp FROM last_processed;")
+                return dict(cursor.fetchall())
+        except Exception as e:
+            logging.error(f"Error fetching last processed timestamps: {e}")
+            return {}
+
+    def get_probe_watermarks(self, measurement_id: str) -> Dict[int, int]:
+        """
+        Get the last processed timestamps of the probes of a measurement.
+
+        @param measurement_id: Measurement ID
+        @return: Dictionary of probe ID to last processed timestamp
+        """
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT prb_id, last_timestamp FROM probe_watermarks WHERE measurement_id = ?;", (measurement_id,))
+                return dict(cursor.fetchall())
+        except Exception as e:
+            logging.error(f"Error fetching probe watermarks for {measurement_id}: {e}")
+            return {}
+
+    def update_probe_watermarks(self, measurement_id: str, timestamps: Dict[int, int], prune_before: int = 0):
+        """
+        Raise the last processed timestamps of probes and drop the ones that are too old to matter.
+
+        @param measurement_id: Measurement ID
+        @param timestamps: Dictionary of probe ID to last processed timestamp, lower values are ignored
+        @param prune_before: Watermarks at or before this timestamp are deleted
+        """
+        try:
+            with self._connection() as conn:
+                conn.executemany("""
+                    INSERT INTO probe_watermarks (measurement_id, prb_id, last_timestamp) VALUES (?, ?, ?)
+                    ON CONFLICT (measurement_id, prb_id) DO UPDATE SET last_timestamp = MAX(last_timestamp, excluded.last_timestamp);
+                """, [(measurement_id, prb_id, timestamp) for prb_id, timestamp in timestamps.items()])
+                conn.execute("DELETE FROM probe_watermarks WHERE measurement_id = ? AND last_timestamp <= ?;", (measurement_id, prune_before))
+        except Exception as e:
+            logging.error(f"Error updating probe watermarks for {measurement_id}: {e}")
+
+    def raise_last_processed(self, measurement_id: str, timestamp: int):
+        """
+        Raise the last processed timestamp of a measurement to at least the given timestamp.
+
+        @param measurement_id: The measurement ID
+        @param timestamp: Minimum last processed timestamp
+        """
+        try:
+            with self._connection() as conn:
+                conn.execute("""
+                    INSERT INTO last_processed (measurement_id, last_timestamp) VALUES (?, ?)
+                    ON CONFLICT (measurement_id) DO UPDATE SET last_timestamp = MAX(last_timestamp, excluded.last_timestamp);
+                """, (measurement_id, timestamp))
+        except Exception as e:
+            logging.error(f"Error raising last processed timestamp for {measurement_id}: {e}")
+
+    def add_backfill_chunks(self, measurement_id: str, chunks: Iterable[Tuple[int, int]]) -> int:
+        """
+        Store the time chunks of a backfill, chunks that are already stored keep their state.
+
+        @param measurement_id: Measurement ID
+        @param chunks: (chunk_start, chunk_stop) tuples
+        @return: Number of newly stored chunks
+        """
+        try:
+            with self._connection() as conn:
+                cursor = conn.executemany("""
+                    INSERT OR IGNORE INTO backfill_chunks (measurement_id, chunk_start, chunk_stop)
+                    VALUES (?, ?, ?);
+                """, [(measurement_id, chunk_start, chunk_stop) for chunk_start, chunk_stop in chunks])
+                return cursor.rowcount
+        except Exception as e:
+            logging.error(f"Error storing backfill chunks for {measurement_id}: {e}")
+            return 0
+
+    def get_backfill_chunks(self, measurement_id: str, pending_only: bool = False) -> List:
+        """
+        Get the backfill chunks of a measurement, oldest first.
+
+        @param measurement_id: Measurement ID
+        @param pending_only: Only return the chunks that are not done
+        @return: List of (chunk_start, chunk_stop, done, results) records
+        """
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"""
+                    SELECT chunk_start, chunk_stop, done, results FROM backfill_chunks
+                    WHERE measurement_id = ? {"AND done = 0" if pending_only else ""} ORDER BY chunk_start;
+                """, (measurement_id,))
+                return cursor.fetchall()
+        except Exception as e:
+            logging.error(f"Error fetching backfill chunks for {measurement_id}: {e}")
+            return []
+
+    def complete_backfill_chunk(self, measurement_id: str, chunk_start: int, results: int):
+        """
+        Checkpoint a backfill chunk as done.
+
+        @param measurement_id: Measurement ID
+        @param chunk_start: Start of the chunk
+        @param results: Number of results stored for the chunk
+        """
+        try:
+            with self._connection() as conn:
+                conn.execute("UPDATE backfill_chunks SET done = 1, results = ? WHERE measurement_id = ? AND chunk_start = ?;", (results, measurement_id, chunk_start))
+        except Exception as e:
+            logging.error(f"Error completing backfill chunk {chunk_start} of {measurement_id}: {e}")
+
+    def delete_backfill_chunks(self, measurement_id: str):
+        """
+        Delete all backfill chunks of a measurement, e.g. to plan a new backfill.
+
+        @param measurement_id: Measurement ID
+        """
+        try:
+            with self._connection() as conn:
+                conn.execute("DELETE FROM backfill_chunks WHERE measurement_id = ?;", (measurement_id,))
+        except Exception as e:
+            logging.error(f"Error deleting backfill chunks for {measurement_id}: {e}")
+
+    def get_data_version(self) -> int:
+        """
+        Get the SQLite data version of the calling thread's connection.
+
+        The value changes whenever another connection, in this or another process, commits a change
+        to the database, which makes it a cheap way to detect new or removed measurements.
+
+        @return: Current data version, or -1 if it cannot be read
+        """
+        try:
+            return self._connection().execute("PRAGMA data_version;").fetchone()[0]
+        except Exception as e:
+            logging.error(f"Error reading data version: {e}")
+            return -1
+
+    def rebalance_leases(self, worker_id: str, lease_ttl: float, now: float, busy: Iterable[str] = ()) -> Set[str]:
+        """
+        Renews the leases of a worker and claims or releases leases until it holds its fair share.
+
+        Runs in one IMMEDIATE transaction, so concurrent workers never claim the same measurement.
+        The fair share is the number of measurements divided by the number of workers with a
+        recent heartbeat, rounded up. Leases of busy measurements are never released.
+
+        @param worker_id: ID of the calling worker
+        @param lease_ttl: Seconds a lease and a heartbeat stay valid
+        @param now: Current unix time, must be comparable across all hosts
+        @param busy: Measurement IDs the worker is processing right now
+        @return: Measurement IDs leased by the worker after the rebalance
+        """
+        busy = set(busy)
+        conn = self._connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE;")
+            conn.execute("INSERT OR REPLACE INTO workers (worker_id, heartbeat) VALUES (?, ?);", (worker_id, now))
+            conn.execute("DELETE FROM workers WHERE heartbeat < ?;", (now - 10 * lease_ttl,))
+            conn.execute("DELETE FROM leases WHERE measurement_id NOT IN (SELECT measurement_id FROM measurements);")
+            conn.execute("UPDATE leases SET expires_at = ? WHERE worker_id = ?;", (now + lease_ttl, worker_id))
+
+            live_workers = conn.execute("SELECT COUNT(*) FROM workers WHERE heartbeat >= ?;", (now - lease_ttl,)).fetchone()[0]
+            total = conn.execute("SELECT COUNT(*) FROM measurements;").fetchone()[0]
+            fair_share = -(-total // max(1, live_workers))
+
+            owned = [row[0] for row in conn.execute("SELECT measurement_id FROM leases WHERE worker_id = ? ORDER BY measurement_id;", (worker_id,))]
+            if len(owned) > fair_share:
+                releasable = [measurement_id for measurement_id in reversed(owned) if measurement_id not in busy]
+                release = releasable[:len(owned) - fair_share]
+                conn.executemany("DELETE FROM leases WHERE measurement_id = ? AND worker_id = ?;", [(measurement_id, worker_id) for measurement_id in release])
+                owned = [measurement_id for measurement_id in owned if measurement_id not in set(release)]
+            elif len(owned) < fair_share:
+                claimable = [row[0] for row in conn.execute("""
+                    SELECT m.measurement_id FROM measurements m
+                    LEFT JOIN leases l ON l.measurement_id = m.measurement_id
+                    WHERE l.measurement_id IS NULL OR l.expires_at < ?
+                    ORDER BY m.measurement_id LIMIT ?;
+                """, (now, fair_share - len(owned)))]
+                conn.executemany("INSERT OR REPLACE INTO leases (measurement_id, worker_id, expires_at) VALUES (?, ?, ?);",
+                                 [(measurement_id, worker_id, now + lease_ttl) for measurement_id in claimable])
+                owned += claimable
+            conn.commit()
+            return set(owned)
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Error rebalancing leases of worker {worker_id}: {e}")
+            raise
+
+    def release_leases(self, worker_id: str):
+        """
+        Releases all leases and the heartbeat of a worker, e.g. on shutdown.
+
+        @param worker_id: ID of the worker
+        """
+        try:
+            with self._connection() as conn:
+                conn.execute("DELETE FROM leases WHERE worker_id = ?;", (worker_id,))
+                conn.execute("DELETE FROM workers WHERE worker_id = ?;", (worker_id,))
+            logging.info(f"Released all leases of worker {worker_id}.")
+        except Exception as e:
+            logging.error(f"Error releasing leases of worker {worker_id}: {e}")
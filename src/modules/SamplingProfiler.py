@@ -0,0 +1,114 @@
+import os
+import sys
+import time
+import logging
+import threading
+from collections import Counter
+from typing import Optional
+
+
+class SamplingProfiler:
+    """
+    Low-overhead statistical profiler for a running worker.
+
+    A background thread takes the current stack of every other thread every interval seconds
+    and counts identical stacks. Nothing is hooked into the profiled code, so the overhead only
+    depends on the sampling interval. The counts are kept in the collapsed stack format
+    ("thread;outer;...;inner count" per line) that flamegraph.pl and speedscope read directly,
+    and are written to output_path every dump_interval seconds and on stop().
+    """
+
+    def __init__(self, interval: float = 0.01, output_path: Optional[str] = None, dump_interval: float = 60.0, max_depth: int = 64):
+        """
+        Initializes the SamplingProfiler.
+
+        @param interval: Seconds between two samples
+        @param output_path: File the collapsed stacks are written to, None keeps them only in memory
+        @param dump_interval: Seconds between two writes of output_path
+        @param max_depth: Maximum number of frames kept per stack, from the innermost frame
+        """
+        self.interval = interval
+        self.output_path = output_path
+        self.dump_interval = dump_interval
+        self.max_depth = max_depth
+        self._stacks = Counter()
+        self._samples = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Starts sampling on a background thread.
+        """
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+            logging.info(f"SamplingProfiler started with a {self.interval * 1000:.0f} ms interval.")
+
+    def stop(self):
+        """
+        Stops sampling and writes the collapsed stacks a last time.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.dump()
+
+    def sample(self):
+        """
+        Takes one sample of the stacks of all other threads.
+        """
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            frames = []
+            while frame is not None and len(frames) < self.max_depth:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            frames.append(names.get(ident, str(ident)))
+            stacks.append(";".join(reversed(frames)))
+
+        with self._lock:
+            self._stacks.update(stacks)
+            self._samples += 1
+
+    def collapsed(self) -> str:
+        """
+        Returns the counted stacks in the collapsed stack format, most frequent first.
+
+        @return: One "stack count" line per distinct stack
+        """
+        with self._lock:
+            stacks = self._stacks.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def dump(self):
+        """
+        Writes the collapsed stacks to output_path, replacing the previous dump.
+        """
+        if not self.output_path:
+            return
+        try:
+            temporary_path = f"{self.output_path}.tmp"
+            with open(temporary_path, "w", encoding="utf-8") as file:
+                file.write(self.collapsed())
+            os.replace(temporary_path, self.output_path)
+            logging.debug(f"SamplingProfiler wrote {self._samples} samples to '{self.output_path}'.")
+        except OSError as e:
+            logging.error(f"Error writing profile to '{self.output_path}': {e}")
+
+    def _run(self):
+        """Sampling loop of the background thread."""
+        next_dump = time.monotonic() + self.dump_interval
+        while not self._stopped.wait(self.interval):
+            self.sample()
+            if time.monotonic() >= next_dump:
+                self.dump()
+                next_dump = time.monotonic() + self.dump_interval
@@ -0,0 +1,197 @@
+import time
+import sqlite3
+import logging
+import threading
+from typing import List, Any, Optional
+from modules.BatchWriter import BatchWriter, WriteRejectedError
+from modules.Metrics import Metrics
+
+
+class WriteSpool:
+    """
+    Durable on-disk queue of line protocol batches between the transform and the InfluxDB write.
+
+    The worker appends every batch to the spool, a separate SQLite file with synchronous=FULL,
+    before it advances the watermark. A background drainer replays the spooled batches through
+    the BatchWriter and deletes them once InfluxDB has stored them, so an InfluxDB restart delays
+    the data instead of losing it. The spool refuses new batches while it holds more than
+    max_bytes; the watermark then stays behind and the data is fetched from RIPE Atlas again later.
+    """
+
+    def __init__(self, spool_path: str, writer: BatchWriter, max_bytes: int = 512 * 1024 * 1024, drain_batch: int = 200, retry_interval: float = 5.0, max_retry_interval: float = 300.0, metrics: Optional[Metrics] = None):
+        """
+        Initializes the WriteSpool.
+
+        @param spool_path: Path to the SQLite spool file
+        @param writer: BatchWriter used to replay spooled batches
+        @param max_bytes: Maximum total size of spooled payloads in bytes
+        @param drain_batch: Number of spooled batches replayed together
+        @param retry_interval: Delay in seconds after a failed replay, doubled while replays keep failing
+        @param max_retry_interval: Upper bound of the delay after failed replays
+        @param metrics: Metrics registry for the spool size, a private one is created if None
+        """
+        self.spool_path = spool_path
+        self.writer = writer
+        self.max_bytes = max_bytes
+        self.drain_batch = drain_batch
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._conn = sqlite3.connect(spool_path, timeout=30, check_same_thread=False)
+        self._initialize_spool()
+        self._size = self._conn.execute("SELECT COALESCE(SUM(LENGTH(payload)), 0) FROM spool;").fetchone()[0]
+        metrics = metrics or Metrics()
+        metrics.gauge("write_spool_bytes", "Bytes of line protocol waiting in the spool.").set_function(function=lambda: self._size)
+        logging.info(f"WriteSpool initialized with {self._size} spooled bytes.")
+
+    def _initialize_spool(self):
+        """Initialize the spool file. auto_vacuum must be set before the first table is created."""
+        with self._lock:
+            self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+            self._conn.execute("PRAGMA journal_mode=WAL;")
+            self._conn.execute("PRAGMA synchronous=FULL;")  # a spooled batch must survive a crash before the watermark moves
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS spool (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    bucket TEXT NOT NULL,
+                    payload BLOB NOT NULL,
+                    created REAL NOT NULL
+                );
+            """)
+            self._conn.commit()
+
+    @property
+    def size(self) -> int:
+        """Total size of all spooled payloads in bytes."""
+        return self._size
+
+    def append(self, bucket: str, records: List[Any]) -> bool:
+        """
+        Durably stores a batch of records for a bucket.
+
+        @param bucket: Name of the target bucket
+        @param records: Line protocol lines as bytes or str, or objects with to_line_protocol()
+        @return: True once the batch is on disk, False if the spool is full or the write failed
+        """
+        if not records:
+            return True
+        payload = b"\n".join(self.to_line_protocol(record) for record in records)
+
+        with self._lock:
+            if self._size + len(payload) > self.max_bytes and self._size > 0:
+                logging.warning(f"Spool is full ({self._size} bytes), refusing {len(payload)} bytes for bucket '{bucket}'.")
+                return False
+            try:
+                with self._conn:
+                    self._conn.execute("INSERT INTO spool (bucket, payload, created) VALUES (?, ?, ?);", (bucket, payload, time.time()))
+            except Exception as e:
+                logging.error(f"Error spooling batch for bucket '{bucket}': {e}")
+                return False
+            self._size += len(payload)
+
+        self._wakeup.set()
+        return True
+
+    @staticmethod
+    def to_line_protocol(record: Any) -> bytes:
+        """
+        Converts a record accepted by the InfluxDB write API into a line protocol line.
+
+        @param record: bytes, str or an object with to_line_protocol(), e.g. influxdb_client.Point
+        @return: Line protocol as bytes
+        """
+        if isinstance(record, bytes):
+            return record
+        if isinstance(record, str):
+            return record.encode()
+        return record.to_line_protocol().encode()
+
+    def start(self):
+        """
+        Starts the background drainer.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._drain_loop, name="spool-drainer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """
+        Stops the background drainer. Spooled batches stay on disk for the next start.
+
+        @param timeout: Maximum seconds to wait for the drainer to finish its current round
+        """
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def drain_once(self) -> Optional[bool]:
+        """
+        Replays the oldest spooled batches once.
+
+        @return: True if all replayed batches were stored, False if any failed, None if the spool is empty
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT id, bucket, payload FROM spool ORDER BY id LIMIT ?;", (self.drain_batch,)).fetchall()
+        if not rows:
+            return None
+
+        futures = [self.writer.submit(bucket, payload.split(b"\n")) for _, bucket, payload in rows]
+        stored, failed, rejected = [], [], []
+        for row, future in zip(rows, futures):
+            try:
+                (stored if future.result() else failed).append(row)
+            except WriteRejectedError as e:
+                # the data itself is invalid, keeping it would block the spool forever
+                logging.error(f"Dropping spooled batch {row[0]}: {e}")
+                rejected.append(row)
+
+        done = stored + rejected
+        if done:
+            with self._lock:
+                with self._conn:
+                    self._conn.executemany("DELETE FROM spool WHERE id = ?;", [(row[0],) for row in done])
+                self._size -= sum(len(row[2]) for row in done)
+
+        if stored:
+            logging.debug(f"Replayed {len(stored)} spooled batches.")
+        return not failed
+
+    def compact(self):
+        """
+        Returns the pages of deleted batches to the file system.
+        """
+        with self._lock:
+            free_pages = self._conn.execute("PRAGMA freelist_count;").fetchone()[0]
+            if free_pages:
+                # the pragma frees one page per step and execute() only steps once, executescript() runs it to completion
+                self._conn.executescript("PRAGMA incremental_vacuum;")
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+                released = free_pages - self._conn.execute("PRAGMA freelist_count;").fetchone()[0]
+                logging.debug(f"Spool compacted, released {released} of {free_pages} free pages.")
+
+    def _drain_loop(self):
+        """Drain loop of the background thread."""
+        delay = self.retry_interval
+        while not self._stopped.is_set():
+            self._wakeup.clear()  # cleared before draining, so an append during the round is not missed
+            try:
+                result = self.drain_once()
+            except Exception as e:
+                logging.error(f"Error draining spool: {e}")
+                result = False
+
+            if result is None:
+                self.compact()
+                delay = self.retry_interval
+                self._wakeup.wait()
+            elif result is False:
+                self._stopped.wait(delay)
+                delay = min(delay * 2, self.max_retry_interval)
+            else:
+                delay = self.retry_interval
@@ -1,3 +1,4 @@
-from .RIPEAtlasAPI import RIPEAtlasAPI
-from .DataProcessor import DataProcessor
-from .BucketManager import BucketManager
+# Every class lives in the module of the same name and is imported from it directly, e.g.
+# from modules.SQLiteManager import SQLiteManager. The package does not re-export them, so that
+# importing one module, e.g. modules.SQLiteManager for the GUI, does not load influxdb_client,
+# requests and NumPy for all the others.
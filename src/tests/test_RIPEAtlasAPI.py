@@ -0,0 +1,41 @@
+import json
+import unittest
+from modules.RIPEAtlasAPI import RIPEAtlasAPI
+
+
+def split(text: str, size: int):
+    """Encodes text and splits it into chunks of size bytes, also inside multi-byte characters."""
+    data = text.encode("utf-8")
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class IterJsonArrayTest(unittest.TestCase):
+    """Regression tests of RIPEAtlasAPI.iter_json_array."""
+
+    def test_values_split_at_every_chunk_size(self):
+        text = '[ {"a":"ü"} , 12.5e3 , "x]y" , -0.25 , 7 , true , null , [1, 2] ]'
+        for size in range(1, len(text.encode("utf-8")) + 1):
+            with self.subTest(size=size):
+                self.assertEqual(list(RIPEAtlasAPI.iter_json_array(split(text, size))), json.loads(text))
+
+    def test_number_at_the_end_of_a_chunk(self):
+        self.assertEqual(list(RIPEAtlasAPI.iter_json_array([b"[12", b".5e3, 1", b"0]"])), [12500.0, 10])
+
+    def test_trailing_data_is_rejected(self):
+        for text in ('[1]garbage', '[1] ]', '[1][2]', '[]x'):
+            for size in (1, 2, 64):
+                with self.subTest(text=text, size=size), self.assertRaises(ValueError):
+                    list(RIPEAtlasAPI.iter_json_array(split(text, size)))
+
+    def test_trailing_whitespace_is_accepted(self):
+        self.assertEqual(list(RIPEAtlasAPI.iter_json_array(split('[1, 2] \r\n', 1))), [1, 2])
+
+    def test_malformed_arrays_are_rejected(self):
+        for text in ('[1 2]', '[1,,2]', '[,1]', '[1,]', '[1', '{"a": 1}', '[12.5e]'):
+            for size in (1, 3, 64):
+                with self.subTest(text=text, size=size), self.assertRaises(ValueError):
+                    list(RIPEAtlasAPI.iter_json_array(split(text, size)))
+
+
+if __name__ == "__main__":
+    unittest.main()